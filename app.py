@@ -1,8 +1,20 @@
+import os
+import hmac
+import time
+import pickle
+import threading
 import traceback
-from flask import render_template, request, redirect, url_for
+from flask import render_template, request, redirect, url_for, jsonify
 import logging.config
 from flask import Flask
-from src.create_database import pd_predictions
+from src.create_database import pd_predictions, pd_predictions_compact, pack_key, read_table_version, \
+    read_packed_radices, PACKED_KEY_RADICES
+from src.prediction_cube import load_prediction_cube, GRID_COLUMNS, Prediction
+from src.micro_batcher import MicroBatcher, model_predict_fn
+from src.response_cache import LRUCache, MISSING
+from src.model_bundle import load_bundle, is_bundle
+from src.request_metrics import MetricsRegistry, instrument_engine, prometheus_text
+from src.shared_cube import SharedPredictionCube
 from flask_sqlalchemy import SQLAlchemy
 
 # Initialize the Flask application
@@ -20,6 +32,172 @@ logger.debug('Test log')
 # Initialize the database
 db = SQLAlchemy(app)
 
+# Request counts and latency histograms (total, database, pool checkout and template rendering) served by /metrics
+request_metrics = MetricsRegistry()
+if app.config["METRICS_ENABLED"]:
+    instrument_engine(db.engine, request_metrics)
+
+# Dense in-memory copy of pd_predictions, loaded before the first request (None if disabled or unavailable)
+prediction_cube = None
+
+# With SHARED_CUBE, the copy is published once into a shared memory segment that every worker process maps instead
+shared_cube = SharedPredictionCube(app.config["SHARED_CUBE_DIR"], app.config["SHARED_CUBE_NAME"],
+                                   check_interval=app.config["SHARED_CUBE_CHECK_SECONDS"]) \
+    if app.config["SHARED_CUBE"] else None
+
+# Responses of /add for the most frequent inputs, dropped whenever the predictions table changes (its version row, the
+# same in every worker) or the model file changes. predictions_version only counts this worker's reloads, it is used
+# when the version row cannot be read
+response_cache = LRUCache(maxsize=app.config["RESPONSE_CACHE_SIZE"], ttl=app.config["RESPONSE_CACHE_TTL"])
+predictions_version = 0
+
+# Version (version row and row count) of the predictions table the cube was loaded from. Every worker checks it every
+# PREDICTIONS_CHECK_SECONDS and reloads its cube when the table was loaded again, whichever worker was notified
+loaded_table_version = None
+_table_checked = None
+# Radices the keys of pd_predictions_compact are packed with, read with its version
+packed_radices = PACKED_KEY_RADICES
+_reload_lock = threading.Lock()
+
+
+def predictions_table():
+    """Returns: name of the predictions table selected by PREDICTION_SCHEMA"""
+    return 'pd_predictions_compact' if app.config["PREDICTION_SCHEMA"] == "compact" else 'pd_predictions'
+
+
+@app.before_first_request
+def reload_prediction_cube(force=False):
+    """Loads (or reloads) the prediction cube from the predictions table selected by PREDICTION_SCHEMA
+
+    With SHARED_CUBE, the worker maps the shared segment, and only loads and publishes the table if no worker
+    published it from the same table version and model file yet (or if force is set)
+
+    Returns: PredictionCube or None if the cube is disabled or could not be built
+
+    """
+    global prediction_cube, predictions_version, loaded_table_version, _table_checked, packed_radices
+    predictions_version += 1
+    # Read before the table itself, so that a load finishing in between is picked up by the next check
+    _table_checked = time.monotonic()
+    try:
+        loaded_table_version = read_table_version(db.engine, predictions_table())
+        if app.config["PREDICTION_SCHEMA"] == "compact":
+            packed_radices = read_packed_radices(db.engine)
+    except Exception:
+        loaded_table_version = None
+    if not app.config["PREDICTION_CUBE"]:
+        return None
+    try:
+        if shared_cube is not None:
+            fingerprint = None if loaded_table_version is None else [loaded_table_version, model_mtime()]
+            return shared_cube.publish(lambda: load_prediction_cube(db.engine, schema=app.config["PREDICTION_SCHEMA"]),
+                                       model_version=model_mtime(), fingerprint=fingerprint, force=force)
+        prediction_cube = load_prediction_cube(db.engine, schema=app.config["PREDICTION_SCHEMA"])
+    except Exception:
+        logger.warning("Not able to load the prediction cube, lookups will query the database")
+        prediction_cube = None
+    return prediction_cube
+
+
+def table_version_due():
+    """Returns: whether PREDICTIONS_CHECK_SECONDS elapsed since the predictions table version was last checked"""
+    return _table_checked is None or time.monotonic() - _table_checked >= app.config["PREDICTIONS_CHECK_SECONDS"]
+
+
+def check_table_version():
+    """Reloads the prediction cube if the predictions table changed since the cube was loaded
+
+    Only one thread checks at a time, the others carry on with the current cube
+
+    :return: whether the cube was reloaded
+    """
+    global _table_checked
+    if not table_version_due() or not _reload_lock.acquire(False):
+        return False
+    try:
+        _table_checked = time.monotonic()
+        version = read_table_version(db.engine, predictions_table())
+        if version == loaded_table_version:
+            return False
+        logger.info("%s changed (version and rows %s, was %s), reloading the prediction cube", predictions_table(),
+                    version, loaded_table_version)
+        # Not forced: with SHARED_CUBE, the first worker to see the new version republishes, the others map its segment
+        reload_prediction_cube()
+        return True
+    except Exception:
+        logger.warning("Not able to check the version of the predictions table")
+        return False
+    finally:
+        _reload_lock.release()
+
+
+def current_prediction_cube():
+    """Returns: the prediction cube lookups are answered from (the shared one with SHARED_CUBE), None if none"""
+    if shared_cube is not None:
+        return shared_cube.cube()
+    return prediction_cube
+
+
+# Micro-batcher around the trained model used by /predict, created on the first call
+prediction_batcher = None
+_prediction_batcher_lock = threading.Lock()
+
+
+def get_prediction_batcher():
+    """Loads the trained model object once and wraps it into a MicroBatcher
+
+    Returns: MicroBatcher
+
+    """
+    global prediction_batcher
+    with _prediction_batcher_lock:
+        if prediction_batcher is None:
+            if is_bundle(app.config["MODEL_PATH"]):
+                model = load_bundle(app.config["MODEL_PATH"])
+            else:
+                with open(app.config["MODEL_PATH"], 'rb') as file:
+                    model = pickle.load(file)
+            logger.info("Trained model object loaded from %s", app.config["MODEL_PATH"])
+            prediction_batcher = MicroBatcher(model_predict_fn(model),
+                                              max_batch_size=app.config["PREDICT_MAX_BATCH_SIZE"],
+                                              max_wait_ms=app.config["PREDICT_MAX_WAIT_MS"])
+    return prediction_batcher
+
+
+@app.before_request
+def start_request_metrics():
+    if app.config["METRICS_ENABLED"]:
+        request_metrics.start_request()
+
+
+@app.before_request
+def check_predictions_version():
+    check_table_version()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if app.config["METRICS_ENABLED"]:
+        request_metrics.end_request(request.url_rule.rule if request.url_rule else 'unmatched',
+                                    error=response.status_code >= 500)
+    return response
+
+
+@app.teardown_request
+def record_failed_request_metrics(exception):
+    # after_request is skipped when a view raises, the request is then recorded here as an error
+    if app.config["METRICS_ENABLED"] and request_metrics.current() is not None:
+        request_metrics.end_request(request.url_rule.rule if request.url_rule else 'unmatched', error=True)
+
+
+def render_page(template, **context):
+    """Renders a template, timing it as the rendering part of the request's latency
+
+    :return: rendered html
+    """
+    with request_metrics.track('render'):
+        return render_template(template, **context)
+
 
 @app.route('/')
 def index():
@@ -31,16 +209,78 @@ def index():
     Returns: rendered html template
 
     """
-    print("Index function")
+    logger.debug("Index page requested")
     try:
         #input = db.session.query(pd_predictions).limit(app.config["MAX_ROWS_SHOW"]).all()
         #logger.debug("Index page accessed")
-        prediction = db.session.query(pd_predictions).limit(1)
-        return render_template('index.html', predictions=prediction)
+        # Read from the same table as /add, pd_predictions is stale or missing under the compact schema
+        if app.config["PREDICTION_SCHEMA"] == "compact":
+            prediction = [compact_prediction(row) for row in db.session.query(pd_predictions_compact).limit(1)]
+        else:
+            prediction = db.session.query(pd_predictions).limit(1)
+        return render_page('index.html', predictions=prediction)
     except:
         traceback.print_exc()
         logger.warning("Not able to display tracks, error page returned")
-        return render_template('error.html')
+        request_metrics.mark_error()
+        return render_page('error.html')
+
+
+def compact_prediction(row):
+    """Converts a pd_predictions_compact row to the Prediction displayed by index.html"""
+    return Prediction(y_prob=str(row.y_prob_bp / 100), y_bin=row.y_bin)
+
+
+def lookup_prediction(values):
+    """Finds the stored prediction of one combination of the seven inputs, from the cube when possible
+
+    :param values: tuple of integers in GRID_COLUMNS order
+    :return: list with one Prediction, empty if the combination is not stored
+    """
+    cube = current_prediction_cube()
+    if cube is not None:
+        prediction = cube.lookup(values)
+        if prediction is not None:
+            return prediction
+    if app.config["PREDICTION_SCHEMA"] == "compact":
+        packed_key = pack_key(values, packed_radices)
+        rows = [] if packed_key is None else \
+            db.session.query(pd_predictions_compact).filter(pd_predictions_compact.packed_key == packed_key)
+        return [compact_prediction(row) for row in rows]
+    age_int, sex_int, chest_pain_int, fasting_blood_sugar_int, electrocardiographic_int, induced_angina_int, \
+        thal_int = values
+    rows = db.session.query(pd_predictions).filter(pd_predictions.age == age_int,
+                                                   pd_predictions.sex == sex_int,
+                                                   pd_predictions.chest_pain == chest_pain_int,
+                                                   pd_predictions.fasting_blood_sugar == fasting_blood_sugar_int,
+                                                   pd_predictions.electrocardiographic == electrocardiographic_int,
+                                                   pd_predictions.induced_angina == induced_angina_int,
+                                                   pd_predictions.thal == thal_int)
+    return [Prediction(y_prob=row.y_prob, y_bin=row.y_bin) for row in rows]
+
+
+def model_mtime():
+    """Modification time of the model file, None if it does not exist"""
+    try:
+        return os.path.getmtime(app.config["MODEL_PATH"])
+    except OSError:
+        return None
+
+
+def cache_version():
+    """Version under which cached responses are valid: the predictions table load and the model file
+
+    Derived from the database (or the shared segment), so every worker drops its cached responses when the table is
+    reloaded, not only the worker that was notified
+
+    :return: tuple that changes whenever the predictions are reloaded or a new model is saved
+    """
+    if shared_cube is not None and shared_cube.cube() is not None:
+        # Same in every worker: the segment is replaced whenever the table is republished
+        return shared_cube.generation, shared_cube.model_version
+    if loaded_table_version is None:
+        return ('local', predictions_version), model_mtime()
+    return loaded_table_version, model_mtime()
 
 
 @app.route('/add', methods=['POST'])
@@ -57,18 +297,94 @@ def add_entry():
         electrocardiographic_int = int(request.form['electrocardiographic'])
         induced_angina_int = int(request.form['induced_angina'])
         thal_int = int(request.form['thal'])
-        prediction = db.session.query(pd_predictions).filter(pd_predictions.age == age_int,
-                                                             pd_predictions.sex == sex_int,
-                                                             pd_predictions.chest_pain == chest_pain_int,
-                                                             pd_predictions.fasting_blood_sugar == fasting_blood_sugar_int,
-                                                             pd_predictions.electrocardiographic == electrocardiographic_int,
-                                                             pd_predictions.induced_angina == induced_angina_int,
-                                                             pd_predictions.thal == thal_int)
-
-        return render_template('index.html',predictions=prediction)
+        values = (age_int, sex_int, chest_pain_int, fasting_blood_sugar_int, electrocardiographic_int,
+                  induced_angina_int, thal_int)
+        version = cache_version()
+        cached = response_cache.get(values, version)
+        if cached is MISSING:
+            prediction = lookup_prediction(values)
+            cached = render_page('index.html', predictions=prediction) \
+                if app.config["RESPONSE_CACHE_RENDERED"] else prediction
+            response_cache.put(values, cached, version)
+        if app.config["RESPONSE_CACHE_RENDERED"]:
+            return cached
+        return render_page('index.html', predictions=cached)
     except:
         logger.warning("Not able to display tracks, error page returned")
-        return render_template('error.html')
+        request_metrics.mark_error()
+        return render_page('error.html')
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    """View that reports the size and hit/miss counters of the /add response cache
+
+    :return: JSON with the cache statistics
+    """
+    return jsonify(response_cache.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    """View that reports request counts, error counts and latency histograms per route (with the part of the
+    latency spent in the database, waiting for a pooled connection and rendering), per query type and per pool
+    checkout
+
+    :return: JSON, or the Prometheus text format with ?format=prometheus
+    """
+    report = request_metrics.snapshot()
+    if request.args.get('format') == 'prometheus':
+        return app.response_class(prometheus_text(report), mimetype='text/plain; version=0.0.4')
+    return jsonify(report)
+
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    """View that scores one patient profile (JSON object) or a list of them with the trained model
+
+    :return: JSON with y_prob (in percent) and y_bin, or a list of them
+    """
+    payload = request.get_json(silent=True)
+    records = payload if isinstance(payload, list) else [payload]
+    try:
+        rows = [[int(record[column]) for column in GRID_COLUMNS] for record in records]
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error="Expected integer values for %s" % ", ".join(GRID_COLUMNS)), 400
+
+    try:
+        results = get_prediction_batcher().predict(rows, timeout=app.config["PREDICT_TIMEOUT"])
+    except Exception:
+        logger.warning("Not able to score the submitted profile, error returned")
+        return jsonify(error="Prediction failed"), 500
+
+    predictions = [dict(y_prob=y_prob, y_bin=y_bin) for y_prob, y_bin in results]
+    return jsonify(predictions if isinstance(payload, list) else predictions[0])
+
+
+@app.route('/reload_cube', methods=['POST'])
+def reload_cube():
+    """View that rebuilds the prediction cube after the pd_predictions table has been repopulated
+
+    :return: JSON with the number of predictions held by the cube
+    """
+    if not reload_allowed():
+        logger.warning("Reload of the prediction cube refused to %s", request.remote_addr)
+        return jsonify(error="forbidden"), 403
+    with _reload_lock:
+        cube = reload_prediction_cube(force=True)
+    return jsonify(loaded=cube is not None, rows=0 if cube is None else cube.n_rows)
+
+
+def reload_allowed():
+    """Whether the current request may reload the prediction cube: it must carry RELOAD_TOKEN in X-Reload-Token, or
+    come from this host when no token is configured
+
+    :return: bool
+    """
+    token = app.config["RELOAD_TOKEN"]
+    if token:
+        return hmac.compare_digest(request.headers.get('X-Reload-Token', ''), token)
+    return request.remote_addr in ('127.0.0.1', '::1')
 
 
 if __name__ == '__main__':
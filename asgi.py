@@ -0,0 +1,97 @@
+import sys
+import json
+import app as hc_app
+from src.async_serving import AsyncApp, Response, Saturated
+from src.prediction_cube import GRID_COLUMNS
+from src.response_cache import MISSING
+
+flask_app = hc_app.app
+logger = hc_app.logger
+
+# ASGI entry point (e.g. uvicorn asgi:application). POST /add is answered on the event loop when the response cache
+# holds the rendered page; database lookups and template rendering take an executor thread. Every other request
+# is served by the Flask app on the executor.
+application = AsyncApp(flask_app, max_workers=flask_app.config["ASYNC_MAX_WORKERS"],
+                       max_pending=flask_app.config["ASYNC_MAX_PENDING"])
+
+
+@application.on_startup
+def load_prediction_cube():
+    """Runs the Flask app's before_first_request functions (loading the prediction cube) when the server starts"""
+    with flask_app.app_context():
+        flask_app.try_trigger_before_first_request_functions()
+
+
+def lookup_in_context(values, metrics=None):
+    """Looks up a prediction on an executor thread, in an app context so that the session is removed afterwards
+    (query and pool checkout times are added to the metrics breakdown of the request)"""
+    with flask_app.app_context(), hc_app.request_metrics.attached(metrics):
+        return hc_app.lookup_prediction(values)
+
+
+def check_in_context(metrics=None):
+    """Checks the version of the predictions table on an executor thread, in an app context"""
+    with flask_app.app_context(), hc_app.request_metrics.attached(metrics):
+        return hc_app.check_table_version()
+
+
+def render(request, template, metrics=None, **context):
+    """Renders a template on an executor thread, in a request context so that the templates can build URLs"""
+    with flask_app.request_context(request.wsgi_environ()), hc_app.request_metrics.attached(metrics):
+        return hc_app.render_page(template, **context)
+
+
+@application.route('/add', methods=['POST'])
+async def add_entry(request):
+    """Async version of the Flask /add view, returning the same pages
+
+    :return: Response with the rendered index page, or the error page
+    """
+    # Same breakdown as the Flask /add records: total, database, pool checkout and rendering times
+    metrics = hc_app.request_metrics.new_request() if flask_app.config["METRICS_ENABLED"] else None
+    if not flask_app.got_first_request:
+        await application.run_blocking(load_prediction_cube)
+    if hc_app.table_version_due():
+        await application.run_blocking(check_in_context, metrics)
+    try:
+        values = tuple(int(request.form[column]) for column in GRID_COLUMNS)
+        version = hc_app.cache_version()
+        cached = hc_app.response_cache.get(values, version)
+        if cached is MISSING:
+            cube = hc_app.current_prediction_cube()
+            prediction = cube.lookup(values) if cube is not None else None
+            if prediction is None:
+                prediction = await application.run_blocking(lookup_in_context, values, metrics)
+            cached = await application.run_blocking(render, request, 'index.html', metrics, predictions=prediction) \
+                if flask_app.config["RESPONSE_CACHE_RENDERED"] else prediction
+            hc_app.response_cache.put(values, cached, version)
+        body = cached if flask_app.config["RESPONSE_CACHE_RENDERED"] else \
+            await application.run_blocking(render, request, 'index.html', metrics, predictions=cached)
+        error = False
+    except Saturated:
+        # Answered with 503 by the application
+        raise
+    except Exception:
+        logger.warning("Not able to display tracks, error page returned")
+        body, error = await application.run_blocking(render, request, 'error.html', metrics), True
+    if metrics is not None:
+        hc_app.request_metrics.record_request('/add', metrics, error)
+    return Response(body)
+
+
+@application.route('/executor_stats')
+async def executor_stats(request):
+    """Size of the executor and number of calls pending on it or refused because it was saturated
+
+    :return: Response with the statistics as JSON
+    """
+    return Response(json.dumps(application.stats()), content_type='application/json')
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("The async serving mode needs uvicorn (pip install uvicorn)")
+        sys.exit(1)
+    uvicorn.run(application, host=flask_app.config["HOST"], port=flask_app.config["PORT"], lifespan='on')
@@ -7,6 +7,23 @@ SQLALCHEMY_TRACK_MODIFICATIONS = True
 HOST = "0.0.0.0"
 SQLALCHEMY_ECHO = False  # If true, SQL for queries made will be printed
 MAX_ROWS_SHOW = 10
+PREDICTION_CUBE = True  # If true, /add lookups are answered from an in-memory copy of pd_predictions
+RESPONSE_CACHE_SIZE = 1024  # Number of /add responses kept in memory (least recently used ones are evicted)
+RESPONSE_CACHE_TTL = 300  # Seconds a cached /add response stays valid
+RESPONSE_CACHE_RENDERED = True  # If true, the rendered page is cached, otherwise only the prediction
+METRICS_ENABLED = True  # If true, request, query and pool checkout latencies are collected and served by /metrics
+SHARED_CUBE = False  # If true, the prediction cube is published once into shared memory and mapped by every worker
+SHARED_CUBE_DIR = None  # Directory of the shared segments (default /dev/shm)
+SHARED_CUBE_NAME = "hc_predictions"  # Name of the segments, the same for all the workers of one deployment
+SHARED_CUBE_CHECK_SECONDS = 1  # How often a worker checks whether the shared table was republished
+PREDICTIONS_CHECK_SECONDS = 5  # How often every worker checks the predictions table's version row and reloads its cube
+PREDICTION_SCHEMA = "legacy"  # "compact" reads predictions from pd_predictions_compact instead of pd_predictions
+MODEL_PATH = "data/interim_files/model_bundle"  # Model bundle (scaler and forest, as in score_data) used by /predict
+ASYNC_MAX_WORKERS = 32  # Threads running database lookups and other blocking requests in the asgi.py serving mode
+ASYNC_MAX_PENDING = 512  # Blocking calls queued or running beyond which asgi.py answers 503 (backpressure)
+PREDICT_MAX_BATCH_SIZE = 256  # Largest number of rows scored in one predict_proba call
+PREDICT_MAX_WAIT_MS = 5  # How long the first request of a batch waits for others to join it
+PREDICT_TIMEOUT = 10  # Seconds a /predict request waits for its batch to be scored
 
 MYSQL_USER=os.environ.get("MYSQL_USER")
 MYSQL_PASSWORD=os.environ.get("MYSQL_PASSWORD")
@@ -14,11 +31,13 @@ MYSQL_HOST=os.environ.get("MYSQL_HOST")
 MYSQL_PORT=os.environ.get("MYSQL_PORT")
 DATABASE_NAME=os.environ.get("DATABASE_NAME")
 SQLALCHEMY_DATABASE_URI=os.environ.get("SQLALCHEMY_DATABASE_URI")
+# Required by /reload_cube in X-Reload-Token, which is only accepted from localhost when no token is set
+RELOAD_TOKEN=os.environ.get("PREDICTION_CUBE_RELOAD_TOKEN")
 conn_type = "mysql+pymysql"
 
 if ((SQLALCHEMY_DATABASE_URI is None) or (SQLALCHEMY_DATABASE_URI is "")) and ((MYSQL_HOST is None) or (MYSQL_HOST is '')):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///data/msia423_db.db'
-elif (host is None) or (host is ""):
+elif (MYSQL_HOST is None) or (MYSQL_HOST is ""):
     pass
 else:
     SQLALCHEMY_DATABASE_URI = "{}://{}:{}@{}:{}/{}".format(conn_type, MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST, MYSQL_PORT, DATABASE_NAME)
\ No newline at end of file
@@ -1,34 +1,60 @@
+import os
 import pickle
 import argparse
 import logging
 import yaml
-import pandas as pd
+import sys
 
 logging.basicConfig(format='%(name)-12s %(levelname)-8s %(message)s', level=logging.INFO)
 logger = logging.getLogger('run.py')
 
-from src.clean_data import clean_data
-from src.write_to_s3 import write_to_s3
-from src.read_from_s3 import read_from_s3
-from src.build_models import build_models
-from src.score_data import score_data
-from src.create_database import create_database_main
+from src.pipeline import run_pipeline
+from src.instrumentation import enable as enable_instrumentation, measure, n_rows
 
 if __name__ == '__main__':
 
     # Parses the different arguments in the docker run statement
     parser = argparse.ArgumentParser(description="Acquire, create features, and build model from heart data")
     parser.add_argument('step', help='Which step to run', choices=['upload','download','clean_data','build_models',\
-                                                                   'score_data','database'])
-    parser.add_argument('--input', '-i', default=None, help='Path to input data')
+                                                                   'score_data','database','database_rollback',\
+                                                                   'database_migrate','pipeline','benchmark'])
+    parser.add_argument('--input', '-i', default=None, help='Path to input data, or s3://bucket/prefix to read all \
+     the partition files under a prefix')
     parser.add_argument('--config', default=None, help='Path to configuration file')
-    parser.add_argument('--output', '-o', default=None, help='Path to save output CSV (optional, default = None)')
-    parser.add_argument('--model', '-m', default=None, help='Path to trained model object')
+    parser.add_argument('--output', '-o', default=None, help='Path to save output CSV, or binary columnar file if \
+     the extension is .col (optional, default = None)')
+    parser.add_argument('--model', '-m', default=None, help='Path to trained model object or model bundle directory')
     parser.add_argument("--truncate", "-t", default=None, help="If given, delete current records\
      from pd_predictions table before create_all ""so that table can be recreated without unique id issues ")
+    parser.add_argument("--flat_forest", "-f", default=None, help="If 1, score_data evaluates the random forest with \
+     flattened node arrays instead of sklearn's per-tree prediction")
+    parser.add_argument("--load_mode", default='append', choices=['append', 'incremental', 'swap'], help="How the \
+     database step writes pd_predictions: append all records, only insert/update/delete the rows that changed, or \
+     load a shadow table and swap it in")
+    parser.add_argument("--schema", default='legacy', choices=['legacy', 'compact'], help="Layout the database step \
+     writes: pd_predictions (legacy) or pd_predictions_compact with a packed integer key (compact)")
+    parser.add_argument("--force", default=None, help="If 1, the pipeline step reruns every step even if its inputs, \
+     config and code are unchanged since the last run")
+    parser.add_argument("--search", "-s", default=None, help="If 1, build_models first searches the hyperparameters \
+     of model_search in config.yaml and writes model_leaderboard.csv next to the output")
+    parser.add_argument("--incremental", default=None, help="If 1, build_models updates the previous model with \
+     the input rows (new trees grown on them, or a full refit on the history when due or when drift is detected)")
+    parser.add_argument("--update_baseline", default=None, help="If 1, the benchmark step stores its results as \
+     the new baseline instead of comparing them with it")
+    parser.add_argument("--instrument", default=None, help="If given, wall time, CPU time, peak RSS and row counts \
+     of the step and of its internal stages are appended as JSON lines to this file ('-' for stderr)")
+    parser.add_argument("--profile_dir", default=None, help="If given with --instrument, every step is run under \
+     cProfile and its stats are dumped to <step>.prof in this directory")
+    parser.add_argument("--grid", "-g", default=None, help="If 1, score_data and database generate the scoring \
+     grid of config.yaml's score_data section block by block instead of reading --input (requires --model)")
+    parser.add_argument("--chunksize", "-c", default=None, type=int, help="If given, clean_data and score_data stream \
+     the input in chunks of this many rows instead of loading it at once")
+    parser.add_argument("--workers", "-w", default=None, type=int, help="Number of worker processes used with \
+     --chunksize (default = number of CPUs)")
 
     args = parser.parse_args()
     truncate_flag = 0
+    streaming = args.step in ['clean_data', 'score_data'] and args.chunksize is not None
 
     # Load configuration file for parameters and tmo path
     if args.config is not None:
@@ -37,57 +63,129 @@ if __name__ == '__main__':
 
     logger.info("Configuration file loaded from %s" % args.config)
 
-    # Picks up the input file specified in the docker run statement
-    if args.input is not None:
-        input = pd.read_csv(args.input)
+    if args.instrument is not None:
+        enable_instrumentation(args.instrument, profile_dir=args.profile_dir)
+
+    # The pipeline only imports the modules of the steps it actually runs (a rerun with nothing to do never loads
+    # pandas or sklearn), so it is dispatched before the modules of the individual steps are imported
+    if args.step == 'pipeline':
+        run_pipeline(config, force=args.force == '1', truncate_flag=1 if args.truncate == '1' else 0,
+                     load_mode=args.load_mode, schema=args.schema)
+        sys.exit()
+
+    from src.columnar import read_table, write_table, is_columnar, config_compression
+    from src.clean_data import clean_data, clean_data_streaming
+    from src.write_to_s3 import write_to_s3
+    from src.read_from_s3 import read_from_s3, read_s3_prefix, split_s3_uri
+    from src.build_models import build_models, save_model_artifacts
+    from src.model_search import search_hyperparameters, split_search_params
+    from src.incremental_training import retrain_incremental
+    from src.model_bundle import load_bundle, is_bundle
+    from src.score_data import score_data, score_data_streaming, score_grid, iter_scored_grid
+    from src.create_database import create_database_main, create_database_streaming, rollback_database_main, \
+        migrate_database_main
+    from src.benchmark import benchmark_main
+    from src.dtypes import apply_dtypes
+
+    # Column types of the dtypes section of config.yaml, kept from loading to scoring
+    dtypes = config.get('dtypes') if args.config is not None else None
+    # Compression of the .col outputs (columnar section of config.yaml)
+    compression = config_compression(config) if args.config is not None else None
+
+    if streaming and any(path is not None and is_columnar(path) for path in [args.input, args.output]):
+        logger.error("--chunksize streams CSV files only")
+        sys.exit(1)
+
+    # Picks up the input file specified in the docker run statement (.col files in the binary columnar format,
+    # s3://bucket/prefix for all the partition files under a prefix, fetched concurrently, or streamed chunk by
+    # chunk from the object bodies with --chunksize)
+    if args.input is not None and args.input.startswith('s3://') and not streaming:
+        download_config = config.get('download', {}) if args.config is not None else {}
+        input = read_s3_prefix(*split_s3_uri(args.input),
+                               **{key: download_config[key] for key in ['MAX_CONCURRENCY', 'MAX_ATTEMPTS']
+                                  if key in download_config})
+    elif args.input is not None and not streaming:
+        input = read_table(args.input)
         logger.info('Input data loaded from %s', args.input)
+    if args.input is not None and not streaming:
+        input = apply_dtypes(input, dtypes, args.input)
 
     # Picks up the trained model object from the location specified in docker run
-    if args.model is not None:
+    if args.model is not None and is_bundle(args.model) and not streaming:
+        input_2 = load_bundle(args.model)
+    elif args.model is not None and not streaming:
         with open(args.model, 'rb') as file:
             input_2 = pickle.load(file)
         logger.info('Trained model object loaded from %s', args.model)
 
-    # Runs the python files corresponding to the step mentioned in docker run
-    if args.step == 'clean_data':
-        output = clean_data(input, **config['clean_data'])
-    elif args.step == 'upload':
-        output = write_to_s3(**config['upload'])
-    elif args.step == 'download':
-        path = args.output
-        output = read_from_s3(**config['download'], RAW_CSV_PATH=path)
-    elif args.step == 'build_models':
-        output, auc, confusion, accuracy, classification_report, model = build_models(input,**config['build_models'])
-        path_levels = len(args.output.split('/'))
-        path = ''
-        for i in range(0,path_levels-1):
-            path = path + args.output.split('/')[i] + '/'
-        model_accuracy_file = path + 'model_accuracy.txt'
-        with open(model_accuracy_file, "w") as f:
-            f.write("Area under the curve\n")
-            f.write(str(auc))
-            f.write("\n")
-            f.write("\nConfusion matrix\n")
-            f.write(str(confusion))
-            f.write("\n")
-            f.write("\nAccuracy\n")
-            f.write(str(accuracy))
-            f.write("\n")
-            f.write("\nClassification report\n")
-            f.write(str(classification_report))
-        logger.info("Model accuracy details saved successfully")
-        # save the model to disk
-        pickle_model_file = path +'finalized_model.sav'
-        pickle.dump(model, open(pickle_model_file, 'wb'))
-        logger.info("Model saved as a pickle file successfully")
-    elif args.step == 'score_data':
-        output = score_data(input,input_2)
-    elif args.step == 'database':
-        if args.truncate == '1':
-            truncate_flag=1
-        create_database_main(input,truncate_flag)
+    # Runs the python files corresponding to the step mentioned in docker run (measured when --instrument is given)
+    output = None
+    with measure('step', args.step, rows_in=n_rows(input) if args.input is not None and not streaming else None) \
+            as step_record:
+        if streaming and args.step == 'clean_data':
+            clean_data_streaming(args.input, args.output, chunksize=args.chunksize, **config['clean_data'])
+        elif args.step == 'clean_data':
+            output = apply_dtypes(clean_data(input, **config['clean_data']), dtypes, 'clean data')
+        elif args.step == 'upload':
+            output = write_to_s3(**config['upload'])
+        elif args.step == 'download':
+            path = args.output
+            output = read_from_s3(**config['download'], RAW_CSV_PATH=path)
+        elif args.step == 'build_models' and args.incremental == '1':
+            # Full refits write model_results.csv next to the model files themselves
+            retrain_incremental(input, os.path.dirname(args.output), **config['build_models'],
+                                **config['incremental_training'])
+            output = None
+        elif args.step == 'build_models':
+            build_config = dict(config['build_models'])
+            if args.search == '1':
+                best_params, leaderboard = search_hyperparameters(input, build_config['target_column'],
+                                                                  build_config['columns_for_modeling'],
+                                                                  test_size=build_config.get('test_size', 0.3),
+                                                                  **config['model_search'])
+                leaderboard.to_csv(os.path.join(os.path.dirname(args.output), 'model_leaderboard.csv'), index=False)
+                logger.info("Leaderboard of the hyperparameter search saved")
+                build_config.update(split_search_params(best_params))
+            output, auc, confusion, accuracy, classification_report, model, scaler = \
+                build_models(input, return_scaler=True, **build_config)
+            save_model_artifacts(os.path.dirname(args.output), auc, confusion, accuracy, classification_report, model,
+                                 scaler, config['build_models']['columns_for_modeling'])
+        elif args.step == 'score_data' and args.grid == '1':
+            score_grid(config['score_data']['grid'], input_2, args.output,
+                       block_size=config['score_data']['block_size'], flat_forest=args.flat_forest == '1',
+                       dtypes=dtypes, compression=compression)
+        elif streaming and args.step == 'score_data':
+            score_data_streaming(args.input, args.output, args.model, chunksize=args.chunksize, n_workers=args.workers,
+                                 flat_forest=args.flat_forest == '1', dtypes=dtypes)
+        elif args.step == 'score_data':
+            output = score_data(input, input_2, flat_forest=args.flat_forest == '1', dtypes=dtypes)
+        elif args.step == 'database' and args.grid == '1':
+            if args.load_mode != 'append':
+                logger.error("Load mode %s is not supported with --grid", args.load_mode)
+                sys.exit(1)
+            blocks = iter_scored_grid(config['score_data']['grid'], input_2,
+                                      block_size=config['score_data']['block_size'],
+                                      flat_forest=args.flat_forest == '1', dtypes=dtypes)
+            create_database_streaming(blocks, 1 if args.truncate == '1' else 0, schema=args.schema,
+                                      grid=config['score_data']['grid'], **config['database'])
+        elif args.step == 'database':
+            if args.truncate == '1':
+                truncate_flag=1
+            create_database_main(input, truncate_flag, load_mode=args.load_mode, schema=args.schema,
+                                 **(config['database'] if args.config is not None else {}))
+        elif args.step == 'database_rollback':
+            rollback_database_main()
+        elif args.step == 'database_migrate':
+            migrate_database_main(**(config['database'] if args.config is not None else {}))
+        elif args.step == 'benchmark':
+            regressions = benchmark_main(config, args.output or 'benchmark_results.json',
+                                         update_baseline=args.update_baseline == '1', **config['benchmark'])
+            if regressions:
+                sys.exit(1)
+            output = None
+        step_record['rows_out'] = n_rows(output) if args.step != 'download' else None
 
     # Saves output in specified location in docker run
-    if args.output is not None and args.step !='download':
-        output.to_csv(args.output, index=False)
+    if args.output is not None and args.step !='download' and not streaming and output is not None:
+        write_table(output, args.output, compression=compression)
         logger.info("Output saved to %s" % args.output)
\ No newline at end of file
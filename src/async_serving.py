@@ -0,0 +1,191 @@
+import io
+import sys
+import asyncio
+import logging
+import functools
+import concurrent.futures
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Loop running the calling coroutine (Python 3.6 has no get_running_loop, its get_event_loop returns that loop when
+# called from a coroutine)
+running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+class Saturated(Exception):
+    """Raised when the executor already holds max_pending calls, the request is then answered with 503"""
+
+
+class Request(object):
+    """HTTP request received by the ASGI application, with its whole body"""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'')
+        self.headers = [(name.decode('latin-1').lower(), value.decode('latin-1'))
+                        for name, value in scope.get('headers', [])]
+        self.body = body
+
+    def wsgi_environ(self):
+        """Returns: WSGI environ of the request"""
+        scope = self.scope
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': self.method,
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': self.path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': self.query_string.decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(self.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in self.headers:
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+    @property
+    def form(self):
+        """Returns: dictionary of the URL-encoded form fields (last value of every field)"""
+        fields = parse_qs(self.body.decode('utf-8'), keep_blank_values=True)
+        return {name: values[-1] for name, values in fields.items()}
+
+
+class Response(object):
+    """HTTP response sent by an async handler"""
+
+    def __init__(self, body, status=200, content_type='text/html; charset=utf-8', headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.headers = [('content-type', content_type)] + list(headers or [])
+
+
+class AsyncApp(object):
+    """ASGI application serving some routes with async handlers and every other request with a WSGI application.
+
+    Blocking work (database queries, the WSGI application itself) runs on a bounded thread pool. At most
+    max_pending calls are queued or running on it: past that, requests are refused with 503 and Retry-After
+    instead of piling up, so a slow database cannot exhaust the process's memory or the clients' timeouts.
+    """
+
+    def __init__(self, wsgi_app, max_workers=32, max_pending=512, retry_after=1):
+        self.wsgi_app = wsgi_app
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.pending = 0
+        self.rejected = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._routes = {}
+        self._startup = []
+
+    def route(self, path, methods=('GET',)):
+        """Decorator registering an async handler (taking the Request, returning a Response) for a path"""
+        def register(handler):
+            for method in methods:
+                self._routes[(method, path)] = handler
+            return handler
+        return register
+
+    def on_startup(self, function):
+        """Decorator registering a blocking function run on the executor when the server starts"""
+        self._startup.append(function)
+        return function
+
+    async def run_blocking(self, function, *args, **kwargs):
+        """
+            Runs a blocking function on the executor, with the given arguments
+            Raises: Saturated if max_pending calls are already queued or running
+            Returns: result of the function
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Saturated()
+        # Only the event loop thread changes the counter, no lock is needed
+        self.pending += 1
+        try:
+            return await running_loop().run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return dict(max_workers=self.max_workers, max_pending=self.max_pending, pending=self.pending,
+                    rejected=self.rejected)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+        request = Request(scope, body)
+        handler = self._routes.get((request.method, request.path))
+        try:
+            if handler is not None:
+                response = await handler(request)
+            else:
+                response = await self.run_blocking(self._call_wsgi, request)
+        except Saturated:
+            logger.warning("%d calls pending on the executor, %s %s refused", self.pending, request.method,
+                           request.path)
+            response = Response('Server busy, retry later', status=503, content_type='text/plain; charset=utf-8',
+                                headers=[('retry-after', str(self.retry_after))])
+        await send({'type': 'http.response.start', 'status': response.status,
+                    'headers': [(name.encode('latin-1'), value.encode('latin-1'))
+                                for name, value in response.headers]})
+        await send({'type': 'http.response.body', 'body': response.body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                for function in self._startup:
+                    await running_loop().run_in_executor(self.executor, function)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _call_wsgi(self, request):
+        """Runs the WSGI application on a request (on an executor thread) and collects its response"""
+        environ = request.wsgi_environ()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        response = Response(body, status=started['status'])
+        response.headers = [(name.lower(), value) for name, value in started['headers']]
+        return response
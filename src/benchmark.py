@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import platform
+import tempfile
+import importlib
+import tracemalloc
+import logging
+import numpy as np
+import pandas as pd
+from src.clean_data import clean_data
+from src.build_models import build_models
+from src.score_data import score_data
+from src.flat_forest import compile_forest
+from src.create_database import create_db, add_records
+from src.scoring_grid import grid_axes
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['clean_data', 'build_models', 'score_data', 'score_data_flat', 'add_records', 'route_index', 'route_add']
+
+# Columns of the raw heart.csv, in order, with the [min, max] integer values drawn for every one of them
+RAW_COLUMNS = [('age', 29, 77), ('sex', 0, 1), ('cp', 0, 3), ('trestbps', 94, 200), ('chol', 126, 564),
+               ('fbs', 0, 1), ('restecg', 0, 2), ('thalach', 71, 202), ('exang', 0, 1), ('oldpeak', 0, 6),
+               ('slope', 0, 2), ('ca', 0, 4), ('thal', 0, 3), ('target', 0, 1)]
+
+# Metrics compared with the baseline: for the timings a regression is an increase, for throughput a decrease
+HIGHER_IS_WORSE = ['median_s', 'p95_ms', 'peak_mb']
+LOWER_IS_WORSE = ['throughput']
+
+
+def synthetic_raw(n_rows, seed=1408, missing_rate=0.01):
+    """
+        Generates rows in the layout of the raw heart.csv, with a few missing values for clean_data to impute
+        Input: n_rows - number of rows
+               seed - seed of the random generator
+               missing_rate - share of the values set to NaN
+        Returns: dataframe with the raw column names
+    """
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({name: rng.randint(low, high + 1, n_rows) for name, low, high in RAW_COLUMNS})
+    df['oldpeak'] = np.round(df['oldpeak'] * rng.rand(n_rows), 1)
+    mask = rng.rand(n_rows, len(RAW_COLUMNS) - 1) < missing_rate
+    features = df.columns[:-1]
+    df[features] = df[features].astype(float).mask(mask)
+    return df
+
+
+def synthetic_grid(n_rows, spec, seed=1408):
+    """
+        Draws distinct combinations of the inputs of the scoring grid
+        Input: n_rows - number of combinations (at most the size of the whole grid)
+               spec - grid specification (grid of the score_data section of config.yaml)
+               seed - seed of the random generator
+        Returns: dataframe with the columns of the grid
+    """
+    axes = grid_axes(spec)
+    shape = [len(axis) for name, axis in axes]
+    n_rows = min(n_rows, int(np.prod(shape)))
+    codes = np.random.RandomState(seed).choice(int(np.prod(shape)), n_rows, replace=False)
+    digits = np.unravel_index(np.sort(codes), shape)
+    return pd.DataFrame({name: axis[digit] for (name, axis), digit in zip(axes, digits)})
+
+
+def percentile_ms(latencies, q):
+    """Returns: q-th percentile of latencies given in seconds, in milliseconds"""
+    return float(np.percentile(latencies, q) * 1000) if len(latencies) else None
+
+
+def peak_memory_mb(function):
+    """
+        Runs function once under tracemalloc (numpy and pandas buffers included)
+        Returns: peak of the memory allocated while it ran, in MB
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def measure(stage, size, function, repeats=3, setup=None, n_items=None):
+    """
+        Times a stage: function is run repeats times (setup, if given, prepares its argument outside of the timing)
+        and once more under tracemalloc for the peak memory
+        Input: stage - name of the stage
+               size - number of input rows
+               function - function of one argument, the result of setup()
+               n_items - number of items processed per run, for the throughput (default size)
+        Returns: dictionary of the stage's metrics
+    """
+    setup = setup or (lambda: None)
+    timings = []
+    for i in range(repeats):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    argument = setup()
+    peak = peak_memory_mb(lambda: function(argument))
+    median = float(np.median(timings))
+    result = dict(stage=stage, size=size, repeats=repeats, median_s=median,
+                  throughput=(n_items or size) / median if median > 0 else None,
+                  p50_ms=percentile_ms(timings, 50), p95_ms=percentile_ms(timings, 95),
+                  p99_ms=percentile_ms(timings, 99), peak_mb=peak)
+    logger.info("%s on %d rows: %.4fs median, %.0f rows/s, %.1f MB peak", stage, size, median,
+                result['throughput'] or 0, peak)
+    return result
+
+
+def _sqlite_engine_string(db_path):
+    return 'sqlite:///%s' % db_path
+
+
+def _load_predictions(db_path, scored, batch_size=10000):
+    """Replaces the content of pd_predictions in the SQLite file with the scored grid"""
+    create_db(_sqlite_engine_string(db_path))
+    with sqlite3.connect(db_path) as connection:
+        connection.execute('DELETE FROM pd_predictions')
+    add_records(scored, _sqlite_engine_string(db_path), batch_size=batch_size)
+
+
+def _import_app(db_path):
+    """
+        Imports the Flask app bound to the benchmark's SQLite file. The app reads its database from the environment
+        when it is first imported, so the benchmark must be the first to import it in the process. The environment
+        is restored once the app is imported.
+        Returns: app module
+    """
+    engine_string = _sqlite_engine_string(db_path)
+    saved = dict((key, os.environ.get(key)) for key in ['SQLALCHEMY_DATABASE_URI', 'MYSQL_HOST'])
+    # The app configures logging from its own file, which disables every logger created before it is imported
+    enabled = [existing for existing in logging.Logger.manager.loggerDict.values()
+               if isinstance(existing, logging.Logger) and not existing.disabled]
+    try:
+        if 'app' not in sys.modules:
+            os.environ['SQLALCHEMY_DATABASE_URI'] = engine_string
+            # MYSQL_HOST would take precedence over SQLALCHEMY_DATABASE_URI, the benchmark always runs offline
+            os.environ.pop('MYSQL_HOST', None)
+        app_module = importlib.import_module('app')
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        for existing in enabled:
+            existing.disabled = False
+    if app_module.app.config['SQLALCHEMY_DATABASE_URI'] != engine_string:
+        raise RuntimeError("The app was imported before the benchmark, with another database")
+    return app_module
+
+
+def measure_routes(app_module, size, grid, n_requests=200, seed=1408):
+    """
+        Sends n_requests requests to / and to /add through the Flask test client, one at a time
+        Input: app_module - app module bound to a database holding the predictions of grid
+               size - number of stored predictions
+               grid - dataframe of the stored combinations, the /add requests are drawn from them
+        Returns: list of the two stages' metrics, with per-request latency percentiles
+    """
+    client = app_module.app.test_client()
+    rng = np.random.RandomState(seed)
+    forms = [{column: str(value) for column, value in row.items()}
+             for row in grid.iloc[rng.randint(0, len(grid), n_requests)].to_dict('records')]
+    requests = [('route_index', lambda form: client.get('/')), ('route_add', lambda form: client.post('/add', data=form))]
+
+    results = []
+    for stage, send in requests:
+        send(forms[0])
+        latencies = []
+        start = time.perf_counter()
+        for form in forms:
+            request_start = time.perf_counter()
+            response = send(form)
+            latencies.append(time.perf_counter() - request_start)
+            if response.status_code != 200:
+                raise RuntimeError("%s answered %d" % (stage, response.status_code))
+        elapsed = time.perf_counter() - start
+        peak = peak_memory_mb(lambda: [send(form) for form in forms[:20]])
+        result = dict(stage=stage, size=size, repeats=n_requests, median_s=float(np.median(latencies)),
+                      throughput=n_requests / elapsed, p50_ms=percentile_ms(latencies, 50),
+                      p95_ms=percentile_ms(latencies, 95), p99_ms=percentile_ms(latencies, 99), peak_mb=peak)
+        logger.info("%s with %d stored predictions: %.0f requests/s, p50 %.2fms, p95 %.2fms, p99 %.2fms", stage, size,
+                    result['throughput'], result['p50_ms'], result['p95_ms'], result['p99_ms'])
+        results.append(result)
+    return results
+
+
+def run_benchmarks(config, sizes=(1000, 10000), repeats=3, stages=None, route_requests=200, work_dir=None):
+    """
+        Runs every stage on synthetic inputs of each size
+        Input: config - parsed config.yaml (clean_data, build_models and score_data sections)
+               sizes - numbers of input rows (for the routes, of stored predictions)
+               repeats - timed runs of every stage
+               stages - names of the stages to run (default STAGES)
+               route_requests - requests sent to each route
+               work_dir - directory of the SQLite files (default a temporary directory)
+        Returns: dictionary with the environment and the list of results
+    """
+    stages = stages or STAGES
+    work_dir = work_dir or tempfile.mkdtemp(prefix='benchmark_')
+    build_config = config['build_models']
+    results = []
+    for size in sizes:
+        raw = synthetic_raw(size)
+        clean = clean_data(raw.copy(), **config['clean_data'])
+        grid = synthetic_grid(size, config['score_data']['grid'])
+        if 'clean_data' in stages:
+            results.append(measure('clean_data', size, lambda df: clean_data(df, **config['clean_data']),
+                                   repeats, setup=raw.copy))
+        if 'build_models' in stages:
+            results.append(measure('build_models', size, lambda df: build_models(df, **build_config),
+                                   repeats, setup=clean.copy))
+        model = build_models(clean, **build_config)[5]
+        if 'score_data' in stages:
+            results.append(measure('score_data', len(grid), lambda df: score_data(df, model), repeats,
+                                   setup=grid.copy))
+        if 'score_data_flat' in stages:
+            # Same rows scored with the flattened forest (compiled once, as score_data_streaming does)
+            forest = compile_forest(model)
+            results.append(measure('score_data_flat', len(grid),
+                                   lambda df: score_data(df, model, flat_forest=True, forest=forest), repeats,
+                                   setup=grid.copy))
+        scored = score_data(grid.copy(), model)
+        if 'add_records' in stages:
+            db_paths = iter(os.path.join(work_dir, 'add_records_%d_%d.db' % (size, i)) for i in range(repeats + 1))
+
+            def fresh_database():
+                db_path = next(db_paths)
+                create_db(_sqlite_engine_string(db_path))
+                return db_path
+            results.append(measure('add_records', len(scored),
+                                   lambda db_path: add_records(scored, _sqlite_engine_string(db_path)), repeats,
+                                   setup=fresh_database))
+        if 'route_index' in stages or 'route_add' in stages:
+            db_path = os.path.join(work_dir, 'app.db')
+            _load_predictions(db_path, scored)
+            app_module = _import_app(db_path)
+            app_module.reload_prediction_cube()
+            app_module.response_cache.clear()
+            results.extend(result for result in measure_routes(app_module, len(scored), grid, route_requests)
+                           if result['stage'] in stages)
+    return dict(created=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                platform=platform.platform(), cpus=os.cpu_count(), results=results)
+
+
+def compare_to_baseline(current, baseline, thresholds):
+    """
+        Compares results with the stored baseline, stage by stage and size by size
+        Input: current, baseline - dictionaries returned by run_benchmarks
+               thresholds - dictionary of metric to the relative change tolerated (e.g. median_s: 0.25 tolerates a
+                            median 25% slower than the baseline)
+        Returns: list of the regressions, each a dictionary with stage, size, metric, baseline, current and change
+    """
+    stored = {(result['stage'], result['size']): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        previous = stored.get((result['stage'], result['size']))
+        if previous is None:
+            continue
+        for metric, tolerance in thresholds.items():
+            before, after = previous.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (metric in HIGHER_IS_WORSE and change > tolerance) or (metric in LOWER_IS_WORSE and -change > tolerance):
+                regressions.append(dict(stage=result['stage'], size=result['size'], metric=metric, baseline=before,
+                                        current=after, change=change))
+    return regressions
+
+
+def benchmark_main(config, output_path, baseline_path=None, thresholds=None, update_baseline=False, **kwargs):
+    """
+        Runs the benchmarks, writes the results as JSON and compares them with the baseline
+        Input: config - parsed config.yaml
+               output_path - JSON file receiving the results
+               baseline_path - JSON file of the stored baseline (written from these results if it does not exist
+                               or if update_baseline is True)
+               thresholds - passed on to compare_to_baseline
+               kwargs - passed on to run_benchmarks
+        Returns: list of the regressions
+    """
+    current = run_benchmarks(config, **kwargs)
+    with open(output_path, 'w') as file:
+        json.dump(current, file, indent=2)
+    logger.info("Benchmark results saved to %s", output_path)
+    if baseline_path is None:
+        return []
+    if update_baseline or not os.path.isfile(baseline_path):
+        with open(baseline_path, 'w') as file:
+            json.dump(current, file, indent=2)
+        logger.info("Benchmark baseline saved to %s", baseline_path)
+        return []
+
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    regressions = compare_to_baseline(current, baseline, thresholds or {})
+    for regression in regressions:
+        logger.error("Regression of %s on %d rows: %s went from %.4g to %.4g (%+.0f%%)", regression['stage'],
+                     regression['size'], regression['metric'], regression['baseline'], regression['current'],
+                     regression['change'] * 100)
+    if not regressions:
+        logger.info("No regression against %s", baseline_path)
+    return regressions
@@ -1,13 +1,18 @@
+import os
+import pickle
 import pandas as pd
 import logging
 import sklearn
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestClassifier
+from src.model_bundle import save_bundle
+from src.instrumentation import instrumented
 
 logger = logging.getLogger(__name__)
 
-def build_models( df, target_column, columns_for_modeling, test_size=0.3, n_estimators=10, max_depth=3):
+def build_models( df, target_column, columns_for_modeling, test_size=0.3, n_estimators=10, max_depth=3,
+                  return_scaler=False, model_params=None):
     """
     Wrapper function that orchestrates all the different steps of modeling
     Input: df - Input dataframe with features and target
@@ -16,9 +21,12 @@ def build_models( df, target_column, columns_for_modeling, test_size=0.3, n_esti
            test_size - Specifies the fraction of the dataset that should be used for testing
            n_estimators - This is a hyperparameter specific to the random forest model
            max_depth - This is a hyperparameter specific to the random forest model
+           return_scaler - If True, the fitted StandardScaler is returned as well
+           model_params - Other hyperparameters of the random forest (e.g. the best ones found by model_search)
     Returns: fi - Feature importances as a dataframe
              auc, confusion, accuracy, classification_model - Accuracy metrics
              model_fit - Fitted model object
+             scaler - Fitted StandardScaler (only if return_scaler is True)
     """
 
     # Checks if input dataset is a dataframe
@@ -29,16 +37,19 @@ def build_models( df, target_column, columns_for_modeling, test_size=0.3, n_esti
     # Orchestration of the different steps involved in modeling
     features, target, temp = split_features_target(df, target_column, columns_for_modeling)
     X_train, X_test, y_train, y_test = split_test_train(features, target, test_size)
-    X_train, X_test = stan_norm(X_train, X_test)
-    model_fit = rf_model(X_train, y_train,n_estimators, max_depth)
+    X_train, X_test, scaler = stan_norm(X_train, X_test, return_scaler=True)
+    model_fit = rf_model(X_train, y_train,n_estimators, max_depth, model_params)
     ypred_proba_test, ypred_bin_test = fit_test(model_fit, X_test)
     auc, confusion, accuracy, classification_report = compute_accuracy(y_test, ypred_proba_test, ypred_bin_test)
     fi = feature_importances(columns_for_modeling, model_fit)
 
+    if return_scaler:
+        return fi, auc, confusion, accuracy, classification_report, model_fit, scaler
     return fi, auc, confusion, accuracy, classification_report, model_fit
 
 
 
+@instrumented
 def split_features_target(df, target_column, columns_for_modeling):
     """
         Splits the dataframe into two datasets (Features and target)
@@ -63,6 +74,7 @@ def split_features_target(df, target_column, columns_for_modeling):
 
 
 
+@instrumented
 def split_test_train(features, target, test_size):
     """
         Splits dataset into test and train
@@ -83,13 +95,16 @@ def split_test_train(features, target, test_size):
 
 
 
-def stan_norm(X_train,X_test):
+@instrumented
+def stan_norm(X_train,X_test, return_scaler=False):
     """
         Standardize and normalize the independent features dataframe
         Input:
             X_train, X_test - train and test independent features dataframe
+            return_scaler - If True, the fitted StandardScaler is returned as well
         Returns:
             X_train, X_test - Standardized and normalized version of the train and test independent features dataframe
+            scaler - Fitted StandardScaler (only if return_scaler is True)
     """
     try:
         scaler = StandardScaler()
@@ -98,22 +113,26 @@ def stan_norm(X_train,X_test):
     except Exception as e:
         logger.error("Unable to standardize or normalize data")
         raise SystemExit()
+    if return_scaler:
+        return (X_train, X_test, scaler)
     return (X_train,X_test)
 
 
 
-def rf_model(X_train, y_train,n_estimators, max_depth):
+@instrumented
+def rf_model(X_train, y_train,n_estimators, max_depth, model_params=None):
     """
         Build a random forest model on the train dataset
         Inpyt:
             X_train, y_train - Train dataset
             n_estimators, max_depth - model hyperparameters
+            model_params - Other hyperparameters passed on to RandomForestClassifier
         Returns:
             model_fit: Fitted model object
     """
     try:
         model = sklearn.ensemble.RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, \
-                                                        random_state=1408)
+                                                        random_state=1408, **(model_params or {}))
         model_fit = model.fit(X_train, y_train)
     except Exception as e:
         logger.error("Unable to build random forest classification model")
@@ -123,6 +142,7 @@ def rf_model(X_train, y_train,n_estimators, max_depth):
 
 
 
+@instrumented
 def fit_test(model_fit, X_test):
     """
         Fitting trained model object to the test dataset
@@ -142,6 +162,7 @@ def fit_test(model_fit, X_test):
 
 
 
+@instrumented
 def compute_accuracy(y_test, ypred_proba_test,ypred_bin_test):
     """
         Computed accuracy of model on the test dataset
@@ -164,6 +185,7 @@ def compute_accuracy(y_test, ypred_proba_test,ypred_bin_test):
 
 
 
+@instrumented
 def feature_importances(columns_for_modeling,model_fit):
     """
         Computes feature importances
@@ -180,4 +202,44 @@ def feature_importances(columns_for_modeling,model_fit):
     except Exception as e:
         logger.error("Could not compute feature importances")
         raise SystemExit()
-    return fi
\ No newline at end of file
+    return fi
+
+
+
+@instrumented
+def save_model_artifacts(path, auc, confusion, accuracy, classification_report, model_fit, scaler,
+                         columns_for_modeling):
+    """
+        Saves the accuracy report, the pickled model and the versioned model bundle next to each other
+        Input:
+            path - directory of the model files ('' for the working directory)
+            auc, confusion, accuracy, classification_report - Accuracy metrics returned by build_models
+            model_fit, scaler - Fitted model object and StandardScaler returned by build_models
+            columns_for_modeling - List of features in training order
+        Returns:
+            Path of the model bundle
+    """
+    model_accuracy_file = os.path.join(path, 'model_accuracy.txt')
+    with open(model_accuracy_file, "w") as f:
+        f.write("Area under the curve\n")
+        f.write(str(auc))
+        f.write("\n")
+        f.write("\nConfusion matrix\n")
+        f.write(str(confusion))
+        f.write("\n")
+        f.write("\nAccuracy\n")
+        f.write(str(accuracy))
+        f.write("\n")
+        f.write("\nClassification report\n")
+        f.write(str(classification_report))
+    logger.info("Model accuracy details saved successfully")
+    # save the model to disk
+    with open(os.path.join(path, 'finalized_model.sav'), 'wb') as f:
+        pickle.dump(model_fit, f)
+    logger.info("Model saved as a pickle file successfully")
+    # save the versioned bundle (preprocessing, node arrays, feature order and metrics) used for scoring
+    bundle_path = os.path.join(path, 'model_bundle')
+    save_bundle(bundle_path, model_fit, scaler, columns_for_modeling,
+                metrics=dict(auc=float(auc), accuracy=float(accuracy), confusion=confusion.tolist(),
+                             classification_report=classification_report))
+    return bundle_path
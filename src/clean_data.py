@@ -1,15 +1,21 @@
 import os
 import logging
+import numpy as np
+import pandas as pd
+from src.instrumentation import instrumented
+from src.read_from_s3 import iter_csv_chunks
 
 logger = logging.getLogger(__name__)
 
 # Adding column names to data
-def clean_data(df, col_names):
+def clean_data(df, col_names, valid_ranges=None):
     """
         Cleans the data and makes it ready for modeling
         Input:
             Dataframe: Raw dataset downloaded from s3
             col_names: list of column names
+            valid_ranges: dictionary of column name to [min, max] valid values (from YAML). If given, missing and
+                          invalid values of all columns are imputed in a single vectorized pass
         Returns:
             Cleaned data
     """
@@ -22,6 +28,12 @@ def clean_data(df, col_names):
 
     # Orchestrates all the steps of data cleaning
     temp = check_columns_datatypes(df)
+    if valid_ranges is not None:
+        df, imputed = impute_values(df, valid_ranges)
+        logger.info("Values imputed per column: %s", imputed)
+        logger.info("Data is clean and ready to use")
+        return df
+
     df2 = missing_value_treatment(df)
     df3,temp = age_impute_invalid_values(df2)
     df4,temp = sex_impute_invalid_values(df3)
@@ -42,6 +54,65 @@ def clean_data(df, col_names):
     return df16
 
 
+def clean_data_streaming(input_path, output_path, col_names, valid_ranges, chunksize=100000, float_decimals=2,
+                         s3=None):
+    """
+        Cleans a raw CSV file that does not fit in memory, in two chunked passes
+        Input:
+            input_path: Raw CSV file, or s3://bucket/prefix streamed from S3 (once per pass)
+            output_path: CSV file where the cleaned data is written
+            col_names: list of column names
+            valid_ranges: dictionary of column name to [min, max] valid values (from YAML)
+            chunksize: number of rows held in memory at a time
+            float_decimals: values are counted after rounding to this many decimals, which keeps the counts
+                            bounded for continuous columns (counts of integer-coded columns stay exact)
+            s3: S3 client used for an s3:// input (default: created from the environment)
+        Returns:
+            Number of rows written
+    """
+
+    # First pass: value counts of every column and whether it has to be stored as float
+    counts = dict((column, pd.Series(dtype=np.float64)) for column in col_names)
+    float_columns = set()
+    for chunk in iter_csv_chunks(input_path, chunksize, s3=s3):
+        try:
+            chunk.columns = col_names
+        except Exception as e:
+            logger.error("Mismatch in the size of dataframe columns and column_names specified in YAML")
+            raise SystemExit()
+        temp = check_columns_datatypes(chunk)
+        for column in col_names:
+            if chunk[column].dtype.kind == 'f':
+                float_columns.add(column)
+            chunk_counts = chunk[column].round(float_decimals).value_counts()
+            counts[column] = counts[column].add(chunk_counts, fill_value=0)
+
+    # Mode of every column, the smallest value in case of ties as pandas does
+    modes = {}
+    for column in col_names:
+        column_counts = counts[column].sort_index()
+        modes[column] = column_counts.index[np.argmax(column_counts.values)] if len(column_counts) > 0 else np.nan
+    logger.info("Column modes computed over the whole file: %s", modes)
+
+    # Second pass: impute chunk by chunk with the global modes and append to the output
+    dtypes = dict((column, np.float64 if column in float_columns else np.int64) for column in col_names)
+    n_rows = 0
+    imputed = dict((column, 0) for column in col_names)
+    with open(output_path, 'w', newline='') as output:
+        for chunk in iter_csv_chunks(input_path, chunksize, s3=s3):
+            chunk.columns = col_names
+            chunk, chunk_imputed = impute_values(chunk.astype(dtypes), valid_ranges, modes=modes)
+            chunk.to_csv(output, index=False, header=(n_rows == 0))
+            n_rows += len(chunk)
+            for column in col_names:
+                imputed[column] += chunk_imputed[column]
+
+    logger.info("Values imputed per column: %s", imputed)
+    logger.info("%d rows cleaned in chunks of %d and saved to %s", n_rows, chunksize, output_path)
+    return n_rows
+
+
+@instrumented
 def check_columns_datatypes(df):
     """
         Function to check if the datatypes of all columns are correct
@@ -49,7 +120,8 @@ def check_columns_datatypes(df):
         Returns: Flag that indicates that the datatypes of all columns are correct
     """
     temp = 0
-    if (len(df.select_dtypes(include=["float64", "int64", "int", "float"]).columns) == 14):
+    # Narrow types (dtypes section of config.yaml) are as valid as the default int64 and float64
+    if (len(df.select_dtypes(include=["number"]).columns) == 14):
         logger.info("The datatypes of all columns in the dataset are valid")
         temp = 1
     else:
@@ -58,6 +130,72 @@ def check_columns_datatypes(df):
     return temp
 
 
+def column_modes(values):
+    """
+        Computes the mode of every column of a column-major block, ignoring missing values
+        Input: values - 2D float array with one row per column of the dataframe
+        Returns: 1D array with the mode of every column (the smallest one in case of ties, as pandas does),
+                 NaN for columns without any value
+    """
+    modes = np.full(values.shape[0], np.nan)
+    for j, column in enumerate(values):
+        present = column[~np.isnan(column)]
+        if present.size == 0:
+            continue
+        low = present.min()
+        if present.max() - low < 65536 and (present == np.floor(present)).all():
+            # Integer codes: counting is linear instead of sorting
+            modes[j] = low + np.argmax(np.bincount((present - low).astype(np.intp)))
+        else:
+            uniques, counts = np.unique(present, return_counts=True)
+            modes[j] = uniques[np.argmax(counts)]
+    return modes
+
+
+@instrumented
+def impute_values(df, valid_ranges, modes=None):
+    """
+        Replaces missing values and values outside of the valid range of their column with the column mode,
+        for all columns at once
+        Input: df - Dataframe with numeric columns
+               valid_ranges - dictionary of column name to [min, max] valid values
+               modes - dictionary of column name to mode, computed from df if not given
+        Returns:
+            Dataframe with imputed values (columns keep their original datatypes)
+            Dictionary with the number of values imputed in every column
+    """
+    for column in valid_ranges:
+        if column not in df.columns:
+            logger.warning("Column '%s' does not exist", column)
+
+    # Column-major float block: every check below is one vectorized operation over all columns
+    columns = list(df.columns)
+    values = np.empty((len(columns), len(df)), dtype=np.float64)
+    for j, column in enumerate(columns):
+        values[j] = df[column].to_numpy()
+    lower = np.array([valid_ranges.get(column, [-np.inf, np.inf])[0] for column in columns], dtype=np.float64)
+    upper = np.array([valid_ranges.get(column, [-np.inf, np.inf])[1] for column in columns], dtype=np.float64)
+    if modes is None:
+        fill = column_modes(values)
+    else:
+        fill = np.array([modes[column] for column in columns], dtype=np.float64)
+
+    invalid = np.isnan(values)
+    invalid |= values < lower[:, np.newaxis]
+    invalid |= values > upper[:, np.newaxis]
+    counts = invalid.sum(axis=1)
+
+    # Only the columns that actually had invalid values are written back
+    for j in np.flatnonzero(counts):
+        values[j][invalid[j]] = fill[j]
+        df[columns[j]] = values[j].astype(df[columns[j]].dtype, copy=False)
+
+    imputed = dict(zip(columns, counts.tolist()))
+    logger.debug("Values imputed per column: %s", imputed)
+    return df, imputed
+
+
+@instrumented
 def missing_value_treatment(df):
     """
         Function that imputes missing values
@@ -75,6 +213,7 @@ def missing_value_treatment(df):
     return df
 
 
+@instrumented
 def age_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -94,6 +233,7 @@ def age_impute_invalid_values(df):
         temp = 1
     return df,temp
 
+@instrumented
 def sex_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -113,6 +253,7 @@ def sex_impute_invalid_values(df):
         temp = 1
     return df,temp
 
+@instrumented
 def cp_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -132,6 +273,7 @@ def cp_impute_invalid_values(df):
         temp = 1
     return df,temp
 
+@instrumented
 def bp_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -151,6 +293,7 @@ def bp_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def sc_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -170,6 +313,7 @@ def sc_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def fbs_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -189,6 +333,7 @@ def fbs_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def ecg_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -208,6 +353,7 @@ def ecg_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def mhr_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -227,6 +373,7 @@ def mhr_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def ia_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -246,6 +393,7 @@ def ia_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def std_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -265,6 +413,7 @@ def std_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def slope_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -284,6 +433,7 @@ def slope_impute_invalid_values(df):
         temp = 1
     return df, temp
 
+@instrumented
 def nov_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -303,6 +453,7 @@ def nov_impute_invalid_values(df):
         temp = 1
     return df,temp
 
+@instrumented
 def thal_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -322,6 +473,7 @@ def thal_impute_invalid_values(df):
         temp = 1
     return df,temp
 
+@instrumented
 def diag_impute_invalid_values(df):
     """
        Replaces the invalid values in the column with mode
@@ -0,0 +1,189 @@
+import os
+import json
+import zlib
+import struct
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Extension of the binary columnar format, any other extension is read and written as CSV
+EXTENSION = '.col'
+MAGIC = b'HCOL0001'
+# Every block starts on a 64-byte boundary so memory-mapped blocks are aligned for any dtype
+ALIGNMENT = 64
+
+
+def _padding(offset):
+    return -offset % ALIGNMENT
+
+
+def _encode_strings(values):
+    """Encodes an object column as int64 end offsets, a null mask and the concatenated UTF-8 bytes"""
+    nulls = pd.isnull(values)
+    encoded = [b'' if null else str(value).encode('utf-8') for value, null in zip(values, nulls)]
+    ends = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+    return ends.tobytes() + nulls.astype(np.uint8).tobytes() + b''.join(encoded)
+
+
+def _decode_strings(buffer, n_rows):
+    ends = np.frombuffer(buffer, dtype=np.int64, count=n_rows)
+    nulls = np.frombuffer(buffer, dtype=np.uint8, count=n_rows, offset=8 * n_rows).astype(bool)
+    data = bytes(buffer[9 * n_rows:])
+    starts = np.concatenate([[0], ends[:-1]]) if n_rows else ends
+    values = np.array([None if null else data[start:end].decode('utf-8')
+                       for start, end, null in zip(starts.tolist(), ends.tolist(), nulls)], dtype=object)
+    return values
+
+
+def write_columnar(df, path, compression=None):
+    """
+        Writes a dataframe in the binary columnar format: a JSON header followed by one block per dtype holding all
+        the columns of that dtype (column-major), and one block per string column
+        Input: df - dataframe with numeric, boolean or string columns
+               path - file to write
+               compression - None to keep numeric blocks memory-mappable, or 'zlib'
+        Returns: None
+    """
+    if compression not in (None, 'zlib'):
+        raise ValueError("Unsupported compression %s" % compression)
+    n_rows = len(df)
+    columns = [str(column) for column in df.columns]
+    groups = {}
+    blocks = []
+    for column, dtype in zip(columns, df.dtypes):
+        if dtype.kind in 'biuf':
+            groups.setdefault(dtype.str, []).append(column)
+        elif dtype.kind == 'O':
+            blocks.append(dict(kind='utf8', columns=[column]))
+        else:
+            raise ValueError("Column %s has unsupported dtype %s" % (column, dtype))
+    blocks = [dict(kind='numeric', dtype=dtype, columns=names) for dtype, names in groups.items()] + blocks
+
+    payloads = []
+    for block in blocks:
+        if block['kind'] == 'numeric':
+            values = np.empty((len(block['columns']), n_rows), dtype=np.dtype(block['dtype']))
+            for i, column in enumerate(block['columns']):
+                values[i] = df[column].to_numpy()
+            payload = values.tobytes()
+        else:
+            payload = _encode_strings(df[block['columns'][0]].to_numpy())
+        block['nbytes'] = len(payload)
+        if compression == 'zlib':
+            payload = zlib.compress(payload, 1)
+        block['compression'] = compression
+        block['stored_nbytes'] = len(payload)
+        payloads.append(payload)
+
+    # Offsets depend on the header length, which depends on the offsets: reserve room for them first
+    header = dict(n_rows=n_rows, columns=columns, blocks=blocks)
+    for block in blocks:
+        block['offset'] = 0
+    header_size = len(json.dumps(header).encode('utf-8')) + 16 * len(blocks) + 64
+    offset = len(MAGIC) + 8 + header_size
+    offset += _padding(offset)
+    for block, payload in zip(blocks, payloads):
+        block['offset'] = offset
+        offset += len(payload) + _padding(len(payload))
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_size)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<Q', len(header_bytes)))
+        file.write(header_bytes)
+        for block, payload in zip(blocks, payloads):
+            file.write(b'\0' * (block['offset'] - file.tell()))
+            file.write(payload)
+    os.replace(tmp_path, path)
+
+
+def read_columnar(path, mmap=True):
+    """
+        Reads a file written by write_columnar. Uncompressed numeric blocks are memory-mapped copy-on-write, so the
+        dataframe shares the file's pages until a value is modified
+        Input: path - file to read
+               mmap - if False, every block is read into memory
+        Returns: dataframe with the original column order and dtypes
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a columnar file" % path)
+        header = json.loads(file.read(struct.unpack('<Q', file.read(8))[0]).decode('utf-8'))
+        n_rows = header['n_rows']
+
+        arrays = {}
+        for block in header['blocks']:
+            if block['kind'] == 'numeric' and block['compression'] is None and mmap and block['nbytes']:
+                values = np.memmap(path, dtype=np.dtype(block['dtype']), mode='c', offset=block['offset'],
+                                   shape=(len(block['columns']), n_rows))
+            else:
+                file.seek(block['offset'])
+                payload = file.read(block['stored_nbytes'])
+                if block['compression'] == 'zlib':
+                    payload = zlib.decompress(payload)
+                if block['kind'] == 'utf8':
+                    arrays[block['columns'][0]] = _decode_strings(payload, n_rows)
+                    continue
+                values = np.frombuffer(bytearray(payload), dtype=np.dtype(block['dtype']))
+                values = values.reshape(len(block['columns']), n_rows)
+            arrays[tuple(block['columns'])] = values
+
+    # The largest block becomes the dataframe without a copy (pandas stores a block as a 2D column-major array),
+    # the other columns are inserted at their original position
+    order = {column: i for i, column in enumerate(header['columns'])}
+    blocks = sorted(arrays.items(), key=lambda item: -len(item[0]) if isinstance(item[0], tuple) else 0)
+    if not blocks:
+        return pd.DataFrame(index=pd.RangeIndex(n_rows))
+    first_columns, first_values = blocks[0]
+    if isinstance(first_columns, tuple):
+        df = pd.DataFrame(first_values.T, columns=list(first_columns), copy=False)
+    else:
+        df = pd.DataFrame({first_columns: first_values})
+    inserted = [(column, values[i]) for columns, values in blocks[1:] if isinstance(columns, tuple)
+                for i, column in enumerate(columns)]
+    inserted += [(column, values) for column, values in blocks[1:] if not isinstance(column, tuple)]
+    for column, values in sorted(inserted, key=lambda item: order[item[0]]):
+        df.insert(sum(order[existing] < order[column] for existing in df.columns), column, values)
+    return df
+
+
+def is_columnar(path):
+    """Returns: True if the path has the extension of the binary columnar format"""
+    return os.path.splitext(str(path))[1] == EXTENSION
+
+
+def read_table(path):
+    """
+        Reads an intermediate table, in the binary columnar format or as CSV depending on the file extension
+        Input: path - .col or CSV file
+        Returns: dataframe
+    """
+    if is_columnar(path):
+        return read_columnar(path)
+    return pd.read_csv(path)
+
+
+def config_compression(config):
+    """
+        Compression of the columnar files written by the steps
+        Input: config - parsed config.yaml (compress in its columnar section)
+        Returns: 'zlib' or None
+    """
+    return 'zlib' if (config or {}).get('columnar', {}).get('compress') else None
+
+
+def write_table(df, path, compression=None):
+    """
+        Writes an intermediate table, in the binary columnar format or as CSV depending on the file extension
+        Input: df - dataframe
+               path - .col or CSV file
+               compression - passed on to write_columnar (ignored for CSV)
+        Returns: None
+    """
+    if is_columnar(path):
+        write_columnar(df, path, compression=compression)
+    else:
+        df.to_csv(path, index=False)
@@ -1,14 +1,38 @@
 import os
+import json
 import logging
 import sys
+import time
+import tempfile
+import urllib.request
+import numpy as np
+import pandas as pd
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, MetaData
+from sqlalchemy import Column, Integer, SmallInteger, String, MetaData
 import sqlalchemy as sql
 from sqlalchemy.orm import sessionmaker
+from src.prediction_cube import mixed_radix_encode, mixed_radix_decode
+from src.instrumentation import instrumented
 
 logger = logging.getLogger(__name__)
 Base = declarative_base()
 
+# Columns that identify a prediction (primary key of pd_predictions)
+KEY_COLUMNS = ['age', 'sex', 'chest_pain', 'fasting_blood_sugar', 'electrocardiographic', 'induced_angina', 'thal']
+
+# Tables used by the shadow-table swap: new predictions are loaded into the shadow table, and the table being
+# replaced is kept as the previous table for rollback
+SHADOW_TABLE = 'pd_predictions_shadow'
+PREVIOUS_TABLE = 'pd_predictions_previous'
+
+# Smallest number of values reserved for every key column in the packed key of pd_predictions_compact (mixed-radix
+# digits starting at 0, in KEY_COLUMNS order), widened to fit the scoring grid. The radices a table was packed with
+# are stored in its pd_predictions_version row, tables loaded before that was done use these.
+PACKED_KEY_RADICES = [256, 2, 4, 2, 4, 3, 4]
+
+# The packed key is stored in a 4-byte signed integer
+MAX_PACKED_KEYS = 2 ** 31
+
 
 class pd_predictions(Base):
     """Creates a table with schema that will be used later in the pipeline for storing predictions"""
@@ -30,6 +54,89 @@ class pd_predictions(Base):
                             self.electrocardiographic,self.induced_angina,self.thal, self.y_prob,self.y_bin)
 
 
+class pd_predictions_version(Base):
+    """Version of every predictions table, bumped by each load so that every app worker notices the change, and the
+    radices its keys are packed with (pd_predictions_compact only, as JSON)"""
+    __tablename__ = 'pd_predictions_version'
+    table_name = Column(String(64), nullable=False, primary_key=True)
+    version = Column(Integer, unique=False, nullable=False)
+    packed_radices = Column(String(100), unique=False, nullable=True)
+
+    def __repr__(self):
+        return "<pd_predictions_version(table_name='%s', version='%d')>" % (self.table_name, self.version)
+
+
+class pd_predictions_compact(Base):
+    """Compact layout of pd_predictions: the seven inputs packed into one integer key and y_prob in basis points"""
+    __tablename__ = 'pd_predictions_compact'
+    packed_key = Column(Integer, nullable=False, primary_key=True, autoincrement=False)
+    y_prob_bp = Column(SmallInteger, unique=False, nullable=False)
+    y_bin = Column(SmallInteger, unique=False, nullable=False)
+
+    def __repr__(self):
+        pred_repr = "<pd_predictions_compact(packed_key='%d', y_prob_bp='%d', y_bin='%d')>"
+        return pred_repr % (self.packed_key, self.y_prob_bp, self.y_bin)
+
+
+def packed_key_radices(df=None, grid=None):
+    """Number of values to reserve for every key column: enough for every row of df or the whole scoring grid, and
+    at least PACKED_KEY_RADICES
+    Args: df - rows to pack, grid - score_data grid of config.yaml (takes precedence)
+    Returns: list of radices in KEY_COLUMNS order
+    Raises: ValueError if a key column has negative values or the keys would not fit a 4-byte integer
+    """
+    if grid is not None:
+        from src.scoring_grid import grid_axes
+        axes = dict(grid_axes(grid))
+        ranges = [(axes[column].min(), axes[column].max()) if column in axes else (0, 0) for column in KEY_COLUMNS]
+    else:
+        ranges = [(df[column].min(), df[column].max()) if len(df) else (0, 0) for column in KEY_COLUMNS]
+    for column, (low, high) in zip(KEY_COLUMNS, ranges):
+        if low < 0:
+            raise ValueError("Column {} has negative values, which do not fit in the packed key".format(column))
+    radices = [max(default, int(high) + 1) for default, (low, high) in zip(PACKED_KEY_RADICES, ranges)]
+    if np.prod(radices, dtype=object) > MAX_PACKED_KEYS:
+        raise ValueError("Packed keys with radices {} do not fit a 4-byte integer".format(radices))
+    return radices
+
+
+def pack_key(values, radices=PACKED_KEY_RADICES):
+    """Packs one combination of the seven inputs (in KEY_COLUMNS order) into the key of pd_predictions_compact
+    Args: values - seven integers, radices - radices the table was packed with
+    Returns: integer key, None if a value does not fit in the key
+    """
+    if len(values) != len(radices) or any(not 0 <= int(value) < radix for value, radix in zip(values, radices)):
+        return None
+    return int(mixed_radix_encode([values], [0] * len(radices), radices)[0])
+
+
+def to_compact(df, radices=PACKED_KEY_RADICES):
+    """Converts scored data (or rows of pd_predictions) to the layout of pd_predictions_compact
+    Args: df - dataframe with KEY_COLUMNS, y_prob (in percent, float or string) and y_bin
+          radices - radices of the packed key
+    Returns: dataframe with packed_key, y_prob_bp and y_bin
+    """
+    keys = mixed_radix_encode(df[KEY_COLUMNS].to_numpy(), [0] * len(radices), radices)
+    if (keys < 0).any():
+        raise ValueError("{} rows have inputs outside of the packed key ranges".format(int((keys < 0).sum())))
+    return pd.DataFrame({'packed_key': keys,
+                         'y_prob_bp': np.rint(df['y_prob'].astype(float).to_numpy() * 100).astype(np.int64),
+                         'y_bin': df['y_bin'].to_numpy().astype(np.int64)})
+
+
+def unpack_compact(df, radices=PACKED_KEY_RADICES):
+    """Converts rows of pd_predictions_compact back to the layout of pd_predictions
+    Args: df - dataframe with packed_key, y_prob_bp and y_bin
+          radices - radices the table was packed with (read_packed_radices)
+    Returns: dataframe with KEY_COLUMNS, y_prob (in percent) and y_bin
+    """
+    values = mixed_radix_decode(df['packed_key'].to_numpy(), [0] * len(radices), radices)
+    unpacked = pd.DataFrame(values, columns=KEY_COLUMNS)
+    unpacked['y_prob'] = df['y_prob_bp'].to_numpy() / 100
+    unpacked['y_bin'] = df['y_bin'].to_numpy()
+    return unpacked
+
+
 def _truncate_pd_predictions(session):
     """Deletes pd_predictions if rerunning and run into unique key error."""
     session.execute('''DELETE FROM pd_predictions''')
@@ -89,10 +196,10 @@ def get_session(engine_string=None):
     return session
 
 
-def create_database_main(df,truncate_flag):
+def engine_string_from_env():
     """
-        Function that takes dataframe amd truncate_flag as input to create a database and add records to it
-        Returns: None
+        Builds the engine string from the RDS or SQLITE details set as environment variables
+        Returns: SQLALCHEMY_DATABASE_URI : engine string
     """
     user = os.environ.get("MYSQL_USER")
     password = os.environ.get("MYSQL_PASSWORD")
@@ -102,41 +209,516 @@ def create_database_main(df,truncate_flag):
     conn_type = "mysql+pymysql"
     SQLALCHEMY_DATABASE_URI = os.environ.get("SQLALCHEMY_DATABASE_URI")
 
-    engine_string = create_engine_string(host, user, password, port, database, conn_type,SQLALCHEMY_DATABASE_URI)
-    if truncate_flag==1:
-        session = get_session(engine_string=engine_string)
-        try:
-            logger.info("Attempting to truncate pd_predictions table.")
-            _truncate_pd_predictions(session)
-            session.commit()
-            logger.info("pd_predictions truncated.")
-        except Exception as e:
-            logger.error("Error occurred while attempting to truncate pd_predictions table.")
-            logger.error(e)
-        finally:
-            session.close()
+    return create_engine_string(host, user, password, port, database, conn_type,SQLALCHEMY_DATABASE_URI)
+
+
+def create_database_main(df,truncate_flag, batch_size=10000, load_data_infile=True, load_mode='append',
+                         schema='legacy'):
+    """
+        Function that takes dataframe amd truncate_flag as input to create a database and add records to it
+        batch_size and load_data_infile are passed on to add_records
+        load_mode - 'append' adds all records (after truncating if truncate_flag is 1),
+                    'incremental' only writes the rows that differ from what is stored,
+                    'swap' loads a shadow table and renames it into place
+        schema - 'legacy' loads pd_predictions, 'compact' loads pd_predictions_compact (append mode only)
+        Returns: None
+    """
+    engine_string = engine_string_from_env()
+    if schema == 'compact':
+        if load_mode != 'append':
+            logger.error("Load mode %s is not supported with the compact schema", load_mode)
+            sys.exit(1)
+        create_db(engine_string)
+        load_compact_records(df, engine_string, truncate=truncate_flag == 1, batch_size=batch_size,
+                             load_data_infile=load_data_infile)
+        predictions_changed(engine_string, 'pd_predictions_compact')
+        return
+    if truncate_flag==1 and load_mode == 'append':
+        truncate_predictions(engine_string)
     # Call the functions to create the database and table
     create_db(engine_string)
-    add_records(df,engine_string)
+    if load_mode == 'incremental':
+        upsert_records(df, engine_string, batch_size=batch_size)
+    elif load_mode == 'swap':
+        swap_records(df, engine_string, batch_size=batch_size, load_data_infile=load_data_infile)
+    else:
+        add_records(df, engine_string, batch_size=batch_size, load_data_infile=load_data_infile)
+    predictions_changed(engine_string, 'pd_predictions')
+
 
+def truncate_predictions(engine_string):
+    """Deletes every record of pd_predictions, logging (not raising) any error"""
+    session = get_session(engine_string=engine_string)
+    try:
+        logger.info("Attempting to truncate pd_predictions table.")
+        _truncate_pd_predictions(session)
+        session.commit()
+        logger.info("pd_predictions truncated.")
+    except Exception as e:
+        logger.error("Error occurred while attempting to truncate pd_predictions table.")
+        logger.error(e)
+    finally:
+        session.close()
 
-def add_records(df,engine_string):
+
+def create_database_streaming(blocks, truncate_flag, batch_size=10000, load_data_infile=True, schema='legacy',
+                              grid=None):
+    """
+        Loads scored records arriving block by block (e.g. the scoring grid generated and scored on the fly), so that
+        only one block is held in memory. Records are appended, after truncating the table if truncate_flag is 1.
+        Input: blocks - iterable of dataframes with the columns of pd_predictions
+               truncate_flag, batch_size, load_data_infile, schema - as in create_database_main
+               grid - scoring grid of config.yaml, the compact keys are packed to fit all of it (not just the first
+                      block). Required with the compact schema
+        Returns: number of records loaded
+    """
+    if schema == 'compact' and grid is None:
+        # Radices derived from the first block would reject a later block with larger values halfway through the load
+        logger.error("The compact schema needs the scoring grid to load records block by block")
+        sys.exit(1)
+    engine_string = engine_string_from_env()
+    create_db(engine_string)
+    if truncate_flag == 1 and schema != 'compact':
+        truncate_predictions(engine_string)
+    n_rows = 0
+    try:
+        radices = packed_key_radices(grid=grid) if schema == 'compact' else None
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    for i, block in enumerate(blocks):
+        if schema == 'compact':
+            load_compact_records(block, engine_string, truncate=truncate_flag == 1 and i == 0, batch_size=batch_size,
+                                 load_data_infile=load_data_infile, radices=radices)
+        else:
+            add_records(block, engine_string, batch_size=batch_size, load_data_infile=load_data_infile)
+        n_rows += len(block)
+    logger.info("%d records loaded block by block", n_rows)
+    predictions_changed(engine_string, 'pd_predictions_compact' if schema == 'compact' else 'pd_predictions')
+    return n_rows
+
+
+def predictions_changed(engine_string, table_name='pd_predictions'):
+    """Records that a predictions table was (re)loaded: bumps its version row, which every app worker checks
+    periodically, and asks the app to reload right away if PREDICTION_CUBE_RELOAD_URL is set
+    Args: engine_string - SQLAlchemy connection string, table_name - table that was loaded
+    Returns: None
+    """
+    bump_table_version(engine_string, table_name)
+    notify_app_reload(os.environ.get("PREDICTION_CUBE_RELOAD_URL"), os.environ.get("PREDICTION_CUBE_RELOAD_TOKEN"))
+
+
+def bump_table_version(engine_string, table_name='pd_predictions'):
+    """Increments the version row of a predictions table (created at 1)
+    Returns: new version
+    """
+    versions = pd_predictions_version.__table__
+    engine = sql.create_engine(engine_string)
+    try:
+        versions.create(engine, checkfirst=True)
+        with engine.begin() as connection:
+            updated = connection.execute(versions.update().where(versions.c.table_name == table_name)
+                                         .values(version=versions.c.version + 1)).rowcount
+            if not updated:
+                connection.execute(versions.insert().values(table_name=table_name, version=1))
+            version = connection.execute(sql.select([versions.c.version])
+                                         .where(versions.c.table_name == table_name)).scalar()
+    finally:
+        engine.dispose()
+    logger.info("%s is now at version %d", table_name, version)
+    return version
+
+
+def store_packed_radices(engine, radices, table_name='pd_predictions_compact'):
+    """Records the radices a compact table is packed with in its version row
+    Args: engine - SQLAlchemy engine, radices - list of radices in KEY_COLUMNS order
+    Returns: None
+    """
+    versions = pd_predictions_version.__table__
+    versions.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        encoded = json.dumps([int(radix) for radix in radices])
+        updated = connection.execute(versions.update().where(versions.c.table_name == table_name)
+                                     .values(packed_radices=encoded)).rowcount
+        if not updated:
+            connection.execute(versions.insert().values(table_name=table_name, version=0, packed_radices=encoded))
+
+
+def read_packed_radices(engine, table_name='pd_predictions_compact'):
+    """Reads the radices a compact table is packed with
+    Args: engine - SQLAlchemy engine or connection string
+    Returns: list of radices, PACKED_KEY_RADICES for tables loaded before the radices were stored
+    """
+    versions = pd_predictions_version.__table__
+    engine = sql.create_engine(engine) if isinstance(engine, str) else engine
+    try:
+        encoded = engine.execute(sql.select([versions.c.packed_radices])
+                                 .where(versions.c.table_name == table_name)).scalar()
+    except sql.exc.DBAPIError:
+        encoded = None
+    return json.loads(encoded) if encoded else list(PACKED_KEY_RADICES)
+
+
+def read_table_version(engine, table_name='pd_predictions'):
+    """Reads what identifies the current content of a predictions table: its version row and its row count (which
+    also catches loads that did not bump the version)
+    Args: engine - SQLAlchemy engine or connection, table_name - predictions table
+    Returns: (version, row count), version being None if the table was never loaded by create_database
+    """
+    versions = pd_predictions_version.__table__
+    try:
+        version = engine.execute(sql.select([versions.c.version]).where(versions.c.table_name == table_name)).scalar()
+    except sql.exc.DBAPIError:
+        version = None
+    count = engine.execute(sql.select([sql.func.count()]).select_from(sql.table(table_name))).scalar()
+    return version, count
+
+
+def notify_app_reload(reload_url, token=None):
+    """Asks a running app to rebuild its prediction cube once pd_predictions has been repopulated
+    Args: reload_url - URL of the app's /reload_cube view (nothing is done if None or empty)
+          token - sent as X-Reload-Token, must match the app's RELOAD_TOKEN
+    Returns: None
+    """
+    if not reload_url:
+        return
+    try:
+        headers = {'X-Reload-Token': token} if token else {}
+        urllib.request.urlopen(urllib.request.Request(reload_url, data=b'', headers=headers, method='POST'),
+                               timeout=10)
+        logger.info("Prediction cube reload requested from %s", reload_url)
+    except Exception as e:
+        logger.warning("Could not ask the app to reload its prediction cube: %s", e)
+
+
+# Applied to the SQLite connection used for bulk loads: the table can always be reloaded from scored_data.csv,
+# so durability of every intermediate page write is traded for speed
+SQLITE_BULK_PRAGMAS = ['PRAGMA synchronous = OFF', 'PRAGMA journal_mode = MEMORY', 'PRAGMA cache_size = -65536']
+
+
+@instrumented
+def add_records(df, engine_string, batch_size=10000, load_data_infile=True, table_name='pd_predictions',
+                model=pd_predictions):
     """Add records to database
-    Args: dataframe and engine string
+    Rows are streamed in batches of tuples through a single prepared INSERT (executemany), with tuned pragmas on
+    SQLite. On MySQL, LOAD DATA LOCAL INFILE is tried first.
+    Args: df - dataframe with the columns of pd_predictions
+          engine_string - SQLAlchemy connection string
+          batch_size - number of rows sent per executemany call
+          load_data_infile - whether LOAD DATA LOCAL INFILE may be used on MySQL
+          table_name - table receiving the rows (pd_predictions or a table with the same columns)
+          model - data model whose columns are loaded (pd_predictions or pd_predictions_compact)
+    Returns: None
+    """
+    columns = [column.name for column in model.__table__.columns]
+    url = sql.engine.url.make_url(engine_string)
+    connect_args = {'local_infile': True} if url.get_backend_name() == 'mysql' and load_data_infile else {}
+    engine = sql.create_engine(engine_string, connect_args=connect_args)
+    start = time.perf_counter()
+
+    try:
+        loaded = False
+        if connect_args:
+            try:
+                _load_data_local_infile(engine, df, table_name, columns)
+                loaded = True
+            except ValueError:
+                # Rows were rejected: the batched inserts would fail the same way
+                raise
+            except Exception as e:
+                logger.warning("LOAD DATA LOCAL INFILE not available (%s), falling back to batched inserts", e)
+        if not loaded:
+            _executemany_records(engine, df, table_name, columns, batch_size)
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+    finally:
+        engine.dispose()
+
+    elapsed = time.perf_counter() - start
+    logger.info("%d records added to %s in %.2fs (%.0f rows/s)", len(df), table_name, elapsed,
+                len(df) / elapsed if elapsed > 0 else float('inf'))
+
+
+def iter_row_batches(df, columns, batch_size):
+    """Yields the rows of a dataframe as lists of tuples of Python scalars, batch_size rows at a time
+    Args: df - dataframe, columns - columns to include (in that order), batch_size - rows per batch
+    Returns: generator of lists of tuples
+    """
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        yield list(zip(*[batch[column].tolist() for column in columns]))
+
+
+def _placeholders(paramstyle, n):
+    """Returns the DBAPI placeholders for n parameters"""
+    return ', '.join(['?' if paramstyle == 'qmark' else '%s'] * n)
+
+
+def _executemany_records(engine, df, table_name, columns, batch_size):
+    """Inserts the rows of df with one prepared statement, batch_size rows per executemany call"""
+    statement = "INSERT INTO {} ({}) VALUES ({})".format(table_name, ', '.join(columns),
+                                                        _placeholders(engine.dialect.paramstyle, len(columns)))
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if engine.dialect.name == 'sqlite':
+            for pragma in SQLITE_BULK_PRAGMAS:
+                cursor.execute(pragma)
+        for rows in iter_row_batches(df, columns, batch_size):
+            cursor.executemany(statement, rows)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def _load_data_local_infile(engine, df, table_name, columns):
+    """Loads the rows of df on MySQL by streaming a temporary CSV file with LOAD DATA LOCAL INFILE
+    LOCAL turns duplicate keys into warnings (IGNORE, stated explicitly), so the number of rows loaded is checked:
+    the load is rolled back with a ValueError if any row was skipped, as the batched inserts fail on duplicates
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+        df[columns].to_csv(file, index=False, header=False)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {} FIELDS TERMINATED BY ',' "
+                       "LINES TERMINATED BY '\\n' ({})".format(table_name, ', '.join(columns)), (file.name,))
+        if cursor.rowcount != len(df):
+            raise ValueError("LOAD DATA loaded {} of {} rows into {} (duplicate keys or invalid rows), load rolled "
+                             "back".format(cursor.rowcount, len(df), table_name))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+        os.remove(file.name)
+
+
+def diff_records(df, stored):
+    """Compares new scored data with the stored predictions by key and prediction value
+    Args: df - new scored dataframe, stored - dataframe read from pd_predictions (y_prob may be a string)
+    Returns: inserts - rows of df whose key is not stored
+             updates - rows of df whose key is stored with a different y_prob or y_bin
+             deletes - keys that are stored but absent from df
+    """
+    columns = KEY_COLUMNS + ['y_prob', 'y_bin']
+    new = df[columns].copy()
+    new['y_prob'] = np.round(new['y_prob'].astype(float), 2)
+    stored = stored[columns].copy()
+    stored['y_prob'] = np.round(stored['y_prob'].astype(float), 2)
+
+    merged = new.merge(stored, on=KEY_COLUMNS, how='outer', suffixes=('', '_stored'), indicator=True)
+    both = merged['_merge'] == 'both'
+    changed = both & ((merged['y_prob'] != merged['y_prob_stored']) | (merged['y_bin'] != merged['y_bin_stored']))
+
+    inserts = merged.loc[merged['_merge'] == 'left_only', columns]
+    updates = merged.loc[changed, columns]
+    deletes = merged.loc[merged['_merge'] == 'right_only', KEY_COLUMNS]
+    for frame in (inserts, updates):
+        frame['y_bin'] = frame['y_bin'].astype(int)
+    return inserts, updates, deletes
+
+
+@instrumented
+def upsert_records(df, engine_string, batch_size=10000):
+    """Brings pd_predictions in line with df by only inserting, updating and deleting the rows that differ
+    Args: df - new scored dataframe, engine_string - SQLAlchemy connection string,
+          batch_size - number of rows sent per executemany call
+    Returns: dictionary with the number of inserted, updated and deleted rows
+    """
+    engine = sql.create_engine(engine_string)
+    start = time.perf_counter()
+    try:
+        stored = pd.read_sql('SELECT * FROM pd_predictions', engine)
+        inserts, updates, deletes = diff_records(df, stored)
+
+        mark = _placeholders(engine.dialect.paramstyle, 1)
+        key_filter = ' AND '.join('{} = {}'.format(column, mark) for column in KEY_COLUMNS)
+        statements = [
+            ("DELETE FROM pd_predictions WHERE {}".format(key_filter), deletes, KEY_COLUMNS),
+            ("UPDATE pd_predictions SET y_prob = {0}, y_bin = {0} WHERE {1}".format(mark, key_filter), updates,
+             ['y_prob', 'y_bin'] + KEY_COLUMNS),
+            ("INSERT INTO pd_predictions ({}) VALUES ({})".format(', '.join(KEY_COLUMNS + ['y_prob', 'y_bin']),
+             _placeholders(engine.dialect.paramstyle, len(KEY_COLUMNS) + 2)), inserts, KEY_COLUMNS + ['y_prob', 'y_bin'])]
+
+        # All changes are applied in one transaction, so readers never see half of a refresh
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for statement, rows, columns in statements:
+                for batch in iter_row_batches(rows, columns, batch_size):
+                    cursor.executemany(statement, batch)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+    finally:
+        engine.dispose()
+
+    changes = dict(inserted=len(inserts), updated=len(updates), deleted=len(deletes))
+    logger.info("pd_predictions refreshed incrementally in %.2fs: %d inserted, %d updated, %d deleted, %d unchanged",
+                time.perf_counter() - start, changes['inserted'], changes['updated'], changes['deleted'],
+                len(stored) - changes['updated'] - changes['deleted'])
+    return changes
+
+
+def _rename_tables(engine, renames):
+    """Applies a list of (old name, new name) table renames atomically
+    MySQL renames all tables in a single RENAME TABLE statement, other backends (SQLite, PostgreSQL) run the
+    ALTER TABLE statements in one transaction since their DDL is transactional.
+    """
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if engine.dialect.name == 'mysql':
+            cursor.execute("RENAME TABLE " + ", ".join("{} TO {}".format(old, new) for old, new in renames))
+        else:
+            cursor.execute("BEGIN")
+            for old, new in renames:
+                cursor.execute("ALTER TABLE {} RENAME TO {}".format(old, new))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+@instrumented
+def swap_records(df, engine_string, batch_size=10000, load_data_infile=True):
+    """Loads df into a shadow table and atomically swaps it with pd_predictions
+    Readers keep querying the complete current table while the shadow table is loaded and validated. The
+    replaced table is kept as pd_predictions_previous so that rollback_records can restore it instantly.
+    Args: df - new scored dataframe, engine_string - SQLAlchemy connection string,
+          batch_size, load_data_infile - passed on to add_records
     Returns: None
     """
     engine = sql.create_engine(engine_string)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    metadata = MetaData()
+    shadow = pd_predictions.__table__.tometadata(metadata, name=SHADOW_TABLE)
+    previous = pd_predictions.__table__.tometadata(metadata, name=PREVIOUS_TABLE)
+    try:
+        # The primary key index is built by the create statement and filled as rows arrive in key order
+        shadow.drop(engine, checkfirst=True)
+        shadow.create(engine)
+        add_records(df, engine_string, batch_size=batch_size, load_data_infile=load_data_infile,
+                    table_name=SHADOW_TABLE)
+
+        n_rows = engine.execute(sql.select([sql.func.count()]).select_from(shadow)).scalar()
+        if n_rows != len(df):
+            shadow.drop(engine)
+            raise ValueError("Shadow table holds {} rows instead of {}, swap aborted".format(n_rows, len(df)))
+
+        previous.drop(engine, checkfirst=True)
+        _rename_tables(engine, [('pd_predictions', PREVIOUS_TABLE), (SHADOW_TABLE, 'pd_predictions')])
+        logger.info("Shadow table with %d rows swapped in, previous predictions kept in %s", n_rows, PREVIOUS_TABLE)
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+    finally:
+        engine.dispose()
+
+
+def rollback_database_main():
+    """
+        Function that restores the predictions replaced by the last shadow-table swap
+        Returns: None
+    """
+    engine_string = engine_string_from_env()
+    rollback_records(engine_string)
+    predictions_changed(engine_string, 'pd_predictions')
 
+
+def rollback_records(engine_string):
+    """Swaps pd_predictions back with the table it replaced during the last shadow-table swap
+    Args: engine_string - SQLAlchemy connection string
+    Returns: None
+    """
+    engine = sql.create_engine(engine_string)
     try:
-        session.bulk_insert_mappings(pd_predictions, df.to_dict(orient="records"))
-        session.commit()
+        if not engine.has_table(PREVIOUS_TABLE):
+            raise ValueError("No previous predictions table to roll back to")
+        _rename_tables(engine, [('pd_predictions', SHADOW_TABLE), (PREVIOUS_TABLE, 'pd_predictions'),
+                                (SHADOW_TABLE, PREVIOUS_TABLE)])
+        logger.info("pd_predictions rolled back to the previous predictions")
     except Exception as e:
         logger.error(e)
         sys.exit(1)
     finally:
-        session.close()
-        return
+        engine.dispose()
+
+
+@instrumented
+def load_compact_records(df, engine_string, truncate=False, batch_size=10000, load_data_infile=True, radices=None):
+    """Converts scored data to the compact layout and loads it into pd_predictions_compact
+    An empty (or truncated) table is packed with radices, stored with it. Rows appended to a filled table are packed
+    with the radices it was packed with.
+    Args: df - dataframe in the layout of scored_data.csv or pd_predictions
+          engine_string - SQLAlchemy connection string
+          truncate - empty pd_predictions_compact first
+          batch_size, load_data_infile - passed on to add_records
+          radices - radices of the packed key (packed_key_radices), by default derived from df
+    Returns: None
+    """
+    engine = sql.create_engine(engine_string)
+    try:
+        empty = truncate or engine.execute('SELECT COUNT(*) FROM pd_predictions_compact').scalar() == 0
+        if empty:
+            radices = radices or packed_key_radices(df=df)
+        else:
+            stored = read_packed_radices(engine)
+            if radices is not None and list(radices) != stored:
+                raise ValueError("pd_predictions_compact is packed with radices {}, not {}: truncate it to reload it "
+                                 "with the new ones".format(stored, list(radices)))
+            radices = stored
+        compact = to_compact(df, radices)
+        if truncate:
+            engine.execute('DELETE FROM pd_predictions_compact')
+            logger.info("pd_predictions_compact truncated.")
+        if empty:
+            store_packed_radices(engine, radices)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    finally:
+        engine.dispose()
+    add_records(compact, engine_string, batch_size=batch_size, load_data_infile=load_data_infile,
+                table_name='pd_predictions_compact', model=pd_predictions_compact)
 
 
+def migrate_database_main(batch_size=10000, load_data_infile=True):
+    """
+        Function that copies the predictions stored in pd_predictions into pd_predictions_compact
+        Returns: None
+    """
+    engine_string = engine_string_from_env()
+    create_db(engine_string)
+    migrate_to_compact(engine_string, batch_size=batch_size, load_data_infile=load_data_infile)
+    predictions_changed(engine_string, 'pd_predictions_compact')
+
+
+def migrate_to_compact(engine_string, batch_size=10000, load_data_infile=True):
+    """Rebuilds pd_predictions_compact from the rows of pd_predictions, leaving pd_predictions untouched
+    Args: engine_string - SQLAlchemy connection string
+          batch_size, load_data_infile - passed on to add_records
+    Returns: number of rows migrated
+    """
+    engine = sql.create_engine(engine_string)
+    try:
+        stored = pd.read_sql('SELECT {}, y_prob, y_bin FROM pd_predictions'.format(', '.join(KEY_COLUMNS)), engine)
+    finally:
+        engine.dispose()
+    load_compact_records(stored, engine_string, truncate=True, batch_size=batch_size,
+                         load_data_infile=load_data_infile)
+    logger.info("%d rows migrated from pd_predictions to pd_predictions_compact", len(stored))
+    return len(stored)
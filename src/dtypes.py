@@ -0,0 +1,71 @@
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Integer types tried, narrowest first, for columns declared 'auto'
+AUTO_INTEGER_TYPES = ['uint8', 'int8', 'uint16', 'int16', 'uint32', 'int32', 'int64']
+
+
+def memory_mb(df):
+    """Returns: memory held by a dataframe (index and object values included) in MB"""
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+def safe_dtype(values, dtype):
+    """
+        Checks that every value of a column is represented exactly by the declared type
+        Input: values - 1D array
+               dtype - declared type name (e.g. 'int8', 'float32'), or 'auto' for the narrowest integer type
+                       holding the values (float32 for columns with non-integer values)
+        Returns: numpy dtype the column can be cast to, None if the values do not fit
+    """
+    if values.dtype.kind not in 'biuf':
+        return None
+    finite = np.isfinite(values) if values.dtype.kind == 'f' else np.ones(len(values), dtype=bool)
+    integral = bool(finite.all()) and (values.dtype.kind in 'biu' or bool((values == np.floor(values)).all()))
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    if dtype == 'auto':
+        if not integral:
+            return np.dtype(np.float32)
+        return next(np.dtype(name) for name in AUTO_INTEGER_TYPES
+                    if np.iinfo(name).min <= low and high <= np.iinfo(name).max)
+
+    target = np.dtype(dtype)
+    if target.kind in 'iu':
+        # Missing or fractional values would be silently truncated
+        if not integral or low < np.iinfo(target).min or high > np.iinfo(target).max:
+            return None
+        return target
+    if target.kind == 'f':
+        if target.itemsize < 8 and finite.any() and np.abs(values[finite]).max() > np.finfo(target).max:
+            return None
+        return target
+    return None
+
+
+def apply_dtypes(df, schema, name='table'):
+    """
+        Casts the columns declared in the schema to their narrow types (in place), logging the memory saved. A column
+        whose values do not fit its declared type keeps its current type, with a warning.
+        Input: df - dataframe
+               schema - dictionary of column name to type name or 'auto' (columns absent from df are ignored),
+                        None to leave df as it is
+               name - name of the table in the log messages
+        Returns: df
+    """
+    if not schema or not isinstance(df, pd.DataFrame):
+        return df
+    before = memory_mb(df)
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        values = df[column].to_numpy()
+        target = safe_dtype(values, dtype)
+        if target is None:
+            logger.warning("Column %s of %s does not fit %s, kept as %s", column, name, dtype, values.dtype)
+        elif target != values.dtype:
+            df[column] = values.astype(target)
+    logger.info("Memory of %s: %.2f MB before the dtypes of config.yaml, %.2f MB after", name, before, memory_mb(df))
+    return df
@@ -0,0 +1,111 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def compile_forest(model):
+    """
+        Flattens the trees of a fitted RandomForestClassifier into shared NumPy node arrays
+        Input: model - Fitted RandomForestClassifier (single output)
+        Returns: Dictionary of node arrays:
+                 feature, threshold - split of every node (leaves point to feature 0)
+                 left, right - global index of the children (leaves point to themselves)
+                 value - class probabilities of every node, normalized as in the tree's predict_proba
+                 roots - global index of the root of every tree
+                 max_depth - depth of the deepest tree
+                 classes - class labels of the model
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(tree.threshold)
+        lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+        rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+
+        value = tree.value[:, 0, :model.n_classes_].copy()
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        values.append(value / normalizer)
+
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    return dict(feature=np.concatenate(features).astype(np.intp),
+                threshold=np.concatenate(thresholds).astype(np.float64),
+                left=np.concatenate(lefts).astype(np.intp),
+                right=np.concatenate(rights).astype(np.intp),
+                value=np.concatenate(values),
+                roots=np.asarray(roots, dtype=np.intp),
+                max_depth=int(max_depth),
+                classes=np.asarray(model.classes_))
+
+
+def predict_proba_flat(forest, X, block_size=None):
+    """
+        Scores rows with a compiled forest, walking all trees for all rows one level at a time
+        Input: forest - Dictionary returned by compile_forest
+               X - 2D array or dataframe of features in training order
+               block_size - number of rows evaluated together (default keeps about 32k tree/row slots per
+                            block so the working set stays in cache)
+        Returns: proba - 2D array of class probabilities, identical to RandomForestClassifier.predict_proba
+    """
+    # Trees compare float32 features against float64 thresholds, as sklearn does
+    X = np.asarray(X, dtype=np.float32).astype(np.float64)
+    n_trees = len(forest['roots'])
+    if block_size is None:
+        block_size = max(256, 32768 // n_trees)
+
+    # Arrays already stored as int32 (e.g. memory-mapped from a model bundle) are used without a copy
+    feature = forest['feature'].astype(np.int32, copy=False)
+    threshold = forest['threshold']
+    # children[2 * node] is the right child and children[2 * node + 1] the left one
+    children = forest.get('children')
+    if children is None:
+        children = np.stack([forest['right'], forest['left']], axis=1).ravel()
+    children = children.astype(np.int32, copy=False)
+    roots = forest['roots'].astype(np.int32, copy=False)
+    value = forest['value']
+
+    proba = np.empty((X.shape[0], value.shape[1]), dtype=np.float64)
+    for start in range(0, X.shape[0], block_size):
+        block = X[start:start + block_size]
+        n_rows = block.shape[0]
+        # Feature-major copy of the block, one slot per (tree, row) pair in tree-major order
+        columns = np.ascontiguousarray(block.T).ravel()
+        rows = np.tile(np.arange(n_rows, dtype=np.int32), n_trees)
+        nodes = np.repeat(roots, n_rows)
+        for level in range(forest['max_depth']):
+            cells = feature.take(nodes)
+            cells *= n_rows
+            cells += rows
+            go_left = columns.take(cells) <= threshold.take(nodes)
+            nodes *= 2
+            nodes += go_left
+            nodes = children.take(nodes)
+
+        # Accumulate tree by tree, in the same order as sklearn, so the floating point sums match exactly
+        leaf_values = value.take(nodes, axis=0).reshape(n_trees, n_rows, -1)
+        total = np.zeros((n_rows, value.shape[1]), dtype=np.float64)
+        for tree_values in leaf_values:
+            total += tree_values
+        total /= n_trees
+        proba[start:start + n_rows] = total
+    return proba
+
+
+def predict_flat(forest, proba):
+    """
+        Derives the class labels from the probabilities instead of traversing the forest a second time
+        Input: forest - Dictionary returned by compile_forest
+               proba - 2D array returned by predict_proba_flat
+        Returns: 1D array of predicted class labels
+    """
+    return forest['classes'].take(np.argmax(proba, axis=1), axis=0)
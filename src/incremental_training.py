@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import pickle
+import logging
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.model_selection import train_test_split
+from src.build_models import build_models, compute_accuracy, save_model_artifacts, split_features_target
+from src.model_bundle import load_bundle
+from src.columnar import read_table
+
+logger = logging.getLogger(__name__)
+
+# Written next to the model files, records what the last full refit and the increments since then were
+STATE_FILE = 'training_state.json'
+
+
+def read_training_state(model_dir):
+    """Returns: training state of the model in model_dir, None if there is none"""
+    try:
+        with open(os.path.join(model_dir, STATE_FILE), 'r') as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_training_state(model_dir, state):
+    tmp_file = os.path.join(model_dir, STATE_FILE + '.tmp')
+    with open(tmp_file, 'w') as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(tmp_file, os.path.join(model_dir, STATE_FILE))
+
+
+def append_history(history_path, new_df):
+    """Appends the new rows to the history of all training rows (CSV), writing only the new rows"""
+    new_file = not os.path.isfile(history_path)
+    new_df.to_csv(history_path, mode='a', header=new_file, index=False)
+
+
+def seed_history(history_path, seed_path):
+    """
+        Starts the history with the rows the current model was trained on, so that the first full refit does not
+        train on the new rows alone
+        Input: history_path - CSV file accumulating every training row (must not exist yet)
+               seed_path - clean data the current model was trained on (clean_data.csv or clean_data.col)
+        Returns: number of rows seeded
+    """
+    if seed_path is None or not os.path.isfile(seed_path):
+        logger.error("No training history at %s and no seed_path to start it from (got %s)", history_path, seed_path)
+        raise SystemExit()
+    seed = read_table(seed_path)
+    append_history(history_path, seed)
+    logger.info("Training history started with the %d rows of %s", len(seed), seed_path)
+    return len(seed)
+
+
+def _fitted_scaler(bundle):
+    """Rebuilds the StandardScaler of the last full refit from the model bundle"""
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(bundle.mean)
+    scaler.scale_ = np.array(bundle.scale)
+    scaler.var_ = scaler.scale_ ** 2
+    return scaler
+
+
+def full_refit(model_dir, history_path, target_column, columns_for_modeling, reason, test_size=0.3, n_estimators=10,
+               max_depth=3, model_params=None):
+    """
+        Rebuilds the model from scratch on the whole history, as build_models does, and resets the training state
+        Returns: dictionary of the new training state
+    """
+    history = pd.read_csv(history_path)
+    fi, auc, confusion, accuracy, classification_report, model, scaler = \
+        build_models(history, target_column, columns_for_modeling, test_size=test_size, n_estimators=n_estimators,
+                     max_depth=max_depth, return_scaler=True, model_params=model_params)
+    save_model_artifacts(model_dir, auc, confusion, accuracy, classification_report, model, scaler,
+                         columns_for_modeling)
+    fi.to_csv(os.path.join(model_dir, 'model_results.csv'), index=False)
+    state = dict(mode='full', reason=reason, baseline_auc=float(auc), last_auc=float(auc), increments=0,
+                 n_estimators=len(model.estimators_), rows_at_full_refit=len(history),
+                 rows_since_full_refit=0, updated=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    _write_training_state(model_dir, state)
+    logger.info("Model fully refitted on %d rows (%s), AUC %.4f", len(history), reason, auc)
+    return state
+
+
+def retrain_incremental(new_df, model_dir, history_path, target_column, columns_for_modeling, test_size=0.3,
+                        n_estimators=10, max_depth=3, model_params=None, new_trees=10, full_refit_every=5,
+                        drift_tolerance=0.05, seed_path=None):
+    """
+        Updates the model with newly arrived rows. The previous model is first scored on the new rows (before
+        seeing them): if its AUC fell more than drift_tolerance below the AUC of the last full refit, or if
+        full_refit_every increments were made since then, the model is fully refitted on the whole history.
+        Otherwise new_trees trees are grown on the new rows only (warm start) and added to the forest, the
+        features being standardized with the scaler of the last full refit. test_size of the new rows are held out
+        of the new trees, the accuracy report of the updated model is computed on them.
+        Input: new_df - clean rows that arrived since the last training
+               model_dir - directory of finalized_model.sav, the model bundle and the training state
+               history_path - CSV file accumulating every training row
+               target_column, columns_for_modeling, test_size, n_estimators, max_depth, model_params - as in
+                   build_models, used by full refits
+               new_trees - number of trees grown on every batch of new rows
+               full_refit_every - number of increments after which the next update is a full refit
+               drift_tolerance - AUC drop on new rows that forces a full refit
+               seed_path - clean data the current model was trained on, copied into the history before the new
+                           rows when there is no history yet (required in that case)
+        Returns: dictionary of the new training state ('mode' is 'full', 'incremental' or 'deferred')
+    """
+    state = read_training_state(model_dir)
+    if not os.path.isfile(history_path):
+        seed_history(history_path, seed_path)
+    append_history(history_path, new_df)
+    refit_args = dict(test_size=test_size, n_estimators=n_estimators, max_depth=max_depth,
+                      model_params=model_params)
+    model_path = os.path.join(model_dir, 'finalized_model.sav')
+    if state is None or not os.path.isfile(model_path):
+        return full_refit(model_dir, history_path, target_column, columns_for_modeling, 'no previous model',
+                          **refit_args)
+    if state['increments'] >= full_refit_every:
+        return full_refit(model_dir, history_path, target_column, columns_for_modeling, 'periodic', **refit_args)
+
+    features, target, temp = split_features_target(new_df, target_column, columns_for_modeling)
+    if target.nunique() < 2:
+        # Trees grown on a single class would change the model's classes, the rows wait for the next refit
+        state.update(mode='deferred', rows_since_full_refit=state['rows_since_full_refit'] + len(new_df))
+        _write_training_state(model_dir, state)
+        logger.warning("New rows hold a single class, kept in the history for the next full refit")
+        return state
+
+    with open(model_path, 'rb') as file:
+        model = pickle.load(file)
+    bundle = load_bundle(os.path.join(model_dir, 'model_bundle'))
+    X_new = bundle.transform(features)
+    y_new = np.asarray(target)
+
+    # Prequential evaluation: the previous model is scored on rows it has not been trained on
+    proba = model.predict_proba(X_new)[:, 1]
+    prequential_auc = compute_accuracy(y_new, proba, model.predict(X_new))[0]
+    if prequential_auc < state['baseline_auc'] - drift_tolerance:
+        logger.warning("AUC on the new rows dropped from %.4f to %.4f", state['baseline_auc'], prequential_auc)
+        return full_refit(model_dir, history_path, target_column, columns_for_modeling, 'drift', **refit_args)
+
+    try:
+        X_fit, X_holdout, y_fit, y_holdout = train_test_split(X_new, y_new, test_size=test_size, stratify=y_new,
+                                                              random_state=1408)
+    except ValueError:
+        # Too few rows of a class to hold some out, the rows wait for the next refit
+        state.update(mode='deferred', rows_since_full_refit=state['rows_since_full_refit'] + len(new_df))
+        _write_training_state(model_dir, state)
+        logger.warning("Too few new rows to evaluate an update, kept in the history for the next full refit")
+        return state
+
+    start = time.perf_counter()
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees)
+    model.fit(X_fit, y_fit)
+    model.set_params(warm_start=False)
+    # The report describes the updated model, on new rows its new trees were not grown on
+    auc, confusion, accuracy, classification_report = \
+        compute_accuracy(y_holdout, model.predict_proba(X_holdout)[:, 1], model.predict(X_holdout))
+    save_model_artifacts(model_dir, auc, confusion, accuracy, classification_report, model, _fitted_scaler(bundle),
+                         columns_for_modeling)
+    state.update(mode='incremental', reason=None, last_auc=float(auc), prequential_auc=float(prequential_auc),
+                 increments=state['increments'] + 1,
+                 n_estimators=len(model.estimators_),
+                 rows_since_full_refit=state['rows_since_full_refit'] + len(new_df),
+                 updated=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    _write_training_state(model_dir, state)
+    logger.info("%d trees grown on %d new rows in %.2fs, the forest now has %d trees (AUC %.4f on %d held out rows)",
+                new_trees, len(y_fit), time.perf_counter() - start, len(model.estimators_), auc, len(y_holdout))
+    return state
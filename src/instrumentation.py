@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# File receiving the JSON lines and directory of the cProfile dumps, both None while instrumentation is disabled.
+# This module imports nothing heavy so the pipeline can instrument a rerun that skips every step.
+_sink = None
+_profile_dir = None
+_sink_lock = threading.Lock()
+# Names of the instrumented calls in progress in every thread, giving each record its parent
+_stack = threading.local()
+
+
+def enable(path, profile_dir=None):
+    """
+        Turns instrumentation on for the whole process
+        Input: path - file the JSON lines are appended to, '-' for stderr
+               profile_dir - if given, every step is run under cProfile and its stats dumped to <step>.prof there
+        Returns: None
+    """
+    global _sink, _profile_dir
+    disable()
+    _sink = sys.stderr if path == '-' else open(path, 'a', buffering=1)
+    _profile_dir = profile_dir
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    logger.info("Instrumentation records written to %s", 'stderr' if path == '-' else path)
+
+
+def disable():
+    """Turns instrumentation off and closes the JSON lines file"""
+    global _sink, _profile_dir
+    if _sink is not None and _sink is not sys.stderr:
+        _sink.close()
+    _sink = None
+    _profile_dir = None
+
+
+def is_enabled():
+    return _sink is not None
+
+
+def peak_rss_mb():
+    """Returns: peak resident set size of the process so far in MB, None where the resource module is missing"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def n_rows(value):
+    """Returns: number of rows of a dataframe or array (of the first element of a tuple), None for anything else"""
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    shape = getattr(value, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+def _emit(record):
+    line = json.dumps(record, default=str)
+    with _sink_lock:
+        if _sink is not None:
+            _sink.write(line + '\n')
+
+
+@contextmanager
+def measure(kind, name, rows_in=None):
+    """
+        Measures the block it wraps and emits one JSON line when it ends (nothing is done while disabled)
+        Input: kind - 'step' or 'stage'
+               name - name of the step or function
+               rows_in - number of input rows, if known
+        Yields: dictionary of the record, extra fields (e.g. rows_out) can be set on it before the block ends
+    """
+    if _sink is None:
+        yield {}
+        return
+    stack = getattr(_stack, 'names', None)
+    if stack is None:
+        stack = _stack.names = []
+    record = dict(kind=kind, name=name, parent=stack[-1] if stack else None, depth=len(stack), pid=os.getpid(),
+                  rows_in=rows_in, rows_out=None)
+    profiler = cProfile.Profile() if kind == 'step' and _profile_dir is not None else None
+    stack.append(name)
+    wall_start, cpu_start, rss_start = time.perf_counter(), time.process_time(), peak_rss_mb()
+    if profiler is not None:
+        profiler.enable()
+    status = 'ok'
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        stack.pop()
+        peak = peak_rss_mb()
+        record.update(status=status, wall_s=round(time.perf_counter() - wall_start, 6),
+                      cpu_s=round(time.process_time() - cpu_start, 6), peak_rss_mb=peak,
+                      peak_rss_growth_mb=None if peak is None else peak - rss_start,
+                      finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        if profiler is not None:
+            record['profile'] = os.path.join(_profile_dir, '%s.prof' % name)
+            profiler.dump_stats(record['profile'])
+        _emit(record)
+
+
+def instrumented(function):
+    """
+        Decorator recording a stage (wall and CPU time, peak RSS, rows of the first argument and of the result) every
+        time the function is called while instrumentation is enabled. Disabled, it costs one global lookup per call.
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _sink is None:
+            return function(*args, **kwargs)
+        with measure('stage', name, rows_in=n_rows(args[0]) if args else None) as record:
+            result = function(*args, **kwargs)
+            record['rows_out'] = n_rows(result)
+        return result
+    return wrapper
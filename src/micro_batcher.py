@@ -0,0 +1,89 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def model_predict_fn(model):
+    """
+        Wraps a fitted classifier into a function that scores a batch in a single predict_proba call
+        Input: model - Fitted model object (e.g. the unpickled finalized_model.sav)
+        Returns: Function taking a 2D array of inputs and returning (y_prob, y_bin) arrays,
+                 y_prob being rounded to two decimals in percent as in score_data
+    """
+    def predict(rows):
+        proba = model.predict_proba(rows)
+        y_prob = np.round(proba[:, 1] * 100, 2)
+        y_bin = model.classes_.take(np.argmax(proba, axis=1))
+        return y_prob, y_bin
+    return predict
+
+
+class MicroBatcher(object):
+    """Groups rows submitted concurrently within a few milliseconds into one vectorized prediction call"""
+
+    def __init__(self, predict_fn, max_batch_size=256, max_wait_ms=5):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, row):
+        """
+            Queues one row of inputs for scoring
+            Input: row - sequence of feature values in model order
+            Returns: Future resolving to a (y_prob, y_bin) tuple
+        """
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def predict(self, rows, timeout=None):
+        """
+            Scores rows through the batcher and waits for the results
+            Input: rows - list of sequences of feature values in model order
+                   timeout - seconds to wait for every row (None waits forever)
+            Returns: list of (y_prob, y_bin) tuples
+        """
+        futures = [self.submit(row) for row in rows]
+        return [future.result(timeout) for future in futures]
+
+    def _collect(self):
+        """Blocks for the first row, then gathers more until the batch is full or the wait window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            rows = [row for row, future in batch]
+            futures = [future for row, future in batch]
+            try:
+                y_prob, y_bin = self.predict_fn(np.asarray(rows))
+            except Exception as e:
+                logger.error("Error in scoring a batch of %d rows", len(rows))
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.rows += len(rows)
+            for future, prob, label in zip(futures, y_prob, y_bin):
+                future.set_result((float(prob), int(label)))
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+from src.flat_forest import compile_forest, predict_proba_flat, predict_flat
+
+logger = logging.getLogger(__name__)
+
+# Version of the on-disk layout, bumped whenever load_bundle can no longer read older bundles
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# Node arrays of the compiled forest, stored as one .npy file each in the dtype used by predict_proba_flat
+FOREST_ARRAYS = dict(feature=np.int32, threshold=np.float64, left=np.int32, right=np.int32, children=np.int32,
+                     value=np.float64, roots=np.int32)
+
+
+class ModelBundle(object):
+    """Trained model loaded from a bundle: preprocessing, flattened forest, feature order and metrics.
+    Exposes predict_proba/predict/classes_ so it can be used wherever the pickled RandomForestClassifier was"""
+
+    def __init__(self, manifest, forest):
+        self.manifest = manifest
+        self.forest = forest
+        self.version = manifest['version']
+        self.features = manifest['features']
+        self.metrics = manifest['metrics']
+        self.classes_ = forest['classes']
+        self.mean = np.asarray(manifest['scaler']['mean'], dtype=np.float64)
+        self.scale = np.asarray(manifest['scaler']['scale'], dtype=np.float64)
+
+    def transform(self, X):
+        """
+            Applies the preprocessing fitted during training (same arithmetic as StandardScaler.transform)
+            Input: X - dataframe holding the bundle's features (any column order) or 2D array in feature order
+            Returns: 2D float64 array of standardized features
+        """
+        if isinstance(X, pd.DataFrame):
+            X = X[self.features]
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean
+        X /= self.scale
+        return X
+
+    def predict_proba(self, X):
+        """Returns: 2D array of class probabilities, identical to the trained forest on standardized inputs"""
+        return predict_proba_flat(self.forest, self.transform(X))
+
+    def predict(self, X):
+        """Returns: 1D array of predicted class labels"""
+        return predict_flat(self.forest, self.predict_proba(X))
+
+
+def _content_hash(manifest, arrays):
+    """Hashes the manifest (without its version) and the bytes of every array, in a fixed order"""
+    digest = hashlib.sha256()
+    body = {key: value for key, value in manifest.items() if key != 'version'}
+    digest.update(json.dumps(body, sort_keys=True).encode('utf-8'))
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(name.encode('utf-8'))
+        digest.update(str(array.dtype).encode('utf-8'))
+        digest.update(str(array.shape).encode('utf-8'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def save_bundle(path, model, scaler, features, metrics=None):
+    """
+        Writes a trained model and its preprocessing as a versioned bundle directory, replacing any previous bundle
+        Input: path - directory of the bundle
+               model - fitted RandomForestClassifier
+               scaler - fitted StandardScaler applied to the features before training
+               features - feature names in training order
+               metrics - dictionary of JSON-serializable evaluation metrics
+        Returns: version of the bundle (content hash)
+    """
+    forest = compile_forest(model)
+    forest['children'] = np.stack([forest['right'], forest['left']], axis=1).ravel()
+    arrays = {name: np.ascontiguousarray(forest[name], dtype=dtype) for name, dtype in FOREST_ARRAYS.items()}
+    manifest = dict(format_version=FORMAT_VERSION,
+                    features=list(features),
+                    classes=np.asarray(forest['classes']).tolist(),
+                    max_depth=forest['max_depth'],
+                    scaler=dict(mean=np.asarray(scaler.mean_, dtype=np.float64).tolist(),
+                                scale=np.asarray(scaler.scale_, dtype=np.float64).tolist()),
+                    metrics=metrics or {},
+                    arrays={name: dict(dtype=str(array.dtype), shape=list(array.shape))
+                            for name, array in arrays.items()})
+    manifest['version'] = _content_hash(manifest, arrays)[:16]
+    manifest['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    # Written next to the destination and renamed into place so readers never see a partial bundle
+    path = os.path.normpath(path)
+    tmp_path = tempfile.mkdtemp(prefix='.' + os.path.basename(path) + '.', dir=os.path.dirname(path) or '.')
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        if os.path.isdir(path):
+            old_path = tmp_path + '.old'
+            os.rename(path, old_path)
+            os.rename(tmp_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.rename(tmp_path, path)
+    except Exception as e:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        logger.error("Unable to write the model bundle to %s", path)
+        logger.error(e)
+        raise SystemExit()
+    logger.info("Model bundle %s saved to %s", manifest['version'], path)
+    return manifest['version']
+
+
+def load_bundle(path, verify=False):
+    """
+        Loads a bundle, memory-mapping its node arrays so processes loading the same bundle share their pages
+        Input: path - directory written by save_bundle
+               verify - if True, re-hashes the content and fails if it does not match the bundle's version
+        Returns: ModelBundle
+    """
+    try:
+        with open(os.path.join(path, MANIFEST), 'r') as file:
+            manifest = json.load(file)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError("Unsupported model bundle format %s" % manifest.get('format_version'))
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in manifest['arrays']}
+        if verify and _content_hash({k: v for k, v in manifest.items() if k != 'created'}, arrays)[:16] \
+                != manifest['version']:
+            raise ValueError("Content of the model bundle does not match version %s" % manifest['version'])
+    except Exception as e:
+        logger.error("Unable to load the model bundle from %s", path)
+        logger.error(e)
+        raise SystemExit()
+
+    forest = dict(arrays, max_depth=manifest['max_depth'], classes=np.asarray(manifest['classes']))
+    logger.info("Model bundle %s loaded from %s", manifest['version'], path)
+    return ModelBundle(manifest, forest)
+
+
+def is_bundle(path):
+    """Returns: True if path is a model bundle directory rather than a pickled model object"""
+    return os.path.isfile(os.path.join(path, MANIFEST))
@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import StratifiedKFold, ParameterGrid, ParameterSampler
+from sklearn.preprocessing import StandardScaler
+from src.build_models import split_features_target, split_test_train
+
+logger = logging.getLogger(__name__)
+
+# Folds (already standardized) and best complete score shared by the candidates evaluated in a worker process
+_folds = None
+_best_score = None
+
+
+def make_folds(X, y, cv_folds=5, random_state=1408):
+    """
+        Splits the training rows into stratified folds and standardizes every fold once, so that all the
+        candidates are evaluated on the same precomputed matrices
+        Input: X - 2D array of features
+               y - 1D array of labels
+               cv_folds - number of folds
+               random_state - seed of the fold assignment
+        Returns: list of (X_train, y_train, X_valid, y_valid) with features scaled on the fold's training rows
+    """
+    folds = []
+    splitter = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=random_state)
+    for train_index, valid_index in splitter.split(X, y):
+        scaler = StandardScaler().fit(X[train_index])
+        # Trees work on float32, converting once here saves the conversion in every fit
+        folds.append((scaler.transform(X[train_index]).astype(np.float32), y[train_index],
+                      scaler.transform(X[valid_index]).astype(np.float32), y[valid_index]))
+    return folds
+
+
+def candidate_space(space, strategy='grid', n_iter=20, random_state=1408):
+    """
+        Lists the hyperparameter combinations to evaluate
+        Input: space - dictionary of hyperparameter name to list of values
+               strategy - 'grid' for every combination, 'random' for n_iter combinations drawn from the space
+        Returns: list of dictionaries of hyperparameters
+    """
+    if strategy == 'grid':
+        return list(ParameterGrid(space))
+    if strategy == 'random':
+        n_combinations = len(ParameterGrid(space))
+        return list(ParameterSampler(space, n_iter=min(n_iter, n_combinations), random_state=random_state))
+    raise ValueError("Unknown search strategy %s" % strategy)
+
+
+def _init_worker(folds, best_score):
+    global _folds, _best_score
+    _folds = folds
+    _best_score = best_score
+
+
+def _evaluate(params, early_stop_margin, min_folds):
+    """
+        Cross-validates one candidate fold by fold, giving up as soon as its mean AUC after min_folds folds is more
+        than early_stop_margin below the best candidate evaluated on all folds so far
+        Returns: dictionary with the candidate's hyperparameters, scores, number of folds evaluated and status
+    """
+    start = time.perf_counter()
+    scores = []
+    status = 'complete'
+    for X_train, y_train, X_valid, y_valid in _folds:
+        model = RandomForestClassifier(random_state=1408, n_jobs=1, **params).fit(X_train, y_train)
+        scores.append(roc_auc_score(y_valid, model.predict_proba(X_valid)[:, 1]))
+        if len(scores) >= min_folds and len(scores) < len(_folds) and \
+                np.mean(scores) < _best_score.value - early_stop_margin:
+            status = 'pruned'
+            break
+    if status == 'complete':
+        with _best_score.get_lock():
+            _best_score.value = max(_best_score.value, float(np.mean(scores)))
+    return dict(params=params, mean_auc=float(np.mean(scores)), std_auc=float(np.std(scores)),
+                folds=len(scores), status=status, seconds=time.perf_counter() - start)
+
+
+def search_hyperparameters(df, target_column, columns_for_modeling, space, test_size=0.3, strategy='grid',
+                           n_iter=20, cv_folds=5, n_jobs=None, early_stop_margin=0.05, min_folds=2):
+    """
+        Searches the random forest hyperparameters with k-fold cross-validation on a pool of worker processes.
+        Only the training rows of build_models' split are used, the test rows stay unseen until the final model.
+        Input: df - Input dataframe with features and target
+               target_column, columns_for_modeling, test_size - as in build_models
+               space - dictionary of RandomForestClassifier hyperparameter name to list of values
+               strategy, n_iter - passed on to candidate_space
+               cv_folds - number of cross-validation folds
+               n_jobs - number of worker processes (default: number of CPUs, 1 evaluates in this process)
+               early_stop_margin - AUC margin under the best complete candidate from which a candidate is pruned
+               min_folds - folds a candidate is evaluated on before it can be pruned
+        Returns: best_params - hyperparameters of the best complete candidate
+                 leaderboard - dataframe of every candidate, best first
+    """
+    features, target, temp = split_features_target(df, target_column, columns_for_modeling)
+    X_train, X_test, y_train, y_test = split_test_train(features, target, test_size)
+    try:
+        candidates = candidate_space(space, strategy, n_iter)
+    except (ValueError, TypeError) as e:
+        logger.error(e)
+        raise SystemExit()
+    folds = make_folds(np.asarray(X_train, dtype=np.float64), np.asarray(y_train), cv_folds)
+    best_score = multiprocessing.Value('d', -np.inf)
+    n_jobs = n_jobs or multiprocessing.cpu_count()
+    logger.info("Evaluating %d candidates with %d-fold cross-validation on %d processes", len(candidates),
+                cv_folds, n_jobs)
+
+    start = time.perf_counter()
+    if n_jobs == 1:
+        _init_worker(folds, best_score)
+        results = [_evaluate(params, early_stop_margin, min_folds) for params in candidates]
+    else:
+        with multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=(folds, best_score)) as pool:
+            results = pool.starmap(_evaluate, [(params, early_stop_margin, min_folds) for params in candidates],
+                                   chunksize=1)
+
+    # Hyperparameters are kept as objects so that None (e.g. unlimited max_depth) does not turn integers to floats
+    leaderboard = pd.DataFrame([result['params'] for result in results], dtype=object)
+    for column in ['mean_auc', 'std_auc', 'folds', 'status', 'seconds']:
+        leaderboard[column] = [result[column] for result in results]
+    leaderboard['complete'] = leaderboard['status'] == 'complete'
+    leaderboard = leaderboard.sort_values(['complete', 'mean_auc'], ascending=[False, False]) \
+        .drop(columns='complete').reset_index(drop=True)
+    leaderboard.insert(0, 'rank', np.arange(1, len(leaderboard) + 1))
+    best_params = next(result['params'] for result in sorted(results, key=lambda result: -result['mean_auc'])
+                       if result['status'] == 'complete')
+    logger.info("Search finished in %.1fs, %d of %d candidates pruned, best mean AUC %.4f with %s",
+                time.perf_counter() - start, int((leaderboard['status'] == 'pruned').sum()), len(candidates),
+                leaderboard['mean_auc'].iloc[0], best_params)
+    return best_params, leaderboard
+
+
+def split_search_params(best_params):
+    """
+        Splits the best hyperparameters into build_models arguments
+        Returns: dictionary with n_estimators and max_depth (when searched) and model_params holding the others
+    """
+    params = dict(best_params)
+    arguments = {name: params.pop(name) for name in ['n_estimators', 'max_depth'] if name in params}
+    arguments['model_params'] = params
+    return arguments
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import importlib
+import importlib.util
+from collections import namedtuple
+from src.instrumentation import measure
+
+logger = logging.getLogger(__name__)
+
+# A step of the pipeline: the artifacts it reads and writes, the config.yaml section and source modules it depends
+# on, and the function running it (taking the pipeline context, returning the produced artifacts by name).
+# Modules are given by name and only imported when a step runs, so a no-op rerun never imports pandas or sklearn.
+Step = namedtuple('Step', ['name', 'inputs', 'outputs', 'config_section', 'modules', 'run'])
+
+
+def file_hash(path):
+    """
+        Hashes the content of a file, or of every file of a directory (by relative path, in sorted order)
+        Input: path - file or directory
+        Returns: hex digest, None if the path does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                digest.update(os.path.relpath(os.path.join(root, name), path).encode('utf-8'))
+                digest.update(file_hash(os.path.join(root, name)).encode('utf-8'))
+        return digest.hexdigest()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_hash(path):
+    """Hashes a step input: a local file or directory, or an s3://bucket/prefix of partition files (from its
+    listing, so nothing is downloaded to decide whether the step can be skipped)"""
+    if path is None:
+        # Generated input (the scoring grid), covered by the step's config section
+        return None
+    if str(path).startswith('s3://'):
+        return importlib.import_module('src.read_from_s3').prefix_fingerprint(path)
+    return file_hash(path)
+
+
+def code_hash(modules):
+    """Hashes the source files of the modules a step runs, so editing the code invalidates the step"""
+    digest = hashlib.sha256()
+    for module in modules:
+        digest.update(file_hash(importlib.util.find_spec(module).origin).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PipelineContext(object):
+    """Artifacts shared by the steps of one run: kept in memory once produced or loaded, read from disk otherwise"""
+
+    def __init__(self, config, paths, options):
+        self.config = config
+        self.paths = paths
+        self.options = options
+        self._artifacts = {}
+
+    def get(self, name):
+        """Returns: the artifact, loaded from its path the first time it is needed"""
+        if name not in self._artifacts:
+            path = self.paths[name]
+            if name == 'model':
+                self._artifacts[name] = importlib.import_module('src.model_bundle').load_bundle(path)
+            else:
+                self._artifacts[name] = importlib.import_module('src.dtypes').apply_dtypes(
+                    read_artifact(path), self.config.get('dtypes'), name)
+            logger.debug("Artifact %s loaded from %s", name, path)
+        return self._artifacts[name]
+
+    def put(self, name, value):
+        self._artifacts[name] = value
+
+
+def read_artifact(path):
+    """Reads a tabular artifact, as CSV or in the binary columnar format depending on its extension, or from all
+    the partition files of an s3://bucket/prefix"""
+    if str(path).startswith('s3://'):
+        read_from_s3 = importlib.import_module('src.read_from_s3')
+        return read_from_s3.read_s3_prefix(*read_from_s3.split_s3_uri(path))
+    return importlib.import_module('src.columnar').read_table(path)
+
+
+def write_artifact(df, path, config=None):
+    """Writes a tabular artifact, as CSV or in the binary columnar format depending on its extension (compressed if
+    set in the columnar section of config)"""
+    columnar = importlib.import_module('src.columnar')
+    columnar.write_table(df, path, compression=columnar.config_compression(config))
+
+
+def _run_clean_data(context):
+    df = importlib.import_module('src.clean_data').clean_data(context.get('raw').copy(), **context.config['clean_data'])
+    df = importlib.import_module('src.dtypes').apply_dtypes(df, context.config.get('dtypes'), 'clean')
+    write_artifact(df, context.paths['clean'], context.config)
+    return dict(clean=df)
+
+
+def _run_build_models(context):
+    build_models = importlib.import_module('src.build_models')
+    fi, auc, confusion, accuracy, classification_report, model, scaler = \
+        build_models.build_models(context.get('clean'), return_scaler=True, **context.config['build_models'])
+    write_artifact(fi, os.path.join(context.paths['output_dir'], 'model_results.csv'), context.config)
+    bundle_path = build_models.save_model_artifacts(context.paths['output_dir'], auc, confusion, accuracy,
+                                                    classification_report, model, scaler,
+                                                    context.config['build_models']['columns_for_modeling'])
+    return dict(model=importlib.import_module('src.model_bundle').load_bundle(bundle_path))
+
+
+def _run_score_data(context):
+    if context.paths['grid'] is None:
+        grid = importlib.import_module('src.scoring_grid').build_grid(context.config['score_data']['grid'],
+                                                                      dtypes=context.config.get('dtypes'))
+    else:
+        grid = context.get('grid').copy()
+    df = importlib.import_module('src.score_data').score_data(grid, context.get('model'),
+                                                              dtypes=context.config.get('dtypes'))
+    write_artifact(df, context.paths['scored'], context.config)
+    return dict(scored=df)
+
+
+def _run_database(context):
+    options = context.options
+    importlib.import_module('src.create_database').create_database_main(
+        context.get('scored'), options['truncate_flag'], load_mode=options['load_mode'], schema=options['schema'],
+        **context.config.get('database', {}))
+    return {}
+
+
+STEPS = [
+    Step('clean_data', ['raw'], ['clean'], 'clean_data', ['src.clean_data', 'src.columnar', 'src.dtypes'],
+         _run_clean_data),
+    Step('build_models', ['clean'], ['model'], 'build_models',
+         ['src.build_models', 'src.model_bundle', 'src.flat_forest', 'src.dtypes'], _run_build_models),
+    Step('score_data', ['model', 'grid'], ['scored'], 'score_data',
+         ['src.score_data', 'src.scoring_grid', 'src.model_bundle', 'src.flat_forest', 'src.columnar', 'src.dtypes'],
+         _run_score_data),
+    Step('database', ['scored'], [], 'database', ['src.create_database', 'src.prediction_cube'], _run_database),
+]
+
+
+def step_key(step, config, options, paths):
+    """
+        Fingerprint of everything a step depends on: its inputs' content, its config section, the load options
+        (database step) and the source code it runs
+        Returns: hex digest
+    """
+    fingerprint = dict(step=step.name,
+                       inputs={name: input_hash(paths[name]) for name in step.inputs},
+                       config=config.get(step.config_section) if step.config_section else None,
+                       dtypes=config.get('dtypes'),
+                       columnar=config.get('columnar'),
+                       options=options if step.name == 'database' else None,
+                       code=code_hash(step.modules))
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _read_state(state_file):
+    try:
+        with open(state_file, 'r') as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_state(state_file, state):
+    """Writes the state file atomically so an interrupted run never leaves it half written"""
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(tmp_file, state_file)
+
+
+def run_pipeline(config, force=False, truncate_flag=0, load_mode='append', schema='legacy', steps=None):
+    """
+        Runs clean_data -> build_models -> score_data -> database in one process, passing dataframes in memory
+        and skipping every step whose inputs, config section and code are unchanged since its last successful run
+        Input: config - parsed config.yaml (the pipeline section gives the paths)
+               force - run every step even if unchanged
+               truncate_flag, load_mode, schema - passed on to create_database_main
+               steps - names of the steps to consider (default all of them, in order)
+        Returns: dictionary of step name to 'ran' or 'skipped'
+    """
+    paths_config = config['pipeline']
+    output_dir = paths_config['output_dir']
+    extension = paths_config.get('intermediate_format', 'csv')
+    paths = dict(raw=paths_config['raw_data'],
+                 grid=paths_config.get('to_be_scored'),
+                 clean=os.path.join(output_dir, 'clean_data.' + extension),
+                 model=os.path.join(output_dir, 'model_bundle'),
+                 scored=os.path.join(output_dir, 'scored_data.' + extension),
+                 output_dir=output_dir)
+    state_file = paths_config.get('state_file') or os.path.join(output_dir, 'pipeline_state.json')
+    options = dict(truncate_flag=truncate_flag, load_mode=load_mode, schema=schema)
+    context = PipelineContext(config, paths, options)
+    state = _read_state(state_file)
+    statuses = {}
+
+    for step in STEPS:
+        if steps is not None and step.name not in steps:
+            continue
+        key = step_key(step, config, options, paths)
+        previous = state.get(step.name, {})
+        outputs_intact = all(previous.get('outputs', {}).get(name) == file_hash(paths[name])
+                             for name in step.outputs)
+        if not force and previous.get('key') == key and outputs_intact:
+            logger.info("Step %s skipped, inputs, config and code unchanged", step.name)
+            statuses[step.name] = 'skipped'
+            continue
+
+        start = time.perf_counter()
+        with measure('step', step.name):
+            for name, value in step.run(context).items():
+                context.put(name, value)
+        state[step.name] = dict(key=key, outputs={name: file_hash(paths[name]) for name in step.outputs},
+                                finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        _write_state(state_file, state)
+        logger.info("Step %s ran in %.2fs", step.name, time.perf_counter() - start)
+        statuses[step.name] = 'ran'
+    return statuses
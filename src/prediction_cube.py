@@ -0,0 +1,135 @@
+import logging
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Order of the model inputs that make up the scoring grid (and the pd_predictions key)
+GRID_COLUMNS = ['age', 'sex', 'chest_pain', 'fasting_blood_sugar', 'electrocardiographic', 'induced_angina', 'thal']
+
+# Sentinel stored in the probability array for grid cells that have no prediction
+MISSING_PROB = np.iinfo(np.uint16).max
+
+# Lightweight stand-in for a pd_predictions row, exposes the attributes used by index.html
+Prediction = namedtuple('Prediction', ['y_prob', 'y_bin'])
+
+
+def mixed_radix_strides(radices):
+    """
+        Computes the stride of every digit of a mixed-radix number (last digit varies fastest)
+        Input: radices - number of distinct values of every digit
+        Returns: strides - list of integers, one per digit
+    """
+    strides = [1] * len(radices)
+    for i in range(len(radices) - 2, -1, -1):
+        strides[i] = strides[i + 1] * int(radices[i + 1])
+    return strides
+
+
+def mixed_radix_encode(values, offsets, radices):
+    """
+        Encodes rows of integer inputs into a single mixed-radix code
+        Input: values - 2D array with one column per digit
+               offsets - smallest value of every digit
+               radices - number of distinct values of every digit
+        Returns: codes - 1D int64 array (-1 for rows that fall outside of the grid)
+    """
+    digits = np.asarray(values, dtype=np.int64) - np.asarray(offsets, dtype=np.int64)
+    in_grid = ((digits >= 0) & (digits < np.asarray(radices, dtype=np.int64))).all(axis=1)
+    codes = digits.dot(np.asarray(mixed_radix_strides(radices), dtype=np.int64))
+    codes[~in_grid] = -1
+    return codes
+
+
+def mixed_radix_decode(codes, offsets, radices):
+    """
+        Decodes mixed-radix codes back into rows of integer inputs
+        Input: codes - 1D integer array
+               offsets - smallest value of every digit
+               radices - number of distinct values of every digit
+        Returns: values - 2D int64 array with one column per digit
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.empty((len(codes), len(radices)), dtype=np.int64)
+    for i, stride in enumerate(mixed_radix_strides(radices)):
+        values[:, i] = (codes // stride) % int(radices[i]) + int(offsets[i])
+    return values
+
+
+class PredictionCube(object):
+    """Dense in-memory copy of the pd_predictions grid, indexed by the mixed-radix code of the seven inputs"""
+
+    def __init__(self, offsets, radices, y_prob_bp, y_bin, n_rows=None):
+        self.offsets = [int(x) for x in offsets]
+        self.radices = [int(x) for x in radices]
+        self.strides = mixed_radix_strides(self.radices)
+        self.y_prob_bp = y_prob_bp
+        self.y_bin = y_bin
+        # Passed in by shared segments, so that attaching one does not read the whole array
+        self.n_rows = int(np.count_nonzero(y_prob_bp != MISSING_PROB)) if n_rows is None else n_rows
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+            Builds the cube from a dataframe of predictions
+            Input: df - Dataframe with the grid columns, y_prob (in percent, float or string) and y_bin
+            Returns: PredictionCube
+        """
+        keys = df[GRID_COLUMNS].to_numpy(dtype=np.int64)
+        offsets = keys.min(axis=0)
+        radices = keys.max(axis=0) - offsets + 1
+        codes = mixed_radix_encode(keys, offsets, radices)
+
+        y_prob_bp = np.full(int(np.prod(radices)), MISSING_PROB, dtype=np.uint16)
+        y_bin = np.zeros(len(y_prob_bp), dtype=np.int8)
+        y_prob_bp[codes] = np.rint(df['y_prob'].astype(float).to_numpy() * 100)
+        y_bin[codes] = df['y_bin'].to_numpy()
+        return cls(offsets, radices, y_prob_bp, y_bin)
+
+    @property
+    def size(self):
+        """Number of cells in the cube (filled or not)"""
+        return len(self.y_prob_bp)
+
+    def lookup(self, values):
+        """
+            Looks up the prediction for one combination of the seven inputs
+            Input: values - sequence of integers in GRID_COLUMNS order
+            Returns: list with the matching Prediction (empty if the grid cell has no prediction),
+                     None if the combination lies outside of the grid
+        """
+        code = 0
+        for value, offset, radix, stride in zip(values, self.offsets, self.radices, self.strides):
+            digit = value - offset
+            if digit < 0 or digit >= radix:
+                return None
+            code += digit * stride
+
+        prob_bp = self.y_prob_bp[code]
+        if prob_bp == MISSING_PROB:
+            return []
+        return [Prediction(y_prob=str(int(prob_bp) / 100), y_bin=int(self.y_bin[code]))]
+
+
+def load_prediction_cube(engine, schema='legacy'):
+    """
+        Reads the predictions table once and packs it into a PredictionCube
+        Input: engine - SQLAlchemy engine or connection string
+               schema - 'legacy' reads pd_predictions, 'compact' reads pd_predictions_compact
+        Returns: PredictionCube, None if the table is empty
+    """
+    if schema == 'compact':
+        from src.create_database import unpack_compact, read_packed_radices
+        df = unpack_compact(pd.read_sql('SELECT packed_key, y_prob_bp, y_bin FROM pd_predictions_compact', engine),
+                            read_packed_radices(engine))
+    else:
+        df = pd.read_sql('SELECT {}, y_prob, y_bin FROM pd_predictions'.format(', '.join(GRID_COLUMNS)), engine)
+    if len(df) == 0:
+        logger.warning("pd_predictions is empty, prediction cube not built")
+        return None
+
+    cube = PredictionCube.from_frame(df)
+    logger.info("Prediction cube loaded with %d predictions in %d cells (%d bytes)", cube.n_rows, cube.size,
+                cube.y_prob_bp.nbytes + cube.y_bin.nbytes)
+    return cube
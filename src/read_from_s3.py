@@ -2,25 +2,177 @@ import os
 import boto3
 import sys
 import logging
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import botocore
+import pandas as pd
+from src.s3_transfer import s3_client, transfer_config, file_checksums, head_object, is_unchanged, with_retries
 
 logger = logging.getLogger(__name__)
 
-def read_from_s3(S3_BUCKET_NAME=None, RAW_CSV_PATH=None):
+def read_from_s3(S3_BUCKET_NAME=None, RAW_CSV_PATH=None, S3_KEY='heart.csv', MULTIPART_THRESHOLD_MB=8,
+                 MULTIPART_CHUNKSIZE_MB=8, MAX_CONCURRENCY=10, MAX_ATTEMPTS=5, SKIP_UNCHANGED=True, s3=None):
     """Function that pulls the raw data from S3 and places it in the specified location
+    Objects above the multipart threshold are downloaded with parallel ranged requests, and nothing is downloaded
+    if the local file already holds the same bytes as the object.
         Inputs:
             S3_BUCKET: Name of S3 bucket
             RAW_CSV_PATH: Location of the raw data file where the data needs to be placed
+            S3_KEY: Key of the object, saved under the same file name in RAW_CSV_PATH
+            MULTIPART_THRESHOLD_MB, MULTIPART_CHUNKSIZE_MB, MAX_CONCURRENCY: Multipart transfer settings
+            MAX_ATTEMPTS: Attempts of the download, with exponential backoff between them
+            SKIP_UNCHANGED: If True, nothing is downloaded when the local file's checksum matches the object
+            s3: S3 client (default: created from the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables)
+        Returns:
+            True if the object was downloaded, False if it was skipped
     """
 
-    S3_PUBLIC_KEY = os.environ.get("AWS_ACCESS_KEY_ID")
-    S3_SECRET_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
-    RAW_CSV_PATH = RAW_CSV_PATH + '/heart.csv'
+    RAW_CSV_PATH = os.path.join(RAW_CSV_PATH, os.path.basename(S3_KEY))
+    config = transfer_config(MULTIPART_THRESHOLD_MB, MULTIPART_CHUNKSIZE_MB, MAX_CONCURRENCY)
 
     try:
-        s3 = boto3.client('s3', aws_access_key_id=S3_PUBLIC_KEY, aws_secret_access_key=S3_SECRET_KEY)
-        s3.download_file(S3_BUCKET_NAME, 'heart.csv', RAW_CSV_PATH)
+        if s3 is None:
+            s3 = s3_client(MAX_CONCURRENCY, MAX_ATTEMPTS)
+        if SKIP_UNCHANGED and os.path.isfile(RAW_CSV_PATH):
+            head = with_retries(lambda: head_object(s3, S3_BUCKET_NAME, S3_KEY), MAX_ATTEMPTS)
+            # The local file is only hashed when its size matches the object
+            if head is not None and head.get('ContentLength') == os.path.getsize(RAW_CSV_PATH) and \
+                    is_unchanged(head, *file_checksums(RAW_CSV_PATH, config)):
+                logger.info("%s already matches s3://%s/%s, download skipped", RAW_CSV_PATH, S3_BUCKET_NAME, S3_KEY)
+                return False
+        with_retries(lambda: s3.download_file(S3_BUCKET_NAME, S3_KEY, RAW_CSV_PATH, Config=config), MAX_ATTEMPTS)
         logger.info("Raw data downloaded from S3 bucket successfully")
     except Exception as e:
         logger.error(e)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    return True
+
+
+def split_s3_uri(uri):
+    """Splits s3://bucket/prefix into (bucket, prefix)"""
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix
+
+
+def list_prefix(s3, bucket, prefix, suffixes=('.csv', '.csv.gz')):
+    """
+        Lists the data files under a prefix
+        Input: s3 - S3 client
+               bucket, prefix - location of the partition files
+               suffixes - only keys ending with one of these are kept
+        Returns: list of (key, ETag, size) sorted by key
+    """
+    objects = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            if item['Key'].endswith(tuple(suffixes)):
+                objects.append((item['Key'], item.get('ETag', '').strip('"'), item.get('Size')))
+    return sorted(objects)
+
+
+def prefix_fingerprint(uri, s3=None):
+    """
+        Fingerprints the content of a prefix from its listing alone (keys, ETags and sizes), without reading it
+        Input: uri - s3://bucket/prefix
+        Returns: hex digest
+    """
+    bucket, prefix = split_s3_uri(uri)
+    listing = list_prefix(s3 or s3_client(), bucket, prefix)
+    return hashlib.sha256(repr(listing).encode('utf-8')).hexdigest()
+
+
+def _read_object(s3, bucket, key, max_attempts, read_csv_kwargs):
+    """Parses one object straight from the response body, retrying the whole request on transient errors"""
+    def fetch():
+        body = s3.get_object(Bucket=bucket, Key=key)['Body']
+        try:
+            return pd.read_csv(body, compression='gzip' if key.endswith('.gz') else None, **read_csv_kwargs)
+        finally:
+            body.close()
+    return with_retries(fetch, max_attempts)
+
+
+def iter_s3_prefix(S3_BUCKET_NAME=None, S3_PREFIX=None, MAX_CONCURRENCY=16, MAX_ATTEMPTS=5, s3=None,
+                   **read_csv_kwargs):
+    """Fetches and parses the partition files of a prefix on a pool of threads, yielding the frames in key order
+        At most two objects per thread are in flight, which bounds memory whatever the number of files.
+        Inputs:
+            S3_BUCKET_NAME, S3_PREFIX: Location of the partition files (.csv or .csv.gz)
+            MAX_CONCURRENCY: Number of objects fetched at the same time (and size of the connection pool)
+            MAX_ATTEMPTS: Attempts of every object, with exponential backoff between them
+            s3: S3 client (default: created from the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables)
+            read_csv_kwargs: Passed on to pd.read_csv
+        Yields:
+            (key, dataframe) for every partition file
+    """
+    if s3 is None:
+        s3 = s3_client(MAX_CONCURRENCY, MAX_ATTEMPTS)
+    keys = [key for key, etag, size in list_prefix(s3, S3_BUCKET_NAME, S3_PREFIX)]
+    logger.info("%d partition files found under s3://%s/%s", len(keys), S3_BUCKET_NAME, S3_PREFIX)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        for key in keys:
+            pending.append((key, executor.submit(_read_object, s3, S3_BUCKET_NAME, key, MAX_ATTEMPTS,
+                                                 read_csv_kwargs)))
+            if len(pending) >= 2 * MAX_CONCURRENCY:
+                key, future = pending.popleft()
+                yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, future.result()
+
+
+def iter_csv_chunks(path, chunksize, s3=None, MAX_ATTEMPTS=5):
+    """Reads a CSV file, or the partition files under s3://bucket/prefix, chunksize rows at a time
+        S3 objects are streamed from the response body one after the other, without s3fs or temporary files.
+        Inputs:
+            path: Local CSV file or s3://bucket/prefix
+            chunksize: Number of rows of every chunk (a chunk never spans two partition files)
+            s3: S3 client (default: created from the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables)
+            MAX_ATTEMPTS: Attempts of the request of every object, with exponential backoff between them
+        Yields:
+            Dataframes of at most chunksize rows
+    """
+    if not path.startswith('s3://'):
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            yield chunk
+        return
+
+    bucket, prefix = split_s3_uri(path)
+    if s3 is None:
+        s3 = s3_client(1, MAX_ATTEMPTS)
+    keys = [key for key, etag, size in list_prefix(s3, bucket, prefix)]
+    if not keys:
+        logger.error("No partition files under %s", path)
+        sys.exit(1)
+    logger.info("%d partition files streamed from %s", len(keys), path)
+    for key in keys:
+        # Only the request is retried: chunks already yielded cannot be taken back if the body fails mid-stream
+        body = with_retries(lambda: s3.get_object(Bucket=bucket, Key=key)['Body'], MAX_ATTEMPTS)
+        try:
+            for chunk in pd.read_csv(body, chunksize=chunksize, compression='gzip' if key.endswith('.gz') else None):
+                yield chunk
+        finally:
+            body.close()
+
+
+def read_s3_prefix(S3_BUCKET_NAME=None, S3_PREFIX=None, MAX_CONCURRENCY=16, MAX_ATTEMPTS=5, s3=None,
+                   **read_csv_kwargs):
+    """Reads every partition file under a prefix concurrently into one dataframe, without temporary files
+        Inputs: see iter_s3_prefix
+        Returns:
+            Dataframe with the rows of all partition files, in key order
+    """
+    try:
+        frames = [df for key, df in iter_s3_prefix(S3_BUCKET_NAME, S3_PREFIX, MAX_CONCURRENCY, MAX_ATTEMPTS, s3,
+                                                   **read_csv_kwargs)]
+        if not frames:
+            raise ValueError("No partition files under s3://%s/%s" % (S3_BUCKET_NAME, S3_PREFIX))
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+    df = pd.concat(frames, ignore_index=True)
+    logger.info("%d rows read from %d partition files", len(df), len(frames))
+    return df
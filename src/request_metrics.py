@@ -0,0 +1,246 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+import sqlalchemy as sql
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in ms) of the latency histogram buckets, the last one catching everything slower
+BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+# Parts of a request's latency tracked separately, so that a slow percentile can be traced to its cause
+COMPONENTS = ['db', 'pool', 'render']
+
+
+class MetricsRegistry(object):
+    """Counters and latency histograms of requests, database queries and pool checkouts.
+
+    Every thread writes to its own shard, so recording a value takes no lock (the lock is only taken once per
+    thread, to register its shard, and when a snapshot merges the shards). The shards of threads that exited are
+    folded into one retired total, so their number stays bounded by the live threads whatever the number of
+    requests. A reset starts a new generation: every thread moves to a fresh shard on its next value instead of
+    having its shard cleared under it.
+    """
+
+    def __init__(self, buckets_ms=BUCKETS_MS, clock=time.perf_counter):
+        self.buckets_ms = list(buckets_ms)
+        self.clock = clock
+        self._shards = []
+        self._retired = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None or self._local.generation != self._generation:
+            shard = {}
+            with self._lock:
+                self._sweep()
+                self._shards.append((threading.current_thread(), shard))
+                generation = self._generation
+            self._local.shard, self._local.generation = shard, generation
+        return shard
+
+    def _sweep(self):
+        """Folds the shards of the threads that exited into the retired total (called with the lock held)"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = live
+
+    def observe(self, kind, name, elapsed_ms, error=False):
+        """
+            Records one value
+            Input: kind - family of the metric ('route', 'route_db', 'db_query', 'pool_checkout', ...)
+                   name - route or query label
+                   elapsed_ms - latency in milliseconds
+                   error - whether the request or query failed
+            Returns: None
+        """
+        shard = self._shard()
+        series = shard.get((kind, name))
+        if series is None:
+            # count, errors, sum, then one counter per bucket
+            series = shard[(kind, name)] = [0, 0, 0.0] + [0] * len(self.buckets_ms)
+        series[0] += 1
+        series[1] += error
+        series[2] += elapsed_ms
+        series[3 + bisect.bisect_left(self.buckets_ms, elapsed_ms)] += 1
+
+    def current(self):
+        """Returns: breakdown of the request being served by this thread (None outside of a request)"""
+        return getattr(self._local, 'request', None)
+
+    def new_request(self):
+        """Returns: empty breakdown of a request starting now"""
+        return dict(start=self.clock(), db=0.0, pool=0.0, render=0.0, queries=0, error=False)
+
+    def start_request(self):
+        self._local.request = self.new_request()
+
+    def end_request(self, route, error=False):
+        """Records the latency of the request served by this thread, in total and per component"""
+        request = self.current()
+        if request is None:
+            return
+        self._local.request = None
+        self.record_request(route, request, error)
+
+    @contextmanager
+    def attached(self, request):
+        """Makes request the current request of this thread in the wrapped block, so that the time spent on it by
+        another thread (e.g. an executor thread of the async server) is added to its breakdown"""
+        previous = self.current()
+        self._local.request = request
+        try:
+            yield
+        finally:
+            self._local.request = previous
+
+    def record_request(self, route, request, error=False):
+        """Records the latency of a request, in total and per component, from its breakdown"""
+        error = error or request['error']
+        self.observe('route', route, (self.clock() - request['start']) * 1000, error)
+        for component in COMPONENTS:
+            self.observe('route_' + component, route, request[component])
+
+    def mark_error(self):
+        """Counts the current request as an error even though it was answered (e.g. with the error page)"""
+        request = self.current()
+        if request is not None:
+            request['error'] = True
+
+    def add(self, component, elapsed_ms):
+        """Adds time spent in a component (db, pool or render) to the current request"""
+        request = self.current()
+        if request is not None:
+            request[component] += elapsed_ms
+
+    @contextmanager
+    def track(self, component):
+        """Measures the wrapped block as time spent in a component of the current request"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(component, (self.clock() - start) * 1000)
+
+    def snapshot(self):
+        """
+            Merges the shards of every thread
+            Returns: dictionary of kind to name to count, errors, sum_ms, mean_ms, p50/p95/p99 estimates (upper
+                     bound of the bucket holding the percentile) and the cumulative bucket counts
+        """
+        with self._lock:
+            self._sweep()
+            merged = dict((key, list(series)) for key, series in self._retired.items())
+            shards = [dict(shard) for thread, shard in self._shards]
+        for shard in shards:
+            _merge(merged, shard)
+
+        report = {}
+        for (kind, name), series in sorted(merged.items()):
+            count, errors, sum_ms, buckets = series[0], series[1], series[2], series[3:]
+            cumulative = [sum(buckets[:i + 1]) for i in range(len(buckets))]
+            report.setdefault(kind, {})[name] = dict(
+                count=count, errors=errors, sum_ms=sum_ms, mean_ms=sum_ms / count if count else None,
+                p50_ms=self._percentile(cumulative, count, 0.50), p95_ms=self._percentile(cumulative, count, 0.95),
+                p99_ms=self._percentile(cumulative, count, 0.99),
+                buckets=[['+Inf' if bound == float('inf') else bound, n] for bound, n in zip(self.buckets_ms, cumulative)])
+        return report
+
+    def _percentile(self, cumulative, count, q):
+        if not count:
+            return None
+        index = bisect.bisect_left(cumulative, q * count)
+        return self.buckets_ms[min(index, len(self.buckets_ms) - 1)]
+
+    def reset(self):
+        """Drops every value recorded so far (the shards of the previous generation are left to their threads)"""
+        with self._lock:
+            self._generation += 1
+            self._shards = []
+            self._retired = {}
+
+
+def _merge(total, shard):
+    """Adds the series of a shard to those of total"""
+    for key, series in shard.items():
+        merged = total.setdefault(key, [0] * len(series))
+        for i, value in enumerate(list(series)):
+            merged[i] += value
+
+
+def instrument_engine(engine, registry):
+    """
+        Times every query run on the engine and the time taken to obtain a connection from its pool
+        Input: engine - SQLAlchemy engine
+               registry - MetricsRegistry receiving db_query (by statement type) and pool_checkout values
+        Returns: None
+    """
+    @sql.event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(registry.clock())
+
+    @sql.event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (registry.clock() - conn.info['query_start'].pop()) * 1000
+        registry.observe('db_query', statement.split(None, 1)[0].upper() if statement.strip() else 'EMPTY',
+                         elapsed_ms)
+        registry.add('db', elapsed_ms)
+        request = registry.current()
+        if request is not None:
+            request['queries'] += 1
+
+    @sql.event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            elapsed_ms = (registry.clock() - starts.pop()) * 1000
+            registry.observe('db_query', 'ERROR', elapsed_ms, error=True)
+            registry.add('db', elapsed_ms)
+
+    # The pool has no event fired before a checkout starts waiting, so its checkout methods are timed instead
+    # (Session checks out with connect(), Engine.connect() with unique_connection() on SQLAlchemy 1.3)
+    pool = engine.pool
+    for method in ['connect', 'unique_connection']:
+        if hasattr(pool, method):
+            setattr(pool, method, _timed_checkout(getattr(pool, method), registry, type(pool).__name__))
+
+
+def _timed_checkout(checkout, registry, pool_name):
+    def timed_checkout():
+        start = registry.clock()
+        try:
+            return checkout()
+        finally:
+            elapsed_ms = (registry.clock() - start) * 1000
+            registry.observe('pool_checkout', pool_name, elapsed_ms)
+            registry.add('pool', elapsed_ms)
+    return timed_checkout
+
+
+def prometheus_text(report, prefix='hc_app'):
+    """
+        Formats a snapshot in the Prometheus text exposition format
+        Input: report - dictionary returned by MetricsRegistry.snapshot
+        Returns: string
+    """
+    lines = []
+    for kind, series in sorted(report.items()):
+        metric = '%s_%s_latency_ms' % (prefix, kind)
+        lines.append('# TYPE %s histogram' % metric)
+        for name, values in sorted(series.items()):
+            label = 'name="%s"' % str(name).replace('\\', '\\\\').replace('"', '\\"')
+            for bound, count in values['buckets']:
+                lines.append('%s_bucket{%s,le="%s"} %d' % (metric, label, bound, count))
+            lines.append('%s_sum{%s} %f' % (metric, label, values['sum_ms']))
+            lines.append('%s_count{%s} %d' % (metric, label, values['count']))
+            lines.append('%s_errors_total{%s} %d' % ('%s_%s' % (prefix, kind), label, values['errors']))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Returned by LRUCache.get when a key is not cached (None is a valid cached value)
+MISSING = object()
+
+
+class LRUCache(object):
+    """Bounded, thread-safe least-recently-used cache whose entries expire after ttl seconds and are all dropped
+    when the version they were stored under changes (new model or new predictions table load)"""
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.version = None
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        """
+            Looks up a key, checking first that the cache still holds entries of the current version
+            Input: key - hashable key
+                   version - current model/data version (any comparable value)
+            Returns: cached value, MISSING if the key is absent or expired
+        """
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version=None):
+        """
+            Stores a value, evicting the least recently used entry when the cache is full
+            Input: key - hashable key
+                   value - value to cache
+                   version - version the value was computed under
+            Returns: None
+        """
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        """
+            Returns: Dictionary with the size of the cache and its hit, miss, eviction and invalidation counters
+        """
+        with self._lock:
+            return dict(size=len(self._entries), maxsize=self.maxsize, hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, invalidations=self.invalidations)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_version(self, version):
+        """Empties the cache when the caller's version differs from the one the entries were stored under"""
+        if version != self.version:
+            if self._entries:
+                logger.info("Version changed from %s to %s, %d cached responses dropped",
+                            self.version, version, len(self._entries))
+                self._entries.clear()
+                self.invalidations += 1
+            self.version = version
@@ -0,0 +1,123 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import boto3
+import botocore
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Metadata key holding the sha256 of the whole file, set on upload and compared before any transfer
+SHA256_METADATA = 'sha256'
+
+# Error codes worth retrying: throttling and server-side failures
+RETRYABLE_CODES = {'500', '502', '503', '504', 'InternalError', 'ServiceUnavailable', 'SlowDown', 'Throttling',
+                   'ThrottlingException', 'RequestTimeout', 'RequestTimeTooSkewed'}
+
+
+def s3_client(max_concurrency=10, max_attempts=5):
+    """
+        Creates an S3 client whose connection pool is large enough for max_concurrency parallel part transfers
+        Input: max_concurrency - number of threads transferring parts at the same time
+               max_attempts - attempts of every request made by botocore itself
+        Returns: boto3 S3 client
+    """
+    config = Config(max_pool_connections=max(10, max_concurrency),
+                    retries={'max_attempts': max_attempts, 'mode': 'standard'})
+    return boto3.client('s3', aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+                        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"), config=config)
+
+
+def transfer_config(multipart_threshold_mb=8, multipart_chunksize_mb=8, max_concurrency=10):
+    """
+        Builds the multipart settings of upload_file/download_file
+        Input: multipart_threshold_mb - files from this size on are transferred in parts
+               multipart_chunksize_mb - size of every part
+               max_concurrency - number of parts transferred in parallel
+        Returns: TransferConfig
+    """
+    return TransferConfig(multipart_threshold=int(multipart_threshold_mb * MB),
+                          multipart_chunksize=int(multipart_chunksize_mb * MB),
+                          max_concurrency=max_concurrency, use_threads=max_concurrency > 1)
+
+
+def file_checksums(path, config):
+    """
+        Reads a file once and computes its sha256 and the ETag S3 gives it when uploaded with config
+        (MD5 of the file, or MD5 of the parts' MD5s followed by -<number of parts> for multipart uploads)
+        Input: path - local file
+               config - TransferConfig used for the transfer
+        Returns: (sha256 hex digest, ETag without quotes)
+    """
+    size = os.path.getsize(path)
+    sha256 = hashlib.sha256()
+    part_md5s = []
+    with open(path, 'rb') as file:
+        for part in iter(lambda: file.read(config.multipart_chunksize), b''):
+            sha256.update(part)
+            part_md5s.append(hashlib.md5(part).digest())
+    if size < config.multipart_threshold:
+        etag = part_md5s[0].hex() if part_md5s else hashlib.md5(b'').hexdigest()
+    else:
+        etag = '%s-%d' % (hashlib.md5(b''.join(part_md5s)).hexdigest(), len(part_md5s))
+    return sha256.hexdigest(), etag
+
+
+def head_object(s3, bucket, key):
+    """Returns: metadata of an object, None if it does not exist"""
+    try:
+        return s3.head_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def is_unchanged(head, sha256, etag):
+    """
+        Compares a local file with an object: by the sha256 stored in the object's metadata when there is one,
+        otherwise by ETag
+        Returns: True if the object holds the same bytes as the local file
+    """
+    if head is None:
+        return False
+    stored_sha256 = head.get('Metadata', {}).get(SHA256_METADATA)
+    if stored_sha256:
+        return stored_sha256 == sha256
+    return head.get('ETag', '').strip('"') == etag
+
+
+def is_retryable(error):
+    """Returns: True for connection errors, throttling and server-side errors"""
+    if isinstance(error, boto3.exceptions.S3UploadFailedError) and error.__context__ is not None:
+        # upload_file wraps the error of the failed request
+        return is_retryable(error.__context__)
+    if isinstance(error, botocore.exceptions.ClientError):
+        return str(error.response.get('Error', {}).get('Code')) in RETRYABLE_CODES
+    return isinstance(error, (botocore.exceptions.EndpointConnectionError, botocore.exceptions.ConnectionError,
+                              botocore.exceptions.ReadTimeoutError, botocore.exceptions.IncompleteReadError,
+                              ConnectionError))
+
+
+def with_retries(function, max_attempts=5, base_delay=0.5, max_delay=30.0):
+    """
+        Calls function until it succeeds, sleeping with exponential backoff and full jitter between attempts
+        Input: function - function without arguments
+               max_attempts - number of attempts before the last error is raised
+               base_delay, max_delay - bounds of the backoff in seconds
+        Returns: result of function
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == max_attempts or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            logger.warning("Attempt %d of %d failed (%s), retrying in %.2fs", attempt, max_attempts, e, delay)
+            time.sleep(delay)
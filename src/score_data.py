@@ -1,20 +1,49 @@
 import os
 import logging
+import pickle
+import multiprocessing
+from collections import deque
 import numpy as np
+import pandas as pd
+from src.flat_forest import compile_forest, predict_proba_flat, predict_flat
+from src.model_bundle import ModelBundle, load_bundle, is_bundle
+from src.instrumentation import instrumented
+from src.scoring_grid import iter_grid
+from src.columnar import is_columnar, write_table
+from src.dtypes import apply_dtypes
+from src.read_from_s3 import iter_csv_chunks
 
 logger = logging.getLogger(__name__)
 
-def score_data(df, model_pickle):
+@instrumented
+def score_data(df, model_pickle, flat_forest=False, forest=None, dtypes=None):
     """
     Scores dataset using the model
     Input:
-        Dataframe, pickle model object
+        Dataframe, pickle model object (or ModelBundle, which standardizes the features as during training and
+        always evaluates the flattened forest)
+        flat_forest - If True, the random forest is compiled into flat node arrays and evaluated in a single
+                      vectorized pass, the binary prediction being derived from the probabilities
+        forest - Forest already compiled with compile_forest, reused instead of compiling it again
+        dtypes - Column types (dtypes section of config.yaml) applied to the scored dataframe, e.g. to keep y_bin
+                 as narrow as the inputs
     Returns:
         Scored dataframe
     """
     try:
-        y_prob = model_pickle.predict_proba(df)[:, 1]
-        y_bin = model_pickle.predict(df)
+        if isinstance(model_pickle, ModelBundle):
+            proba = model_pickle.predict_proba(df)
+            y_prob = proba[:, 1]
+            y_bin = predict_flat(model_pickle.forest, proba)
+        elif flat_forest:
+            if forest is None:
+                forest = compile_forest(model_pickle)
+            proba = predict_proba_flat(forest, df)
+            y_prob = proba[:, 1]
+            y_bin = predict_flat(forest, proba)
+        else:
+            y_prob = model_pickle.predict_proba(df)[:, 1]
+            y_bin = model_pickle.predict(df)
     except Exception as e:
         logger.error("Error in scoring data")
         raise SystemExit()
@@ -24,4 +53,123 @@ def score_data(df, model_pickle):
     df['y_prob'] = np.round(y_prob * 100,2)
     df['y_bin'] = y_bin
 
-    return df
\ No newline at end of file
+    return apply_dtypes(df, dtypes, 'scored data')
+
+
+# Model (and compiled forest) held by every worker process of score_data_streaming
+_worker_model = None
+_worker_forest = None
+_worker_dtypes = None
+
+
+def _init_worker(model_path, flat_forest, dtypes=None):
+    """Loads one copy of the trained model object in a worker process (bundles are memory-mapped and shared)"""
+    global _worker_model, _worker_forest, _worker_dtypes
+    _worker_dtypes = dtypes
+    if is_bundle(model_path):
+        _worker_model = load_bundle(model_path)
+        return
+    with open(model_path, 'rb') as file:
+        _worker_model = pickle.load(file)
+    if flat_forest:
+        _worker_forest = compile_forest(_worker_model)
+
+
+def _score_chunk(chunk, header):
+    """Scores one chunk of rows inside a worker process and formats it as CSV text"""
+    try:
+        chunk = apply_dtypes(chunk, _worker_dtypes, 'chunk')
+        scored = score_data(chunk, _worker_model, flat_forest=_worker_forest is not None, forest=_worker_forest,
+                            dtypes=_worker_dtypes)
+        return len(scored), scored.to_csv(index=False, header=header)
+    except SystemExit:
+        # SystemExit would kill the pool worker and leave the chunk pending forever
+        raise RuntimeError("Error in scoring data")
+
+
+def score_data_streaming(input_path, output_path, model_path, chunksize=100000, n_workers=None, flat_forest=False,
+                         dtypes=None, s3=None):
+    """
+    Scores a CSV file chunk by chunk on a pool of worker processes and writes the results in input order
+    Input:
+        input_path - CSV file with the rows to be scored, or s3://bucket/prefix streamed from S3
+        output_path - CSV file where the scored rows are written
+        model_path - Pickled trained model object or model bundle directory, loaded once by every worker
+        chunksize - Number of rows read, scored and written at a time
+        n_workers - Number of worker processes (default: number of CPUs)
+        flat_forest - Passed on to score_data
+        dtypes - Column types every chunk is cast to before scoring
+        s3 - S3 client used for an s3:// input (default: created from the environment)
+    Returns:
+        Number of rows scored
+    """
+    n_workers = n_workers or multiprocessing.cpu_count()
+    # At most two chunks per worker are in flight, which bounds memory whatever the size of the input
+    max_pending = 2 * n_workers
+    pending = deque()
+    n_rows = 0
+
+    with multiprocessing.Pool(n_workers, initializer=_init_worker,
+                              initargs=(model_path, flat_forest, dtypes)) as pool, \
+            open(output_path, 'w', newline='') as output:
+        def write_next():
+            chunk_rows, text = pending.popleft().get()
+            output.write(text)
+            return chunk_rows
+
+        try:
+            for i, chunk in enumerate(iter_csv_chunks(input_path, chunksize, s3=s3)):
+                pending.append(pool.apply_async(_score_chunk, (chunk, i == 0)))
+                if len(pending) >= max_pending:
+                    n_rows += write_next()
+            while pending:
+                n_rows += write_next()
+        except Exception as e:
+            logger.error("Error in streaming scored data to %s", output_path)
+            raise SystemExit()
+
+    logger.info("%d rows scored in chunks of %d on %d worker processes", n_rows, chunksize, n_workers)
+    return n_rows
+
+
+def iter_scored_grid(spec, model_pickle, block_size=100000, flat_forest=False, dtypes=None):
+    """
+    Generates the scoring grid block by block and scores every block as it is built, without any input file
+    Input:
+        spec - Grid specification (value ranges per model input, see scoring_grid.grid_axes)
+        model_pickle - Trained model object or ModelBundle
+        block_size - Number of rows generated and scored at a time
+        flat_forest - Passed on to score_data (the forest is compiled once for all the blocks)
+        dtypes - Column types of the generated and scored blocks (dtypes section of config.yaml)
+    Returns:
+        Generator of scored dataframes
+    """
+    forest = compile_forest(model_pickle) if flat_forest and not isinstance(model_pickle, ModelBundle) else None
+    for block in iter_grid(spec, block_size, dtypes=dtypes):
+        yield score_data(block, model_pickle, flat_forest=flat_forest, forest=forest, dtypes=dtypes)
+
+
+def score_grid(spec, model_pickle, output_path, block_size=100000, flat_forest=False, dtypes=None, compression=None):
+    """
+    Scores the grid generated on the fly and writes the results block by block
+    Input:
+        spec, model_pickle, block_size, flat_forest, dtypes - As in iter_scored_grid
+        output_path - CSV file written block by block, or binary columnar file (.col) written once all the
+                      blocks are scored
+        compression - Compression of the columnar file (see columnar.write_columnar)
+    Returns:
+        Number of rows scored
+    """
+    blocks = iter_scored_grid(spec, model_pickle, block_size=block_size, flat_forest=flat_forest, dtypes=dtypes)
+    if is_columnar(output_path):
+        scored = pd.concat(list(blocks), ignore_index=True)
+        write_table(scored, output_path, compression=compression)
+        n_rows = len(scored)
+    else:
+        n_rows = 0
+        with open(output_path, 'w', newline='') as output:
+            for block in blocks:
+                block.to_csv(output, index=False, header=(n_rows == 0))
+                n_rows += len(block)
+    logger.info("%d grid rows scored and saved to %s", n_rows, output_path)
+    return n_rows
@@ -0,0 +1,85 @@
+import logging
+import numpy as np
+import pandas as pd
+from src.prediction_cube import mixed_radix_strides
+from src.dtypes import apply_dtypes, safe_dtype
+
+logger = logging.getLogger(__name__)
+
+
+def grid_axes(spec):
+    """
+        Lists the values taken by every input of the scoring grid
+        Input: spec - dictionary of column name (in model input order) to [min, max] (integers, both included),
+                      [min, max, step] or {values: [...]}
+        Returns: list of (column name, 1D array of its values)
+    """
+    axes = []
+    for column, values in spec.items():
+        if isinstance(values, dict) and 'values' in values:
+            axis = np.asarray(values['values'])
+        elif isinstance(values, (list, tuple)) and len(values) in (2, 3):
+            low, high = values[0], values[1]
+            step = values[2] if len(values) == 3 else 1
+            if step <= 0 or high < low:
+                raise ValueError("Invalid range %s of grid column %s" % (values, column))
+            # The small tolerance keeps max in the axis despite floating point steps
+            axis = np.arange(low, high + step / 2.0, step)
+            if all(isinstance(value, int) for value in values):
+                axis = axis.astype(np.int64)
+        else:
+            raise ValueError("Grid column %s should be [min, max], [min, max, step] or {values: [...]}" % column)
+        if axis.ndim != 1 or len(axis) == 0:
+            raise ValueError("Grid column %s has no values" % column)
+        axes.append((column, axis))
+    return axes
+
+
+def grid_size(axes):
+    """Returns: number of rows of the grid (product of the number of values of every column)"""
+    return int(np.prod([len(axis) for column, axis in axes], dtype=np.int64))
+
+
+def grid_block(axes, start, stop, dtypes=None):
+    """
+        Builds rows start to stop of the grid, the last column varying fastest
+        Input: axes - list returned by grid_axes
+               start, stop - row range
+               dtypes - column types the columns are built in directly (when all the values of the axis fit)
+        Returns: dataframe with one column per grid column
+    """
+    radices = [len(axis) for column, axis in axes]
+    codes = np.arange(start, stop, dtype=np.int64)
+    columns = {}
+    # Decoded one column at a time, so no int64 block of every digit is ever held next to the narrow columns
+    for (column, axis), radix, stride in zip(axes, radices, mixed_radix_strides(radices)):
+        target = safe_dtype(axis, dtypes[column]) if dtypes and column in dtypes else None
+        if target is not None:
+            axis = axis.astype(target)
+        columns[column] = axis[(codes // stride) % radix]
+    return pd.DataFrame(columns)
+
+
+def iter_grid(spec, block_size=100000, dtypes=None):
+    """
+        Generates the scoring grid block by block, so that memory stays bounded whatever the size of the grid
+        Input: spec - grid specification (see grid_axes)
+               block_size - number of rows per block
+               dtypes - column types (dtypes section of config.yaml) the blocks are cast to
+        Returns: generator of dataframes
+    """
+    try:
+        axes = grid_axes(spec)
+    except (ValueError, TypeError) as e:
+        logger.error(e)
+        raise SystemExit()
+    n_rows = grid_size(axes)
+    logger.info("Scoring grid of %d rows generated in blocks of %d", n_rows, block_size)
+    for start in range(0, n_rows, block_size):
+        yield apply_dtypes(grid_block(axes, start, min(start + block_size, n_rows), dtypes), dtypes, 'grid block')
+
+
+def build_grid(spec, dtypes=None):
+    """Returns: the whole scoring grid as one dataframe, cast to dtypes if given"""
+    axes = grid_axes(spec)
+    return apply_dtypes(grid_block(axes, 0, grid_size(axes), dtypes), dtypes, 'grid')
@@ -0,0 +1,207 @@
+import os
+import json
+import mmap
+import glob
+import time
+import fcntl
+import struct
+import logging
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+from src.prediction_cube import PredictionCube
+
+logger = logging.getLogger(__name__)
+
+# A segment is the magic, the length of the JSON header, the header, then the probability and y_bin arrays (each
+# aligned on 64 bytes), so it can be mapped and read in place by any process
+MAGIC = b'HCCUBE01'
+PREFIX = struct.Struct('<8sQ')
+ALIGNMENT = 64
+
+
+def default_directory():
+    """Returns: /dev/shm (memory-backed, shared by every process of the host) when available, else the temp dir"""
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _pointer_path(directory, name):
+    return os.path.join(directory, name + '.current')
+
+
+def _segment_path(directory, name, generation):
+    return os.path.join(directory, '%s.%s.seg' % (name, generation))
+
+
+def publish_cube(cube, directory, name, model_version=None, fingerprint=None):
+    """
+        Writes the cube into a new named segment and makes it the current one, then removes the previous segments
+        (processes still mapping them keep reading them until they switch)
+        Input: cube - PredictionCube
+               directory - directory of the segments
+               name - name of the table, shared by the publisher and the readers
+               model_version - version of the model the predictions were scored with, stored with them
+               fingerprint - JSON value identifying the source of the table (e.g. table version and model file)
+        Returns: generation of the new segment
+    """
+    generation = '%d-%d' % (int(time.time() * 1000000), os.getpid())
+    header = dict(generation=generation, model_version=model_version, fingerprint=fingerprint, offsets=cube.offsets,
+                  radices=cube.radices, n_rows=cube.n_rows, size=cube.size)
+    # The array offsets depend on the header length, which depends on them: reserve room for them first
+    header.update(prob_offset=0, bin_offset=0)
+    reserved = len(json.dumps(header).encode('utf-8')) + 64
+    header['prob_offset'] = _aligned(PREFIX.size + reserved)
+    header['bin_offset'] = _aligned(header['prob_offset'] + cube.y_prob_bp.nbytes)
+    encoded = json.dumps(header).encode('utf-8').ljust(reserved)
+
+    path = _segment_path(directory, name, generation)
+    with open(path + '.tmp', 'wb') as file:
+        file.write(PREFIX.pack(MAGIC, len(encoded)) + encoded)
+        file.seek(header['prob_offset'])
+        file.write(np.ascontiguousarray(cube.y_prob_bp, dtype=np.uint16).tobytes())
+        file.seek(header['bin_offset'])
+        file.write(np.ascontiguousarray(cube.y_bin, dtype=np.int8).tobytes())
+    os.replace(path + '.tmp', path)
+
+    # The pointer is replaced atomically, readers see either the previous segment or the new one
+    pointer = _pointer_path(directory, name)
+    with open(pointer + '.tmp', 'w') as file:
+        file.write(os.path.basename(path))
+    os.replace(pointer + '.tmp', pointer)
+
+    for previous in glob.glob(_segment_path(directory, name, '*')):
+        if previous != path:
+            try:
+                os.remove(previous)
+            except OSError:
+                pass
+    logger.info("Prediction table published to %s (%d predictions, model version %s)", path, cube.n_rows,
+                model_version)
+    return generation
+
+
+def attach_segment(path):
+    """
+        Maps a segment read-only, without copying it
+        Input: path - segment file
+        Returns: PredictionCube whose arrays are views of the mapping, header dictionary
+    """
+    with open(path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, length = PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a prediction table segment" % path)
+    header = json.loads(buffer[PREFIX.size:PREFIX.size + length].decode('utf-8'))
+    # The arrays keep the mapping alive, it is unmapped once the last view of it is dropped
+    y_prob_bp = np.frombuffer(buffer, dtype=np.uint16, count=header['size'], offset=header['prob_offset'])
+    y_bin = np.frombuffer(buffer, dtype=np.int8, count=header['size'], offset=header['bin_offset'])
+    return PredictionCube(header['offsets'], header['radices'], y_prob_bp, y_bin, n_rows=header['n_rows']), header
+
+
+class SharedPredictionCube(object):
+    """Prediction table published once into a named shared segment and mapped read-only by every worker process.
+
+    Lookups read the mapped arrays directly, without a query or any message to another process. Every
+    check_interval seconds the reader checks which segment is current and swaps to it if the table was republished.
+    """
+
+    def __init__(self, directory=None, name='hc_predictions', check_interval=1.0, clock=time.monotonic):
+        self.directory = directory or default_directory()
+        self.name = name
+        self.check_interval = check_interval
+        self.clock = clock
+        self.header = {}
+        self._cube = None
+        self._segment = None
+        self._checked = None
+
+    @property
+    def generation(self):
+        return self.header.get('generation')
+
+    @property
+    def model_version(self):
+        return self.header.get('model_version')
+
+    @property
+    def fingerprint(self):
+        return self.header.get('fingerprint')
+
+    def cube(self):
+        """Returns: the current PredictionCube (None if nothing was published), checked every check_interval"""
+        now = self.clock()
+        if self._checked is None or now - self._checked >= self.check_interval:
+            self._checked = now
+            self.refresh()
+        return self._cube
+
+    def lookup(self, values):
+        """Same as PredictionCube.lookup, None if no table was published"""
+        cube = self.cube()
+        return None if cube is None else cube.lookup(values)
+
+    def refresh(self):
+        """
+            Maps the current segment if it changed since the last call
+            Returns: the current PredictionCube, None if nothing was published
+        """
+        # The publisher may remove a segment between reading the pointer and opening it: the pointer is then re-read
+        for attempt in range(3):
+            try:
+                with open(_pointer_path(self.directory, self.name), 'r') as file:
+                    segment = file.read().strip()
+            except (IOError, OSError):
+                return self._cube
+            if segment == self._segment:
+                return self._cube
+            try:
+                cube, header = attach_segment(os.path.join(self.directory, segment))
+            except (IOError, OSError):
+                continue
+            except ValueError as e:
+                logger.error(e)
+                return self._cube
+            # Swapping the references is atomic, lookups in flight finish on the previous segment
+            self._cube, self.header, self._segment = cube, header, segment
+            logger.info("Prediction table segment %s mapped (%d predictions)", segment, cube.n_rows)
+            return self._cube
+        logger.warning("Prediction table segment of %s could not be mapped", self.name)
+        return self._cube
+
+    def publish(self, build, model_version=None, fingerprint=None, force=False):
+        """
+            Publishes the table built by build, unless another process already published it from the same source.
+            Publishers are serialized by a lock file, so concurrent workers build the table only once.
+            Input: build - function returning a PredictionCube, or None when there is nothing to publish
+                   model_version - stored with the table
+                   fingerprint - JSON value identifying the source of the table: a current segment with another
+                                 fingerprint (e.g. left in /dev/shm by an earlier deployment) is replaced. None
+                                 accepts any current segment
+                   force - publish even if the current segment has the same fingerprint
+            Returns: the current PredictionCube, None if nothing was published
+        """
+        # Compared with the header once through JSON, where tuples become lists
+        fingerprint = json.loads(json.dumps(fingerprint))
+        with publisher_lock(self.directory, self.name):
+            if not force and self.refresh() is not None and fingerprint in (None, self.fingerprint):
+                return self._cube
+            cube = build()
+            if cube is not None:
+                publish_cube(cube, self.directory, self.name, model_version=model_version, fingerprint=fingerprint)
+            self._checked = self.clock()
+            return self.refresh()
+
+
+@contextmanager
+def publisher_lock(directory, name):
+    """Holds an exclusive lock on <name>.lock in directory (released if the process dies)"""
+    with open(os.path.join(directory, name + '.lock'), 'a') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -3,24 +3,45 @@ import os
 import boto3
 import sys
 import botocore
+from src.s3_transfer import s3_client, transfer_config, file_checksums, head_object, is_unchanged, with_retries, \
+    SHA256_METADATA
 
 logger = logging.getLogger(__name__)
 
-def write_to_s3(FILE_LOCATION=None, S3_BUCKET_NAME=None):
+def write_to_s3(FILE_LOCATION=None, S3_BUCKET_NAME=None, S3_KEY=None, MULTIPART_THRESHOLD_MB=8,
+                MULTIPART_CHUNKSIZE_MB=8, MAX_CONCURRENCY=10, MAX_ATTEMPTS=5, SKIP_UNCHANGED=True, s3=None):
     """Function that takes the data - heart.csv from the ~/data location and uploads it into a given S3 bucket
+    Files above the multipart threshold are uploaded in parts in parallel. The sha256 of the file is stored in the
+    object's metadata, and the upload is skipped if the object already holds the same bytes.
     Inputs:
         S3_BUCKET: AWS credentials
         FILE_LOCATION: Location of the raw data file that needs to be uploaded to S3
+        S3_KEY: Key of the object (default: name of the file)
+        MULTIPART_THRESHOLD_MB, MULTIPART_CHUNKSIZE_MB, MAX_CONCURRENCY: Multipart transfer settings
+        MAX_ATTEMPTS: Attempts of the upload, with exponential backoff between them
+        SKIP_UNCHANGED: If True, nothing is uploaded when the object's checksum matches the file
+        s3: S3 client (default: created from the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables)
     Returns:
-        None
+        True if the file was uploaded, False if it was skipped
     """
-    S3_PUBLIC_KEY = os.environ.get("AWS_ACCESS_KEY_ID")
-    S3_SECRET_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
+    key = S3_KEY or os.path.basename(FILE_LOCATION)
+    config = transfer_config(MULTIPART_THRESHOLD_MB, MULTIPART_CHUNKSIZE_MB, MAX_CONCURRENCY)
 
     try:
-        s3 = boto3.client('s3', aws_access_key_id=S3_PUBLIC_KEY, aws_secret_access_key=S3_SECRET_KEY)
-        s3.upload_file(FILE_LOCATION, S3_BUCKET_NAME, "heart.csv")
+        if s3 is None:
+            s3 = s3_client(MAX_CONCURRENCY, MAX_ATTEMPTS)
+        sha256, etag = file_checksums(FILE_LOCATION, config)
+        if SKIP_UNCHANGED and is_unchanged(with_retries(lambda: head_object(s3, S3_BUCKET_NAME, key), MAX_ATTEMPTS),
+                                           sha256, etag):
+            logger.info("s3://%s/%s already matches %s, upload skipped", S3_BUCKET_NAME, key, FILE_LOCATION)
+            return False
+        with_retries(lambda: s3.upload_file(FILE_LOCATION, S3_BUCKET_NAME, key, Config=config,
+                                            ExtraArgs={'Metadata': {SHA256_METADATA: sha256}}), MAX_ATTEMPTS)
         logger.info("Raw data uploaded to S3 bucket")
     except botocore.exceptions.NoCredentialsError as e:
         logger.error("Invalid S3 credentials")
         sys.exit(1)
+    except Exception as e:
+        logger.error(e)
+        sys.exit(1)
+    return True
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+from src.async_serving import AsyncApp, Response
+
+
+def wsgi_app(environ, start_response):
+    """WSGI application echoing the method, path, query string and body of the request"""
+    body = environ['wsgi.input'].read()
+    start_response('201 Created', [('Content-Type', 'text/plain')])
+    return [('%s %s %s ' % (environ['REQUEST_METHOD'], environ['PATH_INFO'], environ['QUERY_STRING'])).encode(), body]
+
+
+def call(app, method, path, body=b'', query_string=b''):
+    """Sends one request to an ASGI application, returns the status, headers and body of its response"""
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+             'headers': [(b'content-type', b'application/x-www-form-urlencoded')]}
+    return app(scope, receive, send), sent
+
+
+def run(app, *requests):
+    """Sends the requests concurrently, returns (status, headers, body) of every response"""
+    calls = [call(app, *request) for request in requests]
+    asyncio.get_event_loop().run_until_complete(asyncio.gather(*[coroutine for coroutine, sent in calls]))
+    return [(sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']) for coroutine, sent in calls]
+
+
+def test_happy_async_route_and_wsgi_fallback():
+    """
+    Happy path to check that async handlers get the parsed form and other requests are served by the WSGI app
+    """
+    app = AsyncApp(wsgi_app, max_workers=2)
+
+    @app.route('/add', methods=['POST'])
+    async def add(request):
+        return Response('age=%s' % request.form['age'])
+
+    (status, headers, body), (wsgi_status, wsgi_headers, wsgi_body) = \
+        run(app, ('POST', '/add', b'age=40&sex=1'), ('POST', '/other', b'x=1', b'format=json'))
+    assert (status, body) == (200, b'age=40') and headers[b'content-type'] == b'text/html; charset=utf-8'
+    assert (wsgi_status, wsgi_body) == (201, b'POST /other format=json x=1')
+    assert wsgi_headers[b'content-type'] == b'text/plain'
+
+
+def test_happy_run_blocking_off_loop():
+    """
+    Happy path to check that blocking calls get their keyword arguments and run on an executor thread
+    """
+    app = AsyncApp(wsgi_app, max_workers=1)
+
+    def page(template, predictions=None):
+        return '%s %s %s' % (template, predictions, threading.get_ident() != loop_thread)
+
+    @app.route('/add', methods=['POST'])
+    async def add(request):
+        return Response(await app.run_blocking(page, 'index.html', predictions=request.form['age']))
+
+    loop_thread = threading.get_ident()
+    [(status, headers, body)] = run(app, ('POST', '/add', b'age=40'))
+    assert (status, body) == (200, b'index.html 40 True')
+
+
+def test_unhappy_saturated_executor():
+    """
+    Unhappy path to check that requests beyond max_pending blocking calls are refused with 503 and Retry-After
+    """
+    app = AsyncApp(wsgi_app, max_workers=1, max_pending=2)
+    release = threading.Event()
+
+    @app.route('/slow')
+    async def slow(request):
+        await app.run_blocking(release.wait, 5)
+        return Response('done')
+
+    async def requests():
+        calls = [call(app, 'GET', '/slow') for i in range(5)]
+        tasks = [asyncio.ensure_future(coroutine) for coroutine, sent in calls]
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(*tasks)
+        return [sent for coroutine, sent in calls]
+
+    responses = asyncio.get_event_loop().run_until_complete(requests())
+    statuses = sorted(sent[0]['status'] for sent in responses)
+    assert statuses == [200, 200, 503, 503, 503]
+    refused = next(sent for sent in responses if sent[0]['status'] == 503)
+    assert dict(refused[0]['headers'])[b'retry-after'] == b'1'
+    assert app.stats()['rejected'] == 3 and app.stats()['pending'] == 0
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import yaml
+import pytest
+import src.benchmark as bm
+
+
+def results(**metrics):
+    """Benchmark results holding one clean_data result with the given metrics"""
+    result = dict(stage='clean_data', size=1000, median_s=1.0, p95_ms=1000.0, peak_mb=10.0, throughput=1000.0)
+    result.update(metrics)
+    return dict(results=[result])
+
+
+def test_happy_benchmark_main(tmp_path):
+    """
+    Happy path to check that a first run writes its results and stores them as the baseline
+    """
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    output_path, baseline_path = str(tmp_path / 'results.json'), str(tmp_path / 'baseline.json')
+    regressions = bm.benchmark_main(config, output_path, baseline_path, sizes=[200], repeats=1,
+                                    stages=['clean_data', 'score_data', 'score_data_flat', 'add_records'],
+                                    work_dir=str(tmp_path))
+    with open(output_path, 'r') as file:
+        current = json.load(file)
+    assert regressions == []
+    assert [(result['stage'], result['size']) for result in current['results']] == \
+        [('clean_data', 200), ('score_data', 200), ('score_data_flat', 200), ('add_records', 200)]
+    assert all(result['throughput'] > 0 and result['peak_mb'] > 0 for result in current['results'])
+    with open(baseline_path, 'r') as file:
+        assert json.load(file) == current
+
+
+def test_happy_synthetic_grid():
+    """
+    Happy path to check that the benchmark grid covers the values of the scoring grid of config.yaml
+    """
+    with open('config/config.yaml', 'r') as file:
+        spec = yaml.safe_load(file)['score_data']['grid']
+    grid = bm.synthetic_grid(5000, spec)
+    assert list(grid.columns) == list(spec) and not grid.duplicated().any()
+    for column, (low, high) in spec.items():
+        assert grid[column].min() == low and grid[column].max() == high
+
+
+class AppStandIn(object):
+    """App module bound to the database of the environment it was imported with"""
+    def __init__(self):
+        self.app = type('App', (), {'config': {'SQLALCHEMY_DATABASE_URI': os.environ.get('SQLALCHEMY_DATABASE_URI')}})
+
+
+def test_unhappy_import_app_environment(monkeypatch, tmp_path):
+    """
+    Unhappy path to check that the environment is restored after importing the app, even when the import fails
+    """
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', 'mysql://production')
+    monkeypatch.setenv('MYSQL_HOST', 'production-host')
+    monkeypatch.setattr(bm.importlib, 'import_module', lambda name: AppStandIn())
+    app_module = bm._import_app(str(tmp_path / 'app.db'))
+    assert app_module.app.config['SQLALCHEMY_DATABASE_URI'] == 'sqlite:///%s' % (tmp_path / 'app.db')
+    assert os.environ['SQLALCHEMY_DATABASE_URI'] == 'mysql://production'
+    assert os.environ['MYSQL_HOST'] == 'production-host'
+
+    def failing_import(name):
+        raise ImportError(name)
+    monkeypatch.setattr(bm.importlib, 'import_module', failing_import)
+    monkeypatch.delenv('SQLALCHEMY_DATABASE_URI')
+    with pytest.raises(ImportError):
+        bm._import_app(str(tmp_path / 'app.db'))
+    assert 'SQLALCHEMY_DATABASE_URI' not in os.environ and os.environ['MYSQL_HOST'] == 'production-host'
+
+
+def test_unhappy_compare_to_baseline():
+    """
+    Unhappy path to check that only the metrics past their threshold, in the worse direction, are regressions
+    """
+    thresholds = dict(median_s=0.25, p95_ms=0.5, peak_mb=0.25, throughput=0.2)
+    current = results(median_s=1.3, p95_ms=1400.0, peak_mb=5.0, throughput=700.0)
+    regressions = bm.compare_to_baseline(current, results(), thresholds)
+    assert [regression['metric'] for regression in regressions] == ['median_s', 'throughput']
+    assert bm.compare_to_baseline(current, dict(results=[]), thresholds) == []
@@ -127,4 +127,62 @@ def test_unhappy_fbs_imputation():
     input_df = input_df.drop(['fasting_blood_sugar'], axis=1)
     df_output, temp = cd.fbs_impute_invalid_values(input_df)
 
-    assert temp==1
\ No newline at end of file
+    assert temp==1
+
+def test_happy_impute_values():
+    """
+    Happy path to check if missing and invalid values of all columns are imputed in one pass and counted
+    """
+    input_df = pd.DataFrame([[20, 2, 10, 280, 150, 0, 1, 180, 0, 213, 0, 0, 0, 0],
+                             [170, 1, 1, 180, 500, 0, 0, 167, 1, 213, 1, 2, 1, 0],
+                              [40, 0, 2, 120, 620, 1, 2, 174, 1, 227, 0, 2, 1, 1],
+                              [72, 0, 0, 90, 430, 0, 1, 155, 2, 197, 1, 4, 2, 1],
+                              [56, 1, 3, 60, 420, 1, 0, 150, 1, 186, 2, 3, 3, 0],
+                              [86, 0, 1, 220, 220, 0, 2, 135, 0, 195, 2, 1, 3, 1]],
+                            columns=['age', 'sex', 'chest_pain', 'blood_pressure', 'serum_cholesterol',
+                                     'fasting_blood_sugar',
+                                     'electrocardiographic', 'max_heart_rate', 'induced_angina', 'ST_depression', \
+                                     'slope', 'no_of_vessels', 'thal', 'diagnosis'])
+    valid_ranges = {'age': [1, 120], 'sex': [0, 1], 'chest_pain': [0, 3], 'blood_pressure': [50, 250]}
+    expected_df = input_df.copy()
+    expected_df, temp = cd.age_impute_invalid_values(expected_df)
+    expected_df, temp = cd.sex_impute_invalid_values(expected_df)
+    expected_df, temp = cd.cp_impute_invalid_values(expected_df)
+    expected_df, temp = cd.bp_impute_invalid_values(expected_df)
+
+    df_output, imputed = cd.impute_values(input_df, valid_ranges)
+    assert df_output.equals(expected_df)
+    assert imputed['age'] == 1 and imputed['sex'] == 1 and imputed['chest_pain'] == 1
+    assert imputed['blood_pressure'] == 1 and imputed['thal'] == 0
+
+def test_happy_impute_missing_values():
+    """
+    Happy path to check if missing values are replaced with the mode and the column keeps its datatype
+    """
+    input_df = pd.DataFrame({'age': [40.0, None, 40.0, 63.0], 'sex': [1, 0, 1, 1]})
+    df_output, imputed = cd.impute_values(input_df, {'age': [1, 120]})
+    assert df_output['age'].tolist() == [40.0, 40.0, 40.0, 63.0]
+    assert df_output['sex'].dtype == input_df['sex'].dtype
+    assert imputed == {'age': 1, 'sex': 0}
+
+def test_happy_clean_data_streaming(tmp_path):
+    """
+    Happy path to check if the two-pass chunked cleaning writes the same data as cleaning in memory
+    """
+    col_names = ['age', 'sex', 'chest_pain', 'blood_pressure', 'serum_cholesterol', 'fasting_blood_sugar',
+                 'electrocardiographic', 'max_heart_rate', 'induced_angina', 'ST_depression', \
+                 'slope', 'no_of_vessels', 'thal', 'diagnosis']
+    valid_ranges = {'age': [1, 120], 'sex': [0, 1], 'blood_pressure': [50, 250], 'thal': [0, 3]}
+    input_df = pd.DataFrame([[20, 1, 0, 80, 150, 0, 1, 180, 0, 213, 0, 0, 0, 0],
+                             [170, 1, 1, 180, 500, 0, 0, 167, 1, 213, 1, 2, 1, 0],
+                              [40, None, 2, 120, 620, 1, 2, 174, 1, 227, 0, 2, 1, 1],
+                              [72, 0, 0, 90, 430, 0, 1, 155, 2, 197, 1, 4, 2, 1],
+                              [56, 1, 3, 260, 420, 1, 0, 150, 1, 186, 2, 3, 3, 0],
+                              [86, 0, 1, 220, 220, 0, 2, 135, 0, 195, 2, 1, 5, 1]])
+    input_df.to_csv(tmp_path / 'raw.csv', index=False)
+
+    n_rows = cd.clean_data_streaming(str(tmp_path / 'raw.csv'), str(tmp_path / 'clean.csv'), col_names,
+                                     valid_ranges, chunksize=2)
+    expected_df = cd.clean_data(pd.read_csv(tmp_path / 'raw.csv'), col_names, valid_ranges)
+    assert n_rows == 6
+    assert pd.read_csv(tmp_path / 'clean.csv').equals(expected_df)
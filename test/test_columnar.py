@@ -0,0 +1,40 @@
+import pytest
+import numpy as np
+import pandas as pd
+import src.columnar as col
+
+
+def test_happy_columnar_round_trip(tmp_path):
+    """
+    Happy path to check that a table keeps its values, dtypes and column order, with and without compression
+    """
+    df = pd.DataFrame({'age': [40, 41, 42], 'y_prob': [56.16, 38.03, 50.0], 'feature': ['age', None, 'thal'],
+                       'y_bin': np.array([1, 0, 1], dtype=np.int8), 'sex': [0, 1, 1]})
+    for compression in [None, 'zlib']:
+        col.write_table(df, str(tmp_path / 'table.col'), compression=compression)
+        actual = col.read_table(str(tmp_path / 'table.col'))
+        assert actual.equals(df) and list(actual.dtypes) == list(df.dtypes)
+
+
+def test_happy_columnar_memory_mapped(tmp_path):
+    """
+    Happy path to check that numeric columns are memory-mapped copy-on-write, leaving the file unchanged on writes
+    """
+    df = pd.DataFrame({'age': [40, 41], 'sex': [0, 1], 'y_prob': [56.16, 38.03]})
+    col.write_columnar(df, str(tmp_path / 'table.col'))
+    actual = col.read_columnar(str(tmp_path / 'table.col'))
+    base = actual['age'].to_numpy()
+    while base.base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    actual.loc[0, 'age'] = 99
+    assert col.read_columnar(str(tmp_path / 'table.col')).equals(df)
+
+
+def test_unhappy_columnar_not_columnar(tmp_path):
+    """
+    Unhappy path to check that a file in another format is rejected
+    """
+    pd.DataFrame({'age': [40]}).to_csv(str(tmp_path / 'table.col'), index=False)
+    with pytest.raises(ValueError):
+        col.read_columnar(str(tmp_path / 'table.col'))
@@ -0,0 +1,212 @@
+import pytest
+import sqlite3
+import pandas as pd
+import src.create_database as cdb
+
+
+def scored_df():
+    """Small scored grid in the layout of scored_data.csv"""
+    return pd.DataFrame([[40, 0, 0, 0, 0, 0, 1, 56.16, 1],
+                         [40, 1, 0, 0, 0, 0, 1, 38.03, 0],
+                         [41, 0, 3, 1, 2, 2, 3, 50.0, 1],
+                         [42, 1, 3, 1, 2, 2, 0, 31.07, 0]],
+                        columns=['age', 'sex', 'chest_pain', 'fasting_blood_sugar',
+                                 'electrocardiographic', 'induced_angina', 'thal', 'y_prob', 'y_bin'])
+
+
+def read_table(db_path, table_name='pd_predictions'):
+    """Rows of a table, sorted by key"""
+    return sorted(sqlite3.connect(db_path).execute('SELECT * FROM %s' % table_name).fetchall())
+
+
+def test_happy_add_records(tmp_path):
+    """
+    Happy path to check that the batched loader stores every row as bulk_insert_mappings did
+    """
+    engine_string = 'sqlite:///%s' % (tmp_path / 'test.db')
+    cdb.create_db(engine_string)
+    cdb.add_records(scored_df(), engine_string, batch_size=3)
+    assert read_table(tmp_path / 'test.db') == [(40, 0, 0, 0, 0, 0, 1, '56.16', 1),
+                                                (40, 1, 0, 0, 0, 0, 1, '38.03', 0),
+                                                (41, 0, 3, 1, 2, 2, 3, '50.0', 1),
+                                                (42, 1, 3, 1, 2, 2, 0, '31.07', 0)]
+
+
+def test_unhappy_add_records_duplicate(tmp_path):
+    """
+    Unhappy path to check that loading the same keys twice exits and leaves the first load untouched
+    """
+    engine_string = 'sqlite:///%s' % (tmp_path / 'test.db')
+    cdb.create_db(engine_string)
+    cdb.add_records(scored_df(), engine_string)
+    with pytest.raises(SystemExit):
+        cdb.add_records(scored_df(), engine_string)
+    assert len(read_table(tmp_path / 'test.db')) == 4
+
+
+def test_happy_upsert_records(tmp_path):
+    """
+    Happy path to check that an incremental load only writes the inserted, changed and deleted rows
+    """
+    engine_string = 'sqlite:///%s' % (tmp_path / 'test.db')
+    cdb.create_db(engine_string)
+    cdb.add_records(scored_df(), engine_string)
+
+    new_df = scored_df().drop(index=3)
+    new_df.loc[1, 'y_prob'] = 39.5
+    new_df.loc[4] = [43, 0, 0, 0, 0, 0, 0, 45.25, 0]
+    changes = cdb.upsert_records(new_df, engine_string)
+
+    assert changes == dict(inserted=1, updated=1, deleted=1)
+    assert read_table(tmp_path / 'test.db') == [(40, 0, 0, 0, 0, 0, 1, '56.16', 1),
+                                                (40, 1, 0, 0, 0, 0, 1, '39.5', 0),
+                                                (41, 0, 3, 1, 2, 2, 3, '50.0', 1),
+                                                (43, 0, 0, 0, 0, 0, 0, '45.25', 0)]
+    assert cdb.upsert_records(new_df, engine_string) == dict(inserted=0, updated=0, deleted=0)
+
+
+def test_happy_swap_and_rollback_records(tmp_path):
+    """
+    Happy path to check that a shadow-table load replaces pd_predictions and can be rolled back
+    """
+    engine_string = 'sqlite:///%s' % (tmp_path / 'test.db')
+    cdb.create_db(engine_string)
+    cdb.add_records(scored_df(), engine_string)
+    old_rows = read_table(tmp_path / 'test.db')
+
+    cdb.swap_records(scored_df().iloc[:2], engine_string)
+    assert read_table(tmp_path / 'test.db') == old_rows[:2]
+    assert read_table(tmp_path / 'test.db', cdb.PREVIOUS_TABLE) == old_rows
+
+    cdb.rollback_records(engine_string)
+    assert read_table(tmp_path / 'test.db') == old_rows
+    assert read_table(tmp_path / 'test.db', cdb.PREVIOUS_TABLE) == old_rows[:2]
+
+
+def test_happy_migrate_to_compact(tmp_path):
+    """
+    Happy path to check that migrated rows decode back to exactly what pd_predictions holds
+    """
+    engine_string = 'sqlite:///%s' % (tmp_path / 'test.db')
+    cdb.create_db(engine_string)
+    cdb.add_records(scored_df(), engine_string)
+    assert cdb.migrate_to_compact(engine_string) == 4
+
+    compact = pd.read_sql('SELECT * FROM pd_predictions_compact', engine_string)
+    unpacked = cdb.unpack_compact(compact)
+    assert sorted(unpacked[cdb.KEY_COLUMNS].itertuples(index=False, name=None)) == \
+        [row[:7] for row in read_table(tmp_path / 'test.db')]
+    assert sorted(compact['y_prob_bp']) == [3107, 3803, 5000, 5616]
+    assert cdb.pack_key((40, 1, 0, 0, 0, 0, 1)) in set(compact['packed_key'])
+
+
+def test_unhappy_compact_key_out_of_range():
+    """
+    Unhappy path to check that inputs that do not fit in the packed key are rejected
+    """
+    df = scored_df()
+    df.loc[0, 'thal'] = 4
+    assert cdb.pack_key((40, 0, 0, 0, 0, 0, 4)) is None
+    assert cdb.pack_key((40, 0, 0, 0, 0, 0, -1)) is None
+    with pytest.raises(ValueError):
+        cdb.to_compact(df)
+    with pytest.raises(ValueError):
+        cdb.packed_key_radices(grid=dict(age=[1, 120], thal=[-1, 3]))
+    with pytest.raises(ValueError):
+        cdb.packed_key_radices(grid=dict(age=[0, 100000], sex=[0, 100000]))
+
+
+def test_happy_compact_radices_from_grid(tmp_path, monkeypatch):
+    """
+    Happy path to check that a grid wider than the default key ranges is packed without collisions, with radices
+    stored with the table and reused when decoding and when rows are appended
+    """
+    engine_string = 'sqlite:///%s' % (tmp_path / 'test.db')
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', engine_string)
+    monkeypatch.delenv('MYSQL_HOST', raising=False)
+    monkeypatch.delenv('PREDICTION_CUBE_RELOAD_URL', raising=False)
+    grid = dict(age=[1, 120], sex=[0, 1], chest_pain=[0, 3], fasting_blood_sugar=[0, 1],
+                electrocardiographic=[0, 5], induced_angina=[0, 2], thal=[0, 3])
+    radices = cdb.packed_key_radices(grid=grid)
+    assert radices == [256, 2, 4, 2, 6, 3, 4]
+
+    df = scored_df()
+    df.loc[0, 'electrocardiographic'] = 5
+    blocks = [df.iloc[:2], df.iloc[2:]]
+    with pytest.raises(SystemExit):
+        cdb.create_database_streaming(iter(blocks), 1, schema='compact')
+    assert cdb.create_database_streaming(blocks, 1, schema='compact', grid=grid) == 4
+    engine = cdb.sql.create_engine(engine_string)
+    assert cdb.read_packed_radices(engine) == radices
+    compact = pd.read_sql('SELECT * FROM pd_predictions_compact', engine)
+    unpacked = cdb.unpack_compact(compact, cdb.read_packed_radices(engine))
+    assert sorted(unpacked[cdb.KEY_COLUMNS].itertuples(index=False, name=None)) == \
+        sorted(df[cdb.KEY_COLUMNS].itertuples(index=False, name=None))
+    assert cdb.pack_key((40, 0, 0, 0, 5, 0, 1), radices) in set(compact['packed_key'])
+    with pytest.raises(SystemExit):
+        cdb.load_compact_records(df, engine_string, radices=cdb.PACKED_KEY_RADICES)
+
+
+def test_happy_table_version(tmp_path, monkeypatch):
+    """
+    Happy path to check that every load bumps the version row of the table it wrote, which the app workers compare
+    """
+    engine_string = 'sqlite:///%s' % (tmp_path / 'test.db')
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', engine_string)
+    monkeypatch.delenv('MYSQL_HOST', raising=False)
+    monkeypatch.delenv('PREDICTION_CUBE_RELOAD_URL', raising=False)
+    cdb.create_db(engine_string)
+    engine = cdb.sql.create_engine(engine_string)
+    assert cdb.read_table_version(engine) == (None, 0)
+
+    cdb.create_database_main(scored_df(), 0)
+    assert cdb.read_table_version(engine) == (1, 4)
+    cdb.create_database_main(scored_df().iloc[:2], 1, load_mode='swap')
+    assert cdb.read_table_version(engine) == (2, 2)
+    cdb.rollback_database_main()
+    assert cdb.read_table_version(engine) == (3, 4)
+    cdb.migrate_database_main()
+    assert cdb.read_table_version(engine, 'pd_predictions_compact') == (1, 4)
+    assert cdb.read_table_version(engine) == (3, 4)
+
+
+class LoadDataConnection(object):
+    """DBAPI connection standing in for MySQL, whose LOAD DATA skips the given number of duplicate rows"""
+
+    def __init__(self, skipped):
+        self.skipped = skipped
+        self.committed = self.rolled_back = False
+        self.rowcount = None
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement, params):
+        self.statement = statement
+        self.rowcount = sum(1 for line in open(params[0])) - self.skipped
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        pass
+
+
+def test_unhappy_load_data_skipped_rows():
+    """
+    Unhappy path to check that a LOAD DATA that skipped duplicate rows is rolled back instead of silently committed
+    """
+    columns = cdb.KEY_COLUMNS + ['y_prob', 'y_bin']
+    connection = LoadDataConnection(skipped=1)
+    engine = type('Engine', (object,), {'raw_connection': lambda self: connection})()
+    with pytest.raises(ValueError):
+        cdb._load_data_local_infile(engine, scored_df(), 'pd_predictions', columns)
+    assert 'IGNORE INTO TABLE' in connection.statement
+    assert connection.rolled_back and not connection.committed
+
+    connection = LoadDataConnection(skipped=0)
+    cdb._load_data_local_infile(engine, scored_df(), 'pd_predictions', columns)
+    assert connection.committed
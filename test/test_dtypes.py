@@ -0,0 +1,58 @@
+import yaml
+import numpy as np
+import pandas as pd
+import src.build_models as bm
+import src.clean_data as cd
+import src.dtypes as dt
+import src.score_data as sd
+import src.scoring_grid as sg
+
+
+def test_happy_apply_dtypes():
+    """
+    Happy path to check that the clean data is narrowed to the types of config.yaml, several times smaller, and that
+    the grid scored with those types gives the same predictions
+    """
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    clean = pd.read_csv('data/interim_files/clean_data.csv')
+    before = dt.memory_mb(clean)
+    narrow = dt.apply_dtypes(clean.copy(), config['dtypes'], 'clean data')
+    assert narrow['age'].dtype == np.uint8 and narrow['serum_cholesterol'].dtype == np.int16
+    assert narrow['ST_depression'].dtype == np.float32
+    assert dt.memory_mb(narrow) * 3 < before
+    assert (narrow.values == clean.values).all()
+
+    model = bm.build_models(clean, **config['build_models'])[-1]
+    spec = config['score_data']['grid']
+    expected = sd.score_data(sg.build_grid(spec), model)
+    scored = sd.score_data(sg.build_grid(spec, dtypes=config['dtypes']), model, dtypes=config['dtypes'])
+    assert scored['thal'].dtype == np.int8 and scored['y_bin'].dtype == np.int8
+    assert scored['y_prob'].dtype == np.float64
+    assert (scored.values == expected.values).all()
+    assert dt.memory_mb(scored) * 3 < dt.memory_mb(expected)
+
+
+def test_happy_auto_dtype():
+    """
+    Happy path to check that auto picks the narrowest integer type of the values, and float32 for fractions
+    """
+    assert dt.safe_dtype(np.array([0, 200]), 'auto') == np.uint8
+    assert dt.safe_dtype(np.array([-1, 200]), 'auto') == np.int16
+    assert dt.safe_dtype(np.array([0.5, 1.0]), 'auto') == np.float32
+
+
+def test_unhappy_apply_dtypes():
+    """
+    Unhappy path to check that missing, fractional or out of range values keep their column's type, and that
+    clean_data still accepts the narrow types
+    """
+    df = pd.DataFrame(dict(age=[63.0, np.nan], sex=[1.5, 0.0], thal=[1, 300]))
+    dt.apply_dtypes(df, dict(age='uint8', sex='int8', thal='int8'))
+    assert df.dtypes.tolist() == [np.float64, np.float64, np.int64]
+    assert dt.apply_dtypes(df, None) is df
+
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    clean = dt.apply_dtypes(pd.read_csv('data/interim_files/clean_data.csv'), config['dtypes'])
+    assert cd.check_columns_datatypes(clean) == 1
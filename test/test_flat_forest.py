@@ -0,0 +1,53 @@
+import pytest
+import yaml
+import numpy as np
+import pandas as pd
+import src.build_models as bm
+import src.flat_forest as ff
+import src.score_data as sd
+from src.scoring_grid import build_grid
+
+
+@pytest.fixture(scope='module')
+def model_fit():
+    """Random forest built the same way as the build_models step, on the shipped clean data"""
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    df = pd.read_csv('data/interim_files/clean_data.csv')
+    return bm.build_models(df, **config['build_models'])[-1]
+
+
+@pytest.fixture(scope='module')
+def grid():
+    """Scoring grid of config.yaml"""
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    return build_grid(config['score_data']['grid'])
+
+
+def test_happy_flat_forest_matches_sklearn(model_fit, grid):
+    """
+    Happy path to check that the flattened forest reproduces sklearn's probabilities and labels bit for bit
+    """
+    forest = ff.compile_forest(model_fit)
+    proba = ff.predict_proba_flat(forest, grid.values)
+    assert np.array_equal(proba, model_fit.predict_proba(grid.values))
+    assert np.array_equal(ff.predict_flat(forest, proba), model_fit.predict(grid.values))
+
+
+def test_happy_flat_forest_block_size(model_fit, grid):
+    """
+    Happy path to check that the result does not depend on how rows are split into blocks
+    """
+    forest = ff.compile_forest(model_fit)
+    rows = grid.values[:1000]
+    assert np.array_equal(ff.predict_proba_flat(forest, rows, block_size=7), ff.predict_proba_flat(forest, rows))
+
+
+def test_happy_score_data_flat_forest(model_fit, grid):
+    """
+    Happy path to check that score_data gives the same scored dataframe with and without the flattened forest
+    """
+    expected = sd.score_data(pd.DataFrame(grid.values, columns=grid.columns), model_fit)
+    actual = sd.score_data(pd.DataFrame(grid.values, columns=grid.columns), model_fit, flat_forest=True)
+    assert actual.equals(expected)
@@ -0,0 +1,87 @@
+import os
+import pickle
+import pandas as pd
+import pytest
+import src.incremental_training as it
+from src.columnar import write_table
+from src.model_bundle import load_bundle
+from src.build_models import compute_accuracy
+
+BUILD_CONFIG = dict(target_column='diagnosis', columns_for_modeling=['age', 'sex', 'chest_pain', 'fasting_blood_sugar',
+                                                                    'electrocardiographic', 'induced_angina', 'thal'],
+                    test_size=0.3, n_estimators=10, max_depth=3)
+
+
+@pytest.fixture
+def batches(tmp_path):
+    """Shipped clean data split into the training rows of the current model (saved as a columnar seed, as the clean
+    data of the pipeline) and batches of new rows"""
+    # The shipped rows are sorted by diagnosis, shuffle them so every batch holds both classes
+    df = pd.read_csv('data/interim_files/clean_data.csv').sample(frac=1, random_state=1408)
+    seed_path = str(tmp_path / 'seed.col')
+    write_table(df.iloc[:150], seed_path)
+    return seed_path, [df.iloc[150:190], df.iloc[190:230], df.iloc[230:270], df.iloc[270:]]
+
+
+def test_happy_incremental_then_periodic_refit(batches, tmp_path):
+    """
+    Happy path to check that the first refit trains on the seed and the new rows, and that new rows grow trees on
+    the previous forest for exactly full_refit_every increments before the next update is a full refit
+    """
+    seed_path, new_batches = batches
+    history = str(tmp_path / 'history.csv')
+    args = dict(full_refit_every=2, drift_tolerance=1.0, new_trees=4, seed_path=seed_path, **BUILD_CONFIG)
+    state = it.retrain_incremental(new_batches[0], str(tmp_path), history, **args)
+    assert state['mode'] == 'full' and state['n_estimators'] == 10 and state['rows_at_full_refit'] == 150 + 40
+
+    modes = []
+    for batch in new_batches[1:]:
+        state = it.retrain_incremental(batch, str(tmp_path), history, **args)
+        modes.append((state['mode'], state['increments'], state['n_estimators']))
+    assert modes == [('incremental', 1, 14), ('incremental', 2, 18), ('full', 0, 10)]
+    assert state['reason'] == 'periodic' and state['rows_at_full_refit'] == 303
+
+
+def test_happy_incremental_report_of_updated_model(batches, tmp_path):
+    """
+    Happy path to check that the accuracy report written after an increment describes the updated forest on the
+    held out new rows, not the previous model
+    """
+    seed_path, new_batches = batches
+    history = str(tmp_path / 'history.csv')
+    args = dict(drift_tolerance=1.0, new_trees=4, seed_path=seed_path, **BUILD_CONFIG)
+    it.retrain_incremental(new_batches[0], str(tmp_path), history, **args)
+    state = it.retrain_incremental(new_batches[1], str(tmp_path), history, **args)
+    assert state['mode'] == 'incremental'
+
+    with open(os.path.join(str(tmp_path), 'finalized_model.sav'), 'rb') as file:
+        model = pickle.load(file)
+    X = load_bundle(os.path.join(str(tmp_path), 'model_bundle')).transform(new_batches[1])
+    y = new_batches[1]['diagnosis'].values
+    holdout = it.train_test_split(X, y, test_size=0.3, stratify=y, random_state=1408)
+    X_holdout, y_holdout = holdout[1], holdout[3]
+    auc = compute_accuracy(y_holdout, model.predict_proba(X_holdout)[:, 1], model.predict(X_holdout))[0]
+    with open(os.path.join(str(tmp_path), 'model_accuracy.txt'), 'r') as file:
+        assert float(file.read().split('\n')[1]) == pytest.approx(auc) == pytest.approx(state['last_auc'])
+    assert len(model.estimators_) == 14 and state['prequential_auc'] != state['last_auc']
+
+
+def test_unhappy_incremental_drift(batches, tmp_path):
+    """
+    Unhappy path to check that new rows on which the previous model degrades force a full refit
+    """
+    seed_path, new_batches = batches
+    history = str(tmp_path / 'history.csv')
+    it.retrain_incremental(new_batches[0], str(tmp_path), history, seed_path=seed_path, **BUILD_CONFIG)
+    flipped = new_batches[1].assign(diagnosis=1 - new_batches[1]['diagnosis'])
+    state = it.retrain_incremental(flipped, str(tmp_path), history, drift_tolerance=0.05, **BUILD_CONFIG)
+    assert state['mode'] == 'full' and state['reason'] == 'drift'
+
+
+def test_unhappy_incremental_without_seed(batches, tmp_path):
+    """
+    Unhappy path to check that the first update refuses to refit on the new rows alone when there is no seed
+    """
+    seed_path, new_batches = batches
+    with pytest.raises(SystemExit):
+        it.retrain_incremental(new_batches[0], str(tmp_path), str(tmp_path / 'history.csv'), **BUILD_CONFIG)
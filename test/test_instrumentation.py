@@ -0,0 +1,52 @@
+import json
+import pandas as pd
+import pytest
+import src.instrumentation as instrumentation
+from src.build_models import build_models, split_test_train
+
+BUILD_CONFIG = dict(target_column='diagnosis', columns_for_modeling=['age', 'sex', 'chest_pain', 'fasting_blood_sugar',
+                                                                    'electrocardiographic', 'induced_angina', 'thal'])
+
+
+@pytest.fixture
+def records_path(tmp_path):
+    """JSON lines file receiving the records, instrumentation being turned off again after the test"""
+    path = str(tmp_path / 'records.jsonl')
+    yield path
+    instrumentation.disable()
+
+
+def read_records(path):
+    with open(path, 'r') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_happy_instrumented_step(records_path, tmp_path):
+    """
+    Happy path to check that a step and the stages it runs are recorded with their parent, timings and row counts
+    """
+    df = pd.read_csv('data/interim_files/clean_data.csv')
+    instrumentation.enable(records_path, profile_dir=str(tmp_path / 'profiles'))
+    with instrumentation.measure('step', 'build_models', rows_in=len(df)):
+        build_models(df, **BUILD_CONFIG)
+    records = read_records(records_path)
+    assert [record['name'] for record in records] == ['split_features_target', 'split_test_train', 'stan_norm',
+                                                      'rf_model', 'fit_test', 'compute_accuracy',
+                                                      'feature_importances', 'build_models']
+    assert all(record['parent'] == 'build_models' and record['depth'] == 1 for record in records[:-1])
+    assert records[1]['rows_in'] == 303 and records[1]['rows_out'] == 212
+    assert records[-1]['wall_s'] >= sum(record['wall_s'] for record in records[:-1])
+    assert (tmp_path / 'profiles' / 'build_models.prof').exists()
+
+
+def test_unhappy_instrumented_disabled_and_failing(records_path):
+    """
+    Unhappy path to check that nothing is recorded while disabled, and that a failing stage is recorded as an error
+    """
+    features = pd.DataFrame({'x': range(10)})
+    split_test_train(features, features['x'], 0.3)
+    instrumentation.enable(records_path)
+    with pytest.raises(SystemExit):
+        split_test_train(features, features['x'], 2.0)
+    records = read_records(records_path)
+    assert len(records) == 1 and records[0]['name'] == 'split_test_train' and records[0]['status'] == 'error'
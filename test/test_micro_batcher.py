@@ -0,0 +1,45 @@
+import pytest
+import threading
+import src.micro_batcher as mb
+
+
+def sum_predict_fn(calls):
+    """Fake model that records the size of every batch and returns the row sums"""
+    def predict(rows):
+        calls.append(len(rows))
+        return rows.sum(axis=1) / 100.0, (rows.sum(axis=1) > 5).astype(int)
+    return predict
+
+
+def test_happy_micro_batching():
+    """
+    Happy path to check that concurrent rows are scored together and every caller gets its own result
+    """
+    calls = []
+    batcher = mb.MicroBatcher(sum_predict_fn(calls), max_batch_size=64, max_wait_ms=50)
+    rows = [[i, 1, 0, 0, 0, 0, 1] for i in range(32)]
+    results = [None] * len(rows)
+
+    def score(i):
+        results[i] = batcher.predict([rows[i]], timeout=5)[0]
+
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(len(rows))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [(sum(row) / 100.0, int(sum(row) > 5)) for row in rows]
+    assert sum(calls) == len(rows) and len(calls) < len(rows)
+
+
+def test_unhappy_micro_batching_error():
+    """
+    Unhappy path to check that an error in the model is raised to every caller of the batch
+    """
+    def failing_predict(rows):
+        raise ValueError("bad input")
+
+    batcher = mb.MicroBatcher(failing_predict, max_wait_ms=1)
+    with pytest.raises(ValueError):
+        batcher.predict([[1, 0, 0, 0, 0, 0, 1]], timeout=5)
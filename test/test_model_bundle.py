@@ -0,0 +1,88 @@
+import os
+import sys
+import importlib
+import pytest
+import yaml
+import numpy as np
+import pandas as pd
+import src.build_models as bm
+import src.model_bundle as mbl
+import src.score_data as sd
+import src.create_database as cdb
+from src.scoring_grid import build_grid
+
+
+@pytest.fixture(scope='module')
+def trained():
+    """Random forest and scaler built the same way as the build_models step, on the shipped clean data"""
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    df = pd.read_csv('data/interim_files/clean_data.csv')
+    results = bm.build_models(df, return_scaler=True, **config['build_models'])
+    return results[-2], results[-1], config['build_models']['columns_for_modeling']
+
+
+def test_happy_bundle_matches_training_preprocessing(trained, tmp_path):
+    """
+    Happy path to check that a loaded bundle scores raw inputs exactly as the forest scores standardized ones
+    """
+    model, scaler, features = trained
+    version = mbl.save_bundle(str(tmp_path / 'bundle'), model, scaler, features, metrics=dict(auc=0.9))
+    bundle = mbl.load_bundle(str(tmp_path / 'bundle'), verify=True)
+    with open('config/config.yaml', 'r') as f:
+        grid = build_grid(yaml.load(f, Loader=yaml.FullLoader)['score_data']['grid'])
+
+    assert bundle.version == version and bundle.metrics == dict(auc=0.9)
+    assert isinstance(bundle.forest['threshold'], np.memmap)
+    expected = model.predict_proba(scaler.transform(grid[features]))
+    assert np.array_equal(bundle.predict_proba(grid[features[::-1]]), expected)
+    assert np.array_equal(bundle.predict(grid), model.predict(scaler.transform(grid[features])))
+
+    scored = sd.score_data(grid.copy(), bundle)
+    assert np.array_equal(scored['y_prob'].values, np.round(expected[:, 1] * 100, 2))
+
+
+def test_happy_predict_matches_scored_grid(trained, tmp_path, monkeypatch):
+    """
+    Happy path to check that /predict, served from the default model path, answers the same prediction as the
+    scored grid behind /add
+    """
+    model, scaler, features = trained
+    with open('config/config.yaml', 'r') as f:
+        grid = build_grid(yaml.load(f, Loader=yaml.FullLoader)['score_data']['grid'])
+    bundle_path = str(tmp_path / 'model_bundle')
+    mbl.save_bundle(bundle_path, model, scaler, features)
+    scored = sd.score_data(grid.sample(200, random_state=1408).reset_index(drop=True), mbl.load_bundle(bundle_path))
+    engine_string = 'sqlite:///%s' % (tmp_path / 'app.db')
+    cdb.create_db(engine_string)
+    cdb.add_records(scored, engine_string)
+
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', engine_string)
+    monkeypatch.delenv('MYSQL_HOST', raising=False)
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    app_module = importlib.import_module('app')
+    assert os.path.basename(app_module.app.config['MODEL_PATH']) == 'model_bundle'
+    monkeypatch.setitem(app_module.app.config, 'MODEL_PATH', bundle_path)
+    monkeypatch.setattr(app_module, 'prediction_batcher', None)
+
+    client = app_module.app.test_client()
+    row = scored.iloc[0]
+    form = {column: int(row[column]) for column in features}
+    predicted = client.post('/predict', json=form).get_json()
+    assert predicted == dict(y_prob=row['y_prob'], y_bin=int(row['y_bin']))
+    page = client.post('/add', data={column: str(value) for column, value in form.items()}).get_data(as_text=True)
+    assert '<td>%s</td>' % row['y_prob'] in page
+
+
+def test_unhappy_bundle_tampered(trained, tmp_path):
+    """
+    Unhappy path to check that a bundle whose arrays no longer match its content hash is rejected
+    """
+    model, scaler, features = trained
+    path = str(tmp_path / 'bundle')
+    mbl.save_bundle(path, model, scaler, features)
+    threshold = np.load(path + '/threshold.npy')
+    threshold[0] += 1.0
+    np.save(path + '/threshold.npy', threshold)
+    with pytest.raises(SystemExit):
+        mbl.load_bundle(path, verify=True)
@@ -0,0 +1,42 @@
+import pytest
+import pandas as pd
+import src.model_search as ms
+
+SPACE = {'n_estimators': [5, 20], 'max_depth': [1, None]}
+
+
+@pytest.fixture(scope='module')
+def clean_df():
+    return pd.read_csv('data/interim_files/clean_data.csv')
+
+
+def test_happy_search_hyperparameters(clean_df):
+    """
+    Happy path to check that the pool evaluates every candidate and that the leaderboard is sorted best first
+    """
+    best_params, leaderboard = ms.search_hyperparameters(clean_df, 'diagnosis', ['age', 'sex', 'chest_pain', 'thal'],
+                                                         SPACE, cv_folds=3, n_jobs=2, early_stop_margin=1.0)
+    assert len(leaderboard) == 4 and set(leaderboard['status']) == {'complete'}
+    assert list(leaderboard['rank']) == [1, 2, 3, 4]
+    assert leaderboard['mean_auc'].is_monotonic_decreasing
+    assert best_params == {column: leaderboard[column].iloc[0] for column in SPACE}
+    assert ms.split_search_params(best_params) == dict(best_params, model_params={})
+
+
+def test_happy_search_early_stopping(clean_df):
+    """
+    Happy path to check that candidates clearly worse than a complete one stop before the last fold
+    """
+    best_params, leaderboard = ms.search_hyperparameters(clean_df, 'diagnosis', ['age', 'sex', 'chest_pain', 'thal'],
+                                                         {'n_estimators': [50], 'max_depth': [None, 1]},
+                                                         cv_folds=5, n_jobs=1, early_stop_margin=-1.0, min_folds=2)
+    assert list(leaderboard['status']) == ['complete', 'pruned']
+    assert list(leaderboard['folds']) == [5, 2]
+
+
+def test_unhappy_search_strategy(clean_df):
+    """
+    Unhappy path to check that an unknown search strategy stops the step
+    """
+    with pytest.raises(SystemExit):
+        ms.search_hyperparameters(clean_df, 'diagnosis', ['age'], SPACE, strategy='bayes')
@@ -0,0 +1,62 @@
+import os
+import yaml
+import sqlite3
+import pytest
+import src.pipeline as pl
+import src.columnar as col
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """Pipeline configuration writing every artifact and the database to a temporary directory"""
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config['pipeline'] = dict(raw_data='data/raw_data/heart.csv', to_be_scored=None,
+                              output_dir=str(tmp_path), state_file=str(tmp_path / 'state.json'),
+                              intermediate_format='col')
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///%s' % (tmp_path / 'test.db'))
+    monkeypatch.delenv('MYSQL_HOST', raising=False)
+    monkeypatch.delenv('PREDICTION_CUBE_RELOAD_URL', raising=False)
+    return config
+
+
+def test_happy_pipeline_skips_unchanged_steps(config, tmp_path):
+    """
+    Happy path to check that a rerun skips every step and that a config change only reruns the affected steps
+    """
+    assert pl.run_pipeline(config, load_mode='swap') == dict(clean_data='ran', build_models='ran',
+                                                             score_data='ran', database='ran')
+    n_rows = sqlite3.connect(str(tmp_path / 'test.db')).execute('SELECT COUNT(*) FROM pd_predictions').fetchone()
+    assert n_rows == (92160,)
+    assert set(pl.run_pipeline(config, load_mode='swap').values()) == {'skipped'}
+    assert pl.run_pipeline(config, load_mode='swap', steps=['database'], force=True) == dict(database='ran')
+
+    config['build_models']['n_estimators'] = 5
+    assert pl.run_pipeline(config, load_mode='swap') == dict(clean_data='skipped', build_models='ran',
+                                                             score_data='ran', database='ran')
+
+
+def test_happy_pipeline_compressed(config, tmp_path):
+    """
+    Happy path to check that with columnar compression the intermediate files are zlib-compressed and read back by
+    a later run
+    """
+    config['columnar'] = dict(compress=True)
+    pl.run_pipeline(config, load_mode='swap', steps=['clean_data', 'build_models', 'score_data'])
+    scored = col.read_table(str(tmp_path / 'scored_data.col'))
+    col.write_table(scored, str(tmp_path / 'plain.col'))
+    assert os.path.getsize(str(tmp_path / 'scored_data.col')) < os.path.getsize(str(tmp_path / 'plain.col')) / 2
+
+    assert pl.run_pipeline(config, load_mode='swap', steps=['database']) == dict(database='ran')
+    n_rows = sqlite3.connect(str(tmp_path / 'test.db')).execute('SELECT COUNT(*) FROM pd_predictions').fetchone()
+    assert n_rows == (len(scored),) == (92160,)
+
+
+def test_unhappy_pipeline_modified_output(config, tmp_path):
+    """
+    Unhappy path to check that a step whose output was changed on disk is rerun
+    """
+    pl.run_pipeline(config, load_mode='swap', steps=['clean_data'])
+    with open(str(tmp_path / 'clean_data.col'), 'ab') as f:
+        f.write(b'\0')
+    assert pl.run_pipeline(config, load_mode='swap', steps=['clean_data']) == dict(clean_data='ran')
@@ -0,0 +1,52 @@
+import pytest
+import numpy as np
+import pandas as pd
+import src.prediction_cube as pc
+
+
+def scored_df():
+    """Small scored grid in the layout of scored_data.csv"""
+    return pd.DataFrame([[40, 0, 0, 0, 0, 0, 1, 56.16, 1],
+                         [40, 1, 0, 0, 0, 0, 1, 38.03, 0],
+                         [41, 0, 3, 1, 2, 2, 3, 50.0, 1],
+                         [42, 1, 3, 1, 2, 2, 0, 31.07, 0]],
+                        columns=['age', 'sex', 'chest_pain', 'fasting_blood_sugar',
+                                 'electrocardiographic', 'induced_angina', 'thal', 'y_prob', 'y_bin'])
+
+
+def test_happy_cube_lookup():
+    """
+    Happy path to check that every stored combination is returned with its prediction
+    """
+    df = scored_df()
+    cube = pc.PredictionCube.from_frame(df)
+    for row in df.itertuples(index=False):
+        prediction = cube.lookup(row[:7])
+        assert prediction == [pc.Prediction(y_prob=str(row.y_prob), y_bin=row.y_bin)]
+    assert cube.n_rows == 4
+
+
+def test_happy_cube_missing_cell():
+    """
+    Happy path to check that an in-grid combination without a prediction returns an empty result
+    """
+    cube = pc.PredictionCube.from_frame(scored_df())
+    assert cube.lookup((41, 1, 0, 0, 0, 0, 1)) == []
+
+
+def test_unhappy_cube_out_of_grid():
+    """
+    Unhappy path to check that combinations outside of the grid are flagged for a database fallback
+    """
+    cube = pc.PredictionCube.from_frame(scored_df())
+    assert cube.lookup((150, 0, 0, 0, 0, 0, 1)) is None
+    assert cube.lookup((40, 0, -1, 0, 0, 0, 1)) is None
+
+
+def test_happy_mixed_radix_encode():
+    """
+    Happy path to check that the mixed-radix code follows the row order of the generated scoring grid
+    """
+    values = np.array([[1, 0, 0], [1, 0, 1], [1, 1, 0], [2, 0, 0], [3, 0, 0]])
+    codes = pc.mixed_radix_encode(values, offsets=[1, 0, 0], radices=[2, 2, 2])
+    assert codes.tolist() == [0, 1, 2, 4, -1]
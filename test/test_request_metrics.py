@@ -0,0 +1,137 @@
+import threading
+import sqlalchemy as sql
+import src.request_metrics as rm
+
+
+class FakeClock(object):
+    """Clock advanced by hand, in seconds"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_happy_request_breakdown():
+    """
+    Happy path to check that a request's latency is recorded in total and split into database and rendering time
+    """
+    clock = FakeClock()
+    registry = rm.MetricsRegistry(clock=clock)
+    registry.start_request()
+    registry.add('db', 30.0)
+    with registry.track('render'):
+        clock.now += 0.060
+    clock.now += 0.040
+    registry.end_request('/add')
+    report = registry.snapshot()
+    assert report['route']['/add']['count'] == 1 and report['route']['/add']['sum_ms'] == 100.0
+    assert report['route']['/add']['p99_ms'] == 100
+    assert report['route_db']['/add']['sum_ms'] == 30.0 and report['route_render']['/add']['sum_ms'] == 60.0
+    assert report['route']['/add']['buckets'][-1] == ['+Inf', 1]
+
+
+def test_happy_request_attached_to_other_thread(tmp_path):
+    """
+    Happy path to check that query, pool checkout and rendering times spent on another thread are added to the
+    breakdown of the request they are attached to
+    """
+    clock = FakeClock()
+    registry = rm.MetricsRegistry(clock=clock)
+    engine = sql.create_engine('sqlite:///%s' % (tmp_path / 'test.db'))
+    rm.instrument_engine(engine, registry)
+    request = registry.new_request()
+
+    def work():
+        with registry.attached(request):
+            with engine.connect() as connection:
+                connection.execute('SELECT 1').fetchall()
+            with registry.track('render'):
+                clock.now += 0.020
+        assert registry.current() is None
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    clock.now += 0.010
+    registry.record_request('/add', request)
+    report = registry.snapshot()
+    assert report['route']['/add']['sum_ms'] == 30.0 and report['route_render']['/add']['sum_ms'] == 20.0
+    assert request['queries'] == 1 and set(report['route_pool']) == set(report['route_db']) == {'/add'}
+
+
+def test_happy_threads_and_engine(tmp_path):
+    """
+    Happy path to check that values recorded by several threads are merged, and that queries and pool checkouts
+    of an instrumented engine are timed
+    """
+    registry = rm.MetricsRegistry()
+    threads = [threading.Thread(target=lambda: [registry.observe('route', '/', 1.5) for i in range(1000)])
+               for j in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.snapshot()['route']['/']['count'] == 4000
+
+    engine = sql.create_engine('sqlite:///%s' % (tmp_path / 'test.db'))
+    rm.instrument_engine(engine, registry)
+    registry.start_request()
+    with engine.connect() as connection:
+        connection.execute('SELECT 1').fetchall()
+    registry.end_request('/')
+    report = registry.snapshot()
+    assert report['db_query']['SELECT']['count'] == 1
+    assert sum(series['count'] for series in report['pool_checkout'].values()) == 1
+    assert report['route_db']['/']['sum_ms'] > 0
+
+
+def test_happy_short_lived_threads():
+    """
+    Happy path to check that the shards of threads that exited are folded into one total instead of piling up, one
+    per request of a thread-per-request server
+    """
+    registry = rm.MetricsRegistry()
+    for i in range(200):
+        thread = threading.Thread(target=lambda: registry.observe('route', '/', 1.5, error=i % 2))
+        thread.start()
+        thread.join()
+        assert len(registry._shards) <= 1
+    report = registry.snapshot()
+    assert report['route']['/']['count'] == 200 and report['route']['/']['errors'] == 100
+    assert registry._shards == []
+
+
+def test_happy_reset():
+    """
+    Happy path to check that a reset drops the recorded values without clearing the shard a thread is writing to
+    """
+    registry = rm.MetricsRegistry()
+    registry.observe('route', '/', 1.5)
+    shard = registry._shard()
+    registry.reset()
+    assert registry.snapshot() == {}
+    assert shard[('route', '/')][0] == 1
+    registry.observe('route', '/', 1.5)
+    thread = threading.Thread(target=lambda: registry.observe('route', '/', 1.5))
+    thread.start()
+    thread.join()
+    assert registry.snapshot()['route']['/']['count'] == 2 and shard[('route', '/')][0] == 1
+
+
+def test_unhappy_errors_counted():
+    """
+    Unhappy path to check that failed queries and requests answered with the error page are counted as errors
+    """
+    registry = rm.MetricsRegistry()
+    engine = sql.create_engine('sqlite://')
+    rm.instrument_engine(engine, registry)
+    registry.start_request()
+    try:
+        engine.execute('SELECT * FROM missing_table')
+    except sql.exc.OperationalError:
+        registry.mark_error()
+    registry.end_request('/')
+    report = registry.snapshot()
+    assert report['db_query']['ERROR']['errors'] == 1
+    assert report['route']['/']['errors'] == 1
+    assert 'hc_app_route_errors_total{name="/"} 1' in rm.prometheus_text(report)
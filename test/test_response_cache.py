@@ -0,0 +1,49 @@
+import src.response_cache as rc
+
+
+class FakeClock(object):
+    """Clock advanced by hand"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_happy_lru_eviction():
+    """
+    Happy path to check that the least recently used key is evicted and hits/misses are counted
+    """
+    cache = rc.LRUCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is rc.MISSING
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == dict(size=2, maxsize=2, hits=3, misses=1, evictions=1, invalidations=0)
+
+
+def test_happy_ttl_expiry():
+    """
+    Happy path to check that entries expire after ttl seconds
+    """
+    clock = FakeClock()
+    cache = rc.LRUCache(maxsize=10, ttl=5, clock=clock)
+    cache.put('a', None)
+    clock.now = 4.9
+    assert cache.get('a') is None
+    clock.now = 5.0
+    assert cache.get('a') is rc.MISSING
+    assert len(cache) == 0
+
+
+def test_unhappy_version_change():
+    """
+    Unhappy path to check that a new model or table version invalidates every cached entry
+    """
+    cache = rc.LRUCache(maxsize=10, ttl=60)
+    cache.put('a', 1, version=(1, 100.0))
+    assert cache.get('a', version=(1, 100.0)) == 1
+    assert cache.get('a', version=(2, 100.0)) is rc.MISSING
+    assert cache.stats()['invalidations'] == 1
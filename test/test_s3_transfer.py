@@ -0,0 +1,187 @@
+import io
+import gzip
+import time
+import hashlib
+import boto3
+import pytest
+import pandas as pd
+from botocore.stub import Stubber
+from botocore.response import StreamingBody
+import src.s3_transfer as st
+import src.write_to_s3 as ws
+import src.read_from_s3 as rs
+import src.clean_data as cd
+
+DATA = b'age,sex,chest_pain\n63,1,3\n37,1,2\n'
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """S3 client answering from a Stubber instead of AWS, without sleeping between retries"""
+    monkeypatch.setattr(st.time, 'sleep', lambda seconds: None)
+    client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    with Stubber(client) as stubber:
+        client.stubber = stubber
+        yield client
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def raw_file(tmp_path):
+    path = tmp_path / 'heart.csv'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def test_happy_upload_skips_unchanged(s3, raw_file):
+    """
+    Happy path to check that nothing is uploaded when the object's sha256 metadata matches the file
+    """
+    s3.stubber.add_response('head_object', {'Metadata': {'sha256': SHA256}, 'ContentLength': len(DATA)},
+                            {'Bucket': 'bucket', 'Key': 'heart.csv'})
+    assert ws.write_to_s3(raw_file, 'bucket', MAX_CONCURRENCY=1, s3=s3) is False
+
+
+def test_happy_upload_retries(s3, raw_file):
+    """
+    Happy path to check that a throttled upload is retried and that the file's sha256 is stored as metadata
+    """
+    puts = []
+    s3.meta.events.register('before-parameter-build.s3.PutObject', lambda params, **kwargs: puts.append(params))
+    s3.stubber.add_client_error('head_object', '404', http_status_code=404)
+    s3.stubber.add_client_error('put_object', 'SlowDown', http_status_code=503)
+    s3.stubber.add_response('put_object', {'ETag': '"%s"' % hashlib.md5(DATA).hexdigest()})
+    assert ws.write_to_s3(raw_file, 'bucket', MAX_CONCURRENCY=1, s3=s3) is True
+    assert len(puts) == 2 and puts[-1]['Key'] == 'heart.csv' and puts[-1]['Metadata'] == {'sha256': SHA256}
+
+
+def test_happy_download_skips_unchanged(s3, raw_file):
+    """
+    Happy path to check that nothing is downloaded when the local file matches the object's single-part ETag
+    """
+    s3.stubber.add_response('head_object', {'ETag': '"%s"' % hashlib.md5(DATA).hexdigest(),
+                                            'ContentLength': len(DATA)})
+    assert rs.read_from_s3('bucket', raw_file.rsplit('/', 1)[0], MAX_CONCURRENCY=1, s3=s3) is False
+
+
+def test_happy_download_changed(s3, tmp_path):
+    """
+    Happy path to check that an object whose checksum differs from the local file is downloaded
+    """
+    (tmp_path / 'heart.csv').write_bytes(DATA[:-4] + b'9,9\n')
+    head = {'Metadata': {'sha256': SHA256}, 'ContentLength': len(DATA), 'ETag': '"etag"'}
+    s3.stubber.add_response('head_object', head)
+    s3.stubber.add_response('head_object', head)
+    s3.stubber.add_response('get_object', dict(head, Body=StreamingBody(io.BytesIO(DATA), len(DATA))))
+    assert rs.read_from_s3('bucket', str(tmp_path), MAX_CONCURRENCY=1, s3=s3) is True
+    assert (tmp_path / 'heart.csv').read_bytes() == DATA
+
+
+def test_unhappy_upload_access_denied(s3, raw_file):
+    """
+    Unhappy path to check that errors which are not transient are not retried and stop the step
+    """
+    s3.stubber.add_client_error('head_object', 'AccessDenied', http_status_code=403)
+    with pytest.raises(SystemExit):
+        ws.write_to_s3(raw_file, 'bucket', MAX_CONCURRENCY=1, s3=s3)
+
+
+def test_happy_multipart_etag(tmp_path):
+    """
+    Happy path to check the ETag computed for a file uploaded in parts
+    """
+    path = tmp_path / 'big.csv'
+    path.write_bytes(b'x' * (11 * st.MB))
+    sha256, etag = st.file_checksums(str(path), st.transfer_config(5, 5))
+    part_md5s = [hashlib.md5(b'x' * 5 * st.MB).digest()] * 2 + [hashlib.md5(b'x' * st.MB).digest()]
+    assert etag == '%s-3' % hashlib.md5(b''.join(part_md5s)).hexdigest()
+
+
+class PrefixStandIn(object):
+    """Minimal thread-safe stand-in for the list_objects_v2 paginator and get_object of an S3 client"""
+    def __init__(self, objects, latency=0.0):
+        self.objects = objects
+        self.latency = latency
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        return [{'Contents': [{'Key': key, 'ETag': '"%s"' % hashlib.md5(self.objects[key]).hexdigest(),
+                               'Size': len(self.objects[key])} for key in keys[i:i + 2]]}
+                for i in range(0, len(keys), 2)]
+
+    def get_object(self, Bucket, Key):
+        time.sleep(self.latency)
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+def partitions(n_files):
+    """Daily partition files of the raw data, one of them gzipped, plus a file that is not data"""
+    objects = {'raw/day=%02d/heart.csv' % day: DATA.replace(b'63', str(day).encode()) for day in range(n_files)}
+    objects['raw/day=00/heart.csv.gz'] = gzip.compress(objects.pop('raw/day=00/heart.csv'))
+    objects['raw/_SUCCESS'] = b''
+    return objects
+
+
+def test_happy_read_s3_prefix():
+    """
+    Happy path to check that all partition files are parsed in key order into one dataframe, concurrently
+    """
+    s3 = PrefixStandIn(partitions(16), latency=0.05)
+    start = time.perf_counter()
+    df = rs.read_s3_prefix('bucket', 'raw/', MAX_CONCURRENCY=16, s3=s3)
+    assert time.perf_counter() - start < 0.05 * 16 / 2
+    assert len(df) == 32 and list(df.columns) == ['age', 'sex', 'chest_pain']
+    assert df['age'].tolist()[::2] == list(range(16))
+
+
+def test_unhappy_read_s3_prefix_empty():
+    """
+    Unhappy path to check that an empty prefix stops the step
+    """
+    with pytest.raises(SystemExit):
+        rs.read_s3_prefix('bucket', 'missing/', s3=PrefixStandIn(partitions(2)))
+
+
+def test_happy_iter_csv_chunks_s3():
+    """
+    Happy path to check that partition files are streamed from the object bodies in chunks, in key order
+    """
+    chunks = list(rs.iter_csv_chunks('s3://bucket/raw/', 1, s3=PrefixStandIn(partitions(3))))
+    assert [len(chunk) for chunk in chunks] == [1] * 6
+    assert [chunk['age'].iloc[0] for chunk in chunks] == [0, 37, 1, 37, 2, 37]
+
+
+def test_happy_clean_data_streaming_s3(tmp_path):
+    """
+    Happy path to check that an s3:// input is cleaned in chunks like the same rows read from a local file
+    """
+    col_names = ['age', 'sex', 'chest_pain', 'blood_pressure', 'serum_cholesterol', 'fasting_blood_sugar',
+                 'electrocardiographic', 'max_heart_rate', 'induced_angina', 'ST_depression',
+                 'slope', 'no_of_vessels', 'thal', 'diagnosis']
+    valid_ranges = {'age': [1, 120], 'sex': [0, 1], 'thal': [0, 3]}
+    raw = pd.DataFrame([[20, 1, 0, 80, 150, 0, 1, 180, 0, 213, 0, 0, 0, 0],
+                        [170, 1, 1, 180, 500, 0, 0, 167, 1, 213, 1, 2, 1, 0],
+                        [40, 0, 2, 120, 620, 1, 2, 174, 1, 227, 0, 2, 1, 1],
+                        [72, 0, 0, 90, 430, 0, 1, 155, 2, 197, 1, 4, 5, 1]], columns=col_names)
+    objects = {'raw/day=01/heart.csv': raw[:2].to_csv(index=False).encode(),
+               'raw/day=02/heart.csv': raw[2:].to_csv(index=False).encode()}
+    raw.to_csv(tmp_path / 'raw.csv', index=False)
+
+    n_rows = cd.clean_data_streaming('s3://bucket/raw/', str(tmp_path / 's3.csv'), col_names, valid_ranges,
+                                     chunksize=3, s3=PrefixStandIn(objects))
+    cd.clean_data_streaming(str(tmp_path / 'raw.csv'), str(tmp_path / 'local.csv'), col_names, valid_ranges,
+                            chunksize=3)
+    assert n_rows == 4
+    assert pd.read_csv(tmp_path / 's3.csv').equals(pd.read_csv(tmp_path / 'local.csv'))
+
+
+def test_unhappy_iter_csv_chunks_s3_empty():
+    """
+    Unhappy path to check that streaming an empty prefix stops the step
+    """
+    with pytest.raises(SystemExit):
+        list(rs.iter_csv_chunks('s3://bucket/missing/', 10, s3=PrefixStandIn(partitions(2))))
@@ -0,0 +1,46 @@
+import yaml
+import numpy as np
+import pandas as pd
+import pytest
+import src.build_models as bm
+import src.score_data as sd
+import src.scoring_grid as sg
+
+
+def test_happy_grid_blocks():
+    """
+    Happy path to check the grid order (last column fastest), steps and value lists, and that blocks cover the grid
+    """
+    spec = dict(age=[40, 41], sex={'values': [0, 1]}, ST_depression=[0.0, 1.0, 0.5])
+    grid = sg.build_grid(spec)
+    assert list(grid.columns) == ['age', 'sex', 'ST_depression'] and len(grid) == 12
+    assert grid.iloc[:4].values.tolist() == [[40, 0, 0.0], [40, 0, 0.5], [40, 0, 1.0], [40, 1, 0.0]]
+    assert grid['age'].dtype == np.int64
+    blocks = list(sg.iter_grid(spec, block_size=5))
+    assert [len(block) for block in blocks] == [5, 5, 2]
+    assert pd.concat(blocks, ignore_index=True).equals(grid)
+
+
+def test_happy_score_grid(tmp_path):
+    """
+    Happy path to check that scoring the grid block by block gives the same file as scoring the whole grid at once
+    """
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    model = bm.build_models(pd.read_csv('data/interim_files/clean_data.csv'), **config['build_models'])[-1]
+    spec = config['score_data']['grid']
+    assert sd.score_grid(spec, model, str(tmp_path / 'scored.csv'), block_size=10000) == 92160
+    expected = sd.score_data(sg.build_grid(spec), model)
+    assert pd.read_csv(str(tmp_path / 'scored.csv')).equals(expected)
+
+
+def test_unhappy_grid_spec():
+    """
+    Unhappy path to check that malformed or empty columns are rejected
+    """
+    with pytest.raises(ValueError):
+        sg.grid_axes(dict(age=[40]))
+    with pytest.raises(ValueError):
+        sg.grid_axes(dict(age=[41, 40]))
+    with pytest.raises(SystemExit):
+        next(sg.iter_grid(dict(age={'values': []})))
@@ -0,0 +1,84 @@
+import os
+import multiprocessing
+import pandas as pd
+import pytest
+import src.prediction_cube as pc
+import src.shared_cube as sc
+
+
+def scored_df():
+    """Small scored grid in the layout of scored_data.csv"""
+    return pd.DataFrame([[40, 0, 0, 0, 0, 0, 1, 56.16, 1],
+                         [40, 1, 0, 0, 0, 0, 1, 38.03, 0],
+                         [41, 0, 3, 1, 2, 2, 3, 50.0, 1]],
+                        columns=['age', 'sex', 'chest_pain', 'fasting_blood_sugar',
+                                 'electrocardiographic', 'induced_angina', 'thal', 'y_prob', 'y_bin'])
+
+
+def lookup_in_worker(directory, values):
+    """Looks up a prediction from the shared segment in another process"""
+    return sc.SharedPredictionCube(directory, 'test').lookup(values)
+
+
+def test_happy_shared_cube(tmp_path):
+    """
+    Happy path to check that a published table is mapped without copy, answers lookups in other processes, and that
+    readers swap to a republished table while its previous segment is removed
+    """
+    directory = str(tmp_path)
+    shared = sc.SharedPredictionCube(directory, 'test', check_interval=0)
+    builds = []
+    cube = shared.publish(lambda: builds.append(1) or pc.PredictionCube.from_frame(scored_df()), model_version=3,
+                          fingerprint=((1, 3), 3))
+    assert cube.lookup((40, 1, 0, 0, 0, 0, 1)) == [pc.Prediction(y_prob='38.03', y_bin=0)]
+    assert cube.n_rows == 3 and shared.model_version == 3
+    assert not cube.y_prob_bp.flags.writeable and not cube.y_prob_bp.flags.owndata
+
+    # Another worker finds the table already published and does not build it again
+    other = sc.SharedPredictionCube(directory, 'test', check_interval=0)
+    other.publish(lambda: builds.append(1), fingerprint=((1, 3), 3))
+    assert len(builds) == 1 and other.generation == shared.generation and other.fingerprint == [[1, 3], 3]
+    with multiprocessing.Pool(1) as pool:
+        assert pool.apply(lookup_in_worker, (directory, (41, 0, 3, 1, 2, 2, 3))) == \
+            [pc.Prediction(y_prob='50.0', y_bin=1)]
+
+    df = scored_df()
+    df['y_prob'] = [10.5, 20.5, 30.5]
+    generation = shared.generation
+    # The table was loaded again: the first worker to see the new version republishes it
+    shared.publish(lambda: pc.PredictionCube.from_frame(df), fingerprint=((2, 3), 3))
+    assert other.lookup((40, 0, 0, 0, 0, 0, 1)) == [pc.Prediction(y_prob='10.5', y_bin=1)]
+    assert other.generation != generation
+    assert cube.lookup((40, 0, 0, 0, 0, 0, 1)) == [pc.Prediction(y_prob='56.16', y_bin=1)]
+    assert len([name for name in os.listdir(directory) if name.endswith('.seg')]) == 1
+    assert shared.publish(lambda: builds.append(1), fingerprint=((2, 3), 3)) is not None and len(builds) == 1
+
+
+def test_unhappy_shared_cube(tmp_path):
+    """
+    Unhappy path to check that nothing is looked up before a table is published, that a corrupted segment is
+    rejected while readers keep the table they mapped, and that a stale segment is replaced instead of attached
+    """
+    directory = str(tmp_path)
+    shared = sc.SharedPredictionCube(directory, 'test', check_interval=0)
+    assert shared.cube() is None and shared.lookup((40, 0, 0, 0, 0, 0, 1)) is None
+    assert shared.publish(lambda: None) is None
+
+    shared.publish(lambda: pc.PredictionCube.from_frame(scored_df()))
+    with open(os.path.join(directory, 'test.bad.seg'), 'wb') as file:
+        file.write(b'not a segment' * 10)
+    with pytest.raises(ValueError):
+        sc.attach_segment(os.path.join(directory, 'test.bad.seg'))
+    with open(os.path.join(directory, 'test.current'), 'w') as file:
+        file.write('test.bad.seg')
+    assert shared.lookup((40, 0, 0, 0, 0, 0, 1)) == [pc.Prediction(y_prob='56.16', y_bin=1)]
+
+    # A segment left by an earlier deployment, from another table or model, is not attached
+    stale = scored_df()
+    stale['y_prob'] = [1.5, 2.5, 3.5]
+    sc.SharedPredictionCube(directory, 'stale').publish(lambda: pc.PredictionCube.from_frame(stale),
+                                                        fingerprint=((1, 3), 1))
+    restarted = sc.SharedPredictionCube(directory, 'stale')
+    restarted.publish(lambda: pc.PredictionCube.from_frame(scored_df()), fingerprint=((1, 3), 2))
+    assert restarted.lookup((40, 0, 0, 0, 0, 0, 1)) == [pc.Prediction(y_prob='56.16', y_bin=1)]
+    assert restarted.fingerprint == [[1, 3], 2]